@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Registry of processed sources.
+
+`/process-audio` registers each downloaded source under an asset id, so later
+calls (`/split-audio`, `/waveform`, ...) work on the same file instead of
+fetching it again. The id is derived from the content hash, so processing the
+same audio twice yields the same asset. Each asset is a hard link (or copy) of
+the source plus a JSON record in `root`, so any worker process can resolve it
+and download-cache eviction cannot pull the file out from under it.
+
+Assets expire `ttl` seconds after their last use. A disk quota covers the
+assets together with the scratch directories holding exported segments,
+oldest files first, and scratch files older than the TTL are removed too.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import disk_lru
+
+ASSET_ID_RE = re.compile(r'^[0-9a-f]{24}$')
+
+
+class AssetRegistry:
+    SWEEP_INTERVAL = 60  # Seconds between expiry/quota sweeps triggered by lookups
+
+    def __init__(self, root, ttl=6 * 3600, max_bytes=8 * 1024 ** 3, scratch_dirs=()):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.scratch_dirs = list(scratch_dirs)
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._swept_at = 0.0
+
+    def _record_path(self, asset_id):
+        return os.path.join(self.root, f"{asset_id}.json")
+
+    def register(self, source_path, content_hash, **info):
+        """Register a source file; returns the asset record"""
+        asset_id = content_hash[:24]
+        existing = self.get(asset_id)
+        if existing is not None:
+            return existing
+
+        ext = os.path.splitext(source_path)[1]
+        path = os.path.join(self.root, f"{asset_id}{ext}")
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(source_path, tmp)
+        except OSError:
+            shutil.copyfile(source_path, tmp)  # Different filesystem
+        os.replace(tmp, path)
+
+        record = {**info, 'asset_id': asset_id, 'path': path, 'content_hash': content_hash,
+                  'created_at': time.time()}
+        tmp = f"{self._record_path(asset_id)}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(record, f)
+        os.replace(tmp, self._record_path(asset_id))
+
+        self.sweep(protect={asset_id})
+        return record
+
+    def get(self, asset_id):
+        """Asset record, or None if unknown or expired; extends its lifetime"""
+        if not asset_id or not ASSET_ID_RE.match(asset_id):
+            return None
+        self._maybe_sweep()
+        try:
+            with open(self._record_path(asset_id)) as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if not os.path.exists(record['path']):
+            return None
+        disk_lru.touch(record['path'])
+        disk_lru.touch(self._record_path(asset_id))
+        return record
+
+    def owns(self, path):
+        """True if `path` is a registered source file"""
+        path, root = os.path.realpath(path), os.path.realpath(self.root)
+        return os.path.commonpath([path, root]) == root and os.path.isfile(path)
+
+    def _maybe_sweep(self):
+        with self._lock:
+            if time.time() - self._swept_at < self.SWEEP_INTERVAL:
+                return
+            self._swept_at = time.time()
+        self.sweep()
+
+    def sweep(self, protect=()):
+        """Drop expired assets and scratch files, then enforce the disk quota"""
+        cutoff = time.time() - self.ttl
+        disk_lru.remove_stale_partials(self.root)
+
+        # (last_used, size, paths) for every asset and every scratch file
+        entries = []
+        for key, (last_used, size, paths) in disk_lru.scan(self.root).items():
+            entries.append((last_used, size, paths, key in protect))
+        for scratch in self.scratch_dirs:
+            for key, (last_used, size, paths) in disk_lru.scan(scratch).items():
+                entries.append((last_used, size, paths, False))
+
+        total = sum(size for _, size, _, _ in entries)
+        for last_used, size, paths, protected in sorted(entries, key=lambda e: e[0]):
+            if protected or (last_used >= cutoff and total <= self.max_bytes):
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
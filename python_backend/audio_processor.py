@@ -6,190 +6,803 @@ and precise audio splitting.
 
 import os
 import sys
+import atexit
+import shutil
+import hashlib
 import json
-import librosa
+import contextvars
+import queue
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from matplotlib.backends.backend_agg import FigureCanvasAgg
-import io
-import base64
-from pydub import AudioSegment
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 import tempfile
+import threading
+import time
 import uuid
-import yt_dlp
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import quote
+from werkzeug.exceptions import NotFound
+
+from asset_registry import AssetRegistry
+from download_cache import DownloadCache
+import ingest
+import limits
+import metrics
+from metadata_cache import MetadataCache
+from pcm_store import AudioStream, PCMStore, mono_mix
+from jobs import JobManager, no_progress
+from segment_cache import SegmentCache
+from segment_export import ENCODER_SETTINGS, SegmentExporter
+import segment_stats
+import spectrogram_tiles
+from spectrogram_tiles import SpectrogramTiles
+from split_suggest import DEFAULTS as SUGGEST_DEFAULTS, suggest_splits
+from stream_copy import split_copy
+from waveform_codec import ENCODINGS, MIMETYPE as PEAKS_MIMETYPE, encode_overview, encode_peaks, to_base64
+from waveform_peaks import STREAM_MAX_BUCKETS, PeakPyramid, overview
+from waveform_images import BaseImage, WaveformImageCache
+from waveform_render import THEME, THEMES, draw_markers, encode_png, plot_rect, render_base, to_data_uri
+from zip_stream import ZipStream, safe_arcname
+
+# Decoded PCM outlives the per-process temp dir so restarted workers reuse it
+PCM_STORE_DIR = os.environ.get('AUDIO_PCM_STORE_DIR',
+                               os.path.join(tempfile.gettempdir(), 'audio_splitter_pcm'))
+PCM_STORE_MAX_BYTES = int(os.environ.get('AUDIO_PCM_STORE_MAX_BYTES', 4 * 1024 ** 3))
+# Downloaded sources, keyed by extractor + media id and shared by all workers
+DOWNLOAD_CACHE_DIR = os.environ.get('AUDIO_DOWNLOAD_CACHE_DIR',
+                                    os.path.join(tempfile.gettempdir(), 'audio_splitter_downloads'))
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_DOWNLOAD_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Registered sources for /split-audio etc.: lifetime after last use and a disk quota that
+# also covers exported segments in the temp dir
+ASSETS_DIR = os.environ.get('AUDIO_ASSETS_DIR', os.path.join(tempfile.gettempdir(), 'audio_splitter_assets'))
+ASSET_TTL = int(os.environ.get('AUDIO_ASSET_TTL', 6 * 3600))
+ASSET_MAX_BYTES = int(os.environ.get('AUDIO_ASSET_MAX_BYTES', 8 * 1024 ** 3))
+# /metadata results: seconds to keep them, how many URLs, and batch concurrency
+METADATA_TTL = int(os.environ.get('AUDIO_METADATA_TTL', 6 * 3600))
+METADATA_MAX_ENTRIES = int(os.environ.get('AUDIO_METADATA_MAX_ENTRIES', 512))
+METADATA_WORKERS = int(os.environ.get('AUDIO_METADATA_WORKERS', 4))
+METADATA_BATCH_MAX = 50
+SPLIT_BATCH_MAX_SOURCES = 50
+SPLIT_NAME_TEMPLATE = '{title}/{index:02d} - {name}.{ext}'
+# 'memory' builds peaks from the PCM store, 'stream' decodes block by block with flat memory
+WAVEFORM_MODE = os.environ.get('AUDIO_WAVEFORM_MODE', 'memory')
+WAVEFORM_MODES = ('memory', 'stream')
+# Size of the fast-rendered waveform image, matching the old 12x4in figure at 150 dpi
+IMAGE_WIDTH = 1800
+IMAGE_HEIGHT = 600
+# Processes encoding split segments in parallel (default: one per core)
+EXPORT_WORKERS = int(os.environ.get('AUDIO_EXPORT_WORKERS', 0)) or os.cpu_count() or 1
+# Encoded segments by (source content, frame range, format, encoder settings), so a
+# re-split only encodes the segments whose boundaries moved
+SEGMENT_CACHE_DIR = os.environ.get('AUDIO_SEGMENT_CACHE_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'audio_splitter_segments'))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('AUDIO_SEGMENT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Seconds browsers may reuse a downloaded segment; segment files never change once written
+SEGMENT_MAX_AGE = 3600
+
+# Rendered waveform images without markers, per worker process
+IMAGE_CACHE_BYTES = int(os.environ.get('AUDIO_IMAGE_CACHE_BYTES', 64 * 1024 ** 2))
+IMAGE_MAX_AGE = 3600
+SPECTROGRAM_CACHE_BYTES = int(os.environ.get('AUDIO_SPECTROGRAM_CACHE_BYTES', 64 * 1024 ** 2))
+TILE_MAX_AGE = 24 * 3600  # Tiles only change with the source content, which their ETag names
+# Concurrent downloads, CPU-bound stages (decode, peaks, rendering, analysis) and
+# segment encodes per worker process. Requests queue for a slot up to
+# AUDIO_QUEUE_TIMEOUT seconds, at most AUDIO_QUEUE_DEPTH at a time, before a 429.
+DOWNLOAD_SLOTS = int(os.environ.get('AUDIO_DOWNLOAD_SLOTS', 4))
+CPU_SLOTS = int(os.environ.get('AUDIO_CPU_SLOTS', 0)) or os.cpu_count() or 1
+ENCODE_SLOTS = int(os.environ.get('AUDIO_ENCODE_SLOTS', 2))
+QUEUE_TIMEOUT = float(os.environ.get('AUDIO_QUEUE_TIMEOUT', 10))
+QUEUE_DEPTH = int(os.environ.get('AUDIO_QUEUE_DEPTH', 16))
+# Background jobs for /jobs/*: worker threads and state shared between processes
+JOB_WORKERS = int(os.environ.get('AUDIO_JOB_WORKERS', 2))
+JOBS_DIR = os.environ.get('AUDIO_JOBS_DIR', os.path.join(tempfile.gettempdir(), 'audio_splitter_jobs'))
 
 app = Flask(__name__)
 CORS(app)
 
+class ProcessingError(Exception):
+    """A pipeline stage failed; the message is safe to return to the client"""
+
+class UnknownAsset(ProcessingError):
+    """An asset id that was never registered or has expired"""
+
 class AudioProcessor:
+    MAX_CACHED_PYRAMIDS = 8
+
     def __init__(self):
         self.temp_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        self.download_limiter = limits.Limiter('download', DOWNLOAD_SLOTS, QUEUE_DEPTH, QUEUE_TIMEOUT)
+        self.cpu_limiter = limits.Limiter('cpu', CPU_SLOTS, QUEUE_DEPTH, QUEUE_TIMEOUT)
+        self.encode_limiter = limits.Limiter('encode', ENCODE_SLOTS, QUEUE_DEPTH, QUEUE_TIMEOUT)
+        self.assets = AssetRegistry(ASSETS_DIR, ASSET_TTL, ASSET_MAX_BYTES, scratch_dirs=[self.temp_dir])
+        self.download_cache = DownloadCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES, self.download_limiter)
+        self.pcm_store = PCMStore(PCM_STORE_DIR, PCM_STORE_MAX_BYTES, self.cpu_limiter)
+        self.exporter = SegmentExporter(EXPORT_WORKERS)
+        self.segment_cache = SegmentCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+        self.spectrograms = SpectrogramTiles(SPECTROGRAM_CACHE_BYTES, self.cpu_limiter)
+        self.images = WaveformImageCache(IMAGE_CACHE_BYTES)
+        self._pyramids = OrderedDict()
+        self._pyramid_lock = threading.Lock()
         
-    def download_audio(self, url):
-        """Download audio from URL using yt-dlp"""
+    def download_audio(self, url, progress=no_progress):
+        """Download audio from URL using yt-dlp, reusing cached downloads"""
         try:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': os.path.join(self.temp_dir, '%(title)s.%(ext)s'),
-                'extractaudio': True,
-                'audioformat': 'mp3',
-                'noplaylist': True,
-            }
+            filename, meta, hit = self.download_cache.get(
+                url, lambda scratch_dir: self._fetch_audio(url, scratch_dir, progress))
+            metrics.cache_result('download', hit)
+            if hit:
+                progress('download', 1, 1)
+            return filename, meta.get('duration', 0)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                # Convert to mp3 if needed
-                if not filename.endswith('.mp3'):
-                    audio = AudioSegment.from_file(filename)
-                    mp3_filename = filename.rsplit('.', 1)[0] + '.mp3'
-                    audio.export(mp3_filename, format='mp3')
-                    os.remove(filename)  # Remove original file
-                    filename = mp3_filename
-                
-                return filename, info.get('duration', 0)
-                
+        except limits.Overloaded:
+            raise
         except Exception as e:
             print(f"Download error: {e}")
             return None, 0
+    
+    def _fetch_audio(self, url, out_dir, progress=no_progress):
+        """
+        Download one URL into `out_dir` in its native container; returns (filename, meta).
+
+        Plain HTTP(S) media is decoded and analyzed while it downloads (see
+        ingest.py); anything else, or a failed pipelined fetch, goes through
+        yt-dlp's own downloader.
+        """
+        def report_download(d):
+            if d.get('status') == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                progress('download', d.get('downloaded_bytes', 0), total)
+        
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(out_dir, '%(id)s.%(ext)s'),
+            'noplaylist': True,
+            'progress_hooks': [report_download],
+        }
         
-    def generate_waveform_data(self, audio_file_path):
+        import yt_dlp
+        
+        with self.download_limiter.slot(), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            filename = ydl.prepare_filename(info)
+            fetched = None
+            media = ingest.direct_media(info)
+            if media:
+                try:
+                    with metrics.stage('ingest') as stage:
+                        fetched = ingest.ingest(ingest.fetch_chunks(*media), filename, self.pcm_store.root,
+                                                info.get('duration'), progress)
+                        stage.add_bytes(fetched['bytes'])
+                except ingest.IngestError as e:
+                    print(f"Pipelined download failed, using yt-dlp: {e}")
+            
+            if fetched is None:
+                with metrics.stage('download') as stage:
+                    info = ydl.process_ie_result(info, download=True)
+                    filename = ydl.prepare_filename(info)
+                    stage.add_bytes(os.path.getsize(filename))
+                duration = info.get('duration', 0)
+            else:
+                duration = self._adopt_ingested(filename, fetched) or info.get('duration', 0)
+            
+            return filename, {'duration': duration, 'title': info.get('title')}
+    
+    def _adopt_ingested(self, filename, fetched):
+        """Hand PCM and peaks decoded during the download to the caches; returns the duration if known"""
+        key = fetched['sha256']
+        self.pcm_store.remember_hash(filename, key)
+        if not fetched['pcm_path']:
+            return None
+        pcm = self.pcm_store.adopt(key, fetched['pcm_path'], fetched['sample_rate'],
+                                   fetched['channels'], fetched['frames'])
+        pyramid = fetched['pyramid']
+        pyramid.samples = pcm.mono  # Exact edge queries read the stored PCM
+        self._cache_pyramid(key, pyramid)
+        return pcm.duration
+    
+    def owns_file(self, path):
+        """True if `path` is a file inside the temp dir, the download cache or the asset registry"""
+        if self.assets.owns(path):
+            return True
+        path = os.path.realpath(path)
+        for root in (self.temp_dir, self.download_cache.root):
+            root = os.path.realpath(root)
+            if os.path.commonpath([path, root]) == root and os.path.isfile(path):
+                return True
+        return False
+    
+    def register_asset(self, audio_file_path, **info):
+        """Register a downloaded source so later requests can refer to it by id"""
+        return self.assets.register(audio_file_path, self.pcm_store.content_hash(audio_file_path), **info)
+    
+    def resolve_asset(self, asset_id):
+        """Source file path for an asset id"""
+        asset = self.assets.get(asset_id)
+        metrics.cache_result('asset', asset is not None)
+        if asset is None:
+            raise UnknownAsset(f'Unknown or expired asset: {asset_id}')
+        return asset['path']
+    
+    def get_peak_pyramid(self, audio_file_path):
+        """Return the peak pyramid for a file, building it on first use"""
+        pcm = self.pcm_store.get(audio_file_path)
+        key = pcm.key
+        with self._pyramid_lock:
+            pyramid = self._pyramids.get(key)
+            metrics.cache_result('pyramid', pyramid is not None)
+            if pyramid is not None:
+                self._pyramids.move_to_end(key)
+                return pyramid
+
+        with self.cpu_limiter.slot(), metrics.stage('peaks', pcm.frames * pcm.channels * 4):
+            pyramid = PeakPyramid.from_blocks(pcm.mono_blocks(), pcm.sample_rate, samples=pcm.mono)
+        self._cache_pyramid(key, pyramid)
+        return pyramid
+
+    def _cache_pyramid(self, key, pyramid):
+        with self._pyramid_lock:
+            self._pyramids[key] = pyramid
+            self._pyramids.move_to_end(key)
+            while len(self._pyramids) > self.MAX_CACHED_PYRAMIDS:
+                self._pyramids.popitem(last=False)
+
+    def stream_peak_pyramid(self, audio_file_path):
+        """Build a peak pyramid straight from the decoder, one block at a time"""
+        with self.cpu_limiter.slot(), metrics.stage('peaks_stream', os.path.getsize(audio_file_path)), \
+                AudioStream(audio_file_path) as stream:
+            blocks = (mono_mix(block) for block in stream.blocks())
+            return PeakPyramid.from_blocks(blocks, stream.sample_rate,
+                                           max_buckets=STREAM_MAX_BUCKETS)
+
+    def generate_waveform_data(self, audio_file_path, mode=None, progress=no_progress, as_lists=True):
         """Generate clean waveform data for visualization"""
         try:
-            # Load audio file
-            y, sr = librosa.load(audio_file_path, sr=None)
-            duration = len(y) / sr
-            
-            # Generate waveform data
-            times = np.linspace(0, duration, len(y))
+            mode = mode or WAVEFORM_MODE
+            if mode not in WAVEFORM_MODES:
+                raise ValueError(f"Unknown waveform mode: {mode}")
             
-            # Downsample for visualization (reduce data points)
-            downsample_factor = max(1, len(y) // 2000)  # Max 2000 points
-            y_downsampled = y[::downsample_factor]
-            times_downsampled = times[::downsample_factor]
+            progress('decode')
+            if mode == 'stream':
+                pyramid = self.stream_peak_pyramid(audio_file_path)
+            else:
+                pyramid = self.get_peak_pyramid(audio_file_path)
             
+            # Max 2000 min/max buckets over the whole file
+            with metrics.stage('overview'):
+                return overview(pyramid, points=2000, as_lists=as_lists)
+        except limits.Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error generating waveform data: {e}")
+            return None
+
+    def query_waveform(self, audio_file_path, start=0.0, end=None, width=1000, encoding=None,
+                       compress=False):
+        """
+        Return min/max/RMS peak buckets for a zoom window in seconds.
+
+        With `encoding` ('int8' or 'int16') the peaks come back as a packed
+        binary payload instead of a dict of float lists.
+        """
+        try:
+            pyramid = self.get_peak_pyramid(audio_file_path)
+            if end is None:
+                end = pyramid.duration
+            with metrics.stage('query'):
+                peaks = pyramid.query_seconds(start, end, width)
+            edges = peaks['edges']
+            if encoding:
+                spb = (edges[-1] - edges[0]) / max(len(edges) - 1, 1) if len(edges) else 0
+                return encode_peaks(peaks['min'], peaks['max'], peaks['rms'], pyramid.sample_rate,
+                                    pyramid.duration, edges[0] / pyramid.sample_rate if len(edges) else start,
+                                    spb, ENCODINGS[encoding], compress)
             return {
-                'times': times_downsampled.tolist(),
-                'amplitudes': y_downsampled.tolist(),
-                'duration': duration,
-                'sample_rate': sr,
-                'original_length': len(y)
+                'start': edges[0] / pyramid.sample_rate if len(edges) else start,
+                'end': edges[-1] / pyramid.sample_rate if len(edges) else start,
+                'width': len(peaks['min']),
+                'sample_rate': pyramid.sample_rate,
+                'duration': pyramid.duration,
+                'samples_per_bucket': (edges[-1] - edges[0]) / max(len(edges) - 1, 1) if len(edges) else 0,
+                'min': peaks['min'].tolist(),
+                'max': peaks['max'].tolist(),
+                'rms': peaks['rms'].tolist(),
             }
+        except limits.Overloaded:
+            raise
         except Exception as e:
-            print(f"Error generating waveform data: {e}")
+            print(f"Error querying waveform: {e}")
             return None
     
-    def create_waveform_image(self, audio_file_path, split_points=None):
+    def spectrogram_layout(self, audio_file_path):
+        """Zoom levels and tile counts of a file's spectrogram"""
+        pcm = self.pcm_store.get(audio_file_path)
+        return {**spectrogram_tiles.layout(pcm.frames, pcm.sample_rate), 'source_hash': pcm.key}
+    
+    def spectrogram_tile(self, audio_file_path, level, x, scale='mel', rows=128, image=True):
+        """
+        One spectrogram tile as PNG bytes, or (with image=False) in the raw
+        8-bit format; returns (data, source_hash). Raises ValueError for tiles
+        outside the file's layout.
+        """
+        pcm = self.pcm_store.get(audio_file_path)
+        levels = spectrogram_tiles.layout(pcm.frames, pcm.sample_rate)['levels']
+        if not 0 <= level < len(levels):
+            raise ValueError(f'level must be between 0 and {len(levels) - 1}')
+        if not 0 <= x < levels[level]['tiles']:
+            raise ValueError(f"x must be between 0 and {levels[level]['tiles'] - 1} at level {level}")
+        
+        with metrics.stage('spectrogram') as stage:
+            tile, valid, hit = self.spectrograms.get(pcm, level, x, scale, rows)
+            metrics.cache_result('spectrogram', hit)
+            if image:
+                data = spectrogram_tiles.encode_tile_png(tile)
+            else:
+                data = spectrogram_tiles.encode_raw(tile, valid, level, x, scale,
+                                                    levels[level]['column_seconds'])
+            stage.add_bytes(len(data))
+        return data, pcm.key
+    
+    def waveform_image_etag(self, audio_file_path, split_points=None, annotated=False,
+                            width=IMAGE_WIDTH, height=IMAGE_HEIGHT, theme='dark'):
+        """ETag of a waveform image, known without rendering it"""
+        spec = json.dumps([self.pcm_store.content_hash(audio_file_path), [float(p) for p in split_points or []],
+                           bool(annotated), width, height, theme])
+        return hashlib.sha256(spec.encode()).hexdigest()[:32]
+    
+    def waveform_png(self, audio_file_path, split_points=None, annotated=False,
+                     width=IMAGE_WIDTH, height=IMAGE_HEIGHT, theme='dark'):
+        """
+        A waveform image as (PNG bytes, ETag).
+
+        The waveform itself is rendered once per (source, size, theme, style)
+        and cached; split markers are composited onto a copy of it.
+        """
+        etag = self.waveform_image_etag(audio_file_path, split_points, annotated, width, height, theme)
+        png = self.images.png(etag)
+        if png is not None:
+            metrics.cache_result('image', True)
+            return png, etag
+        
+        key = (self.pcm_store.content_hash(audio_file_path), width, height, theme, bool(annotated))
+        base, hit = self.images.base(key, lambda: self._render_base_image(audio_file_path, annotated,
+                                                                         width, height, THEMES[theme]))
+        metrics.cache_result('image', hit)
+        with metrics.stage('composite') as stage:
+            image = base.pixels.copy()
+            draw_markers(image, split_points, base.duration, THEMES[theme], rect=base.rect)
+            png = encode_png(image)
+            stage.add_bytes(len(png))
+        self.images.store_png(etag, png)
+        return png, etag
+    
+    def _render_base_image(self, audio_file_path, annotated, width, height, theme):
+        pyramid = self.get_peak_pyramid(audio_file_path)
+        if annotated:
+            with self.cpu_limiter.slot(), metrics.stage('render_annotated'):
+                return self._annotated_base_image(pyramid, width, height, theme)
+        
+        with self.cpu_limiter.slot(), metrics.stage('render'):
+            # One min/max column per plot pixel, drawn straight into a pixel buffer
+            x0, _, x1, _ = plot_rect(width, height)
+            peaks = pyramid.query(0, pyramid.length, x1 - x0)
+            image = render_base(peaks['min'], peaks['max'], peaks['rms'], width, height, theme)
+            pixels = np.clip(np.round(image), 0, 255).astype(np.uint8)
+        return BaseImage(pixels, plot_rect(width, height), pyramid.duration)
+    
+    def create_waveform_image(self, audio_file_path, split_points=None, annotated=False,
+                              width=IMAGE_WIDTH, height=IMAGE_HEIGHT, progress=no_progress, theme='dark'):
         """Create a clean waveform visualization image"""
         try:
-            # Load audio
-            y, sr = librosa.load(audio_file_path, sr=None)
-            duration = len(y) / sr
-            
-            # Create figure
-            fig, ax = plt.subplots(figsize=(12, 4))
-            fig.patch.set_facecolor('#1f2937')  # Dark background
-            ax.set_facecolor('#374151')
-            
-            # Generate waveform
-            times = np.linspace(0, duration, len(y))
-            
-            # Plot waveform
-            ax.plot(times, y, color='#4F46E5', linewidth=0.8, alpha=0.8)
-            ax.fill_between(times, y, 0, color='#4F46E5', alpha=0.3)
-            
-            # Add split points if provided
-            if split_points:
-                for i, point in enumerate(split_points):
-                    if 0 <= point <= duration:
-                        ax.axvline(x=point, color='#EF4444', linewidth=2, alpha=0.8)
-                        ax.text(point, max(y) * 0.8, f'{i+1}', 
-                               color='#EF4444', fontweight='bold', fontsize=10,
-                               ha='center', va='bottom')
-            
-            # Styling
-            ax.set_xlim(0, duration)
-            ax.set_ylim(-1, 1)
-            ax.set_xlabel('Time (seconds)', color='white')
-            ax.set_ylabel('Amplitude', color='white')
-            ax.tick_params(colors='white')
-            ax.grid(True, alpha=0.3, color='white')
-            
-            # Remove top and right spines
-            ax.spines['top'].set_visible(False)
-            ax.spines['right'].set_visible(False)
-            ax.spines['bottom'].set_color('white')
-            ax.spines['left'].set_color('white')
-            
-            plt.tight_layout()
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight',
-                       facecolor='#1f2937', edgecolor='none')
-            buffer.seek(0)
-            
-            # Encode as base64
-            image_base64 = base64.b64encode(buffer.getvalue()).decode()
-            plt.close(fig)
-            
-            return f"data:image/png;base64,{image_base64}"
+            progress('render')
+            png, _ = self.waveform_png(audio_file_path, split_points, annotated, width, height, theme)
+            return to_data_uri(png)
             
+        except limits.Overloaded:
+            raise
         except Exception as e:
             print(f"Error creating waveform image: {e}")
             return None
     
-    def split_audio(self, audio_file_path, split_points, output_format='mp3'):
-        """Split audio at specified points"""
+    def _annotated_base_image(self, pyramid, width=IMAGE_WIDTH, height=IMAGE_HEIGHT, theme=THEME):
+        """Matplotlib rendering with axes, grid and labels, without split markers"""
+        # matplotlib is only needed here; importing it costs about half a second
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        
+        duration = pyramid.duration
+        peaks = pyramid.query(0, pyramid.length, width)
+        times = peaks['edges'][:-1] / pyramid.sample_rate
+        
+        # Figure rather than pyplot, so concurrent requests don't share state.
+        # At 150 dpi (12x4in for the default size) one figure unit is one pixel.
+        fig = Figure(figsize=(width / 150, height / 150), dpi=150)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        fig.patch.set_facecolor(theme['background'])
+        ax.set_facecolor(theme['plot'])
+        
+        # Plot the min/max envelope
+        ax.plot(times, peaks['max'], color=theme['waveform'], linewidth=0.8, alpha=0.8)
+        ax.plot(times, peaks['min'], color=theme['waveform'], linewidth=0.8, alpha=0.8)
+        ax.fill_between(times, peaks['min'], peaks['max'], color=theme['waveform'], alpha=0.3)
+        
+        # Styling
+        ax.set_xlim(0, duration)
+        ax.set_ylim(-1, 1)
+        ax.set_xlabel('Time (seconds)', color=theme['text'])
+        ax.set_ylabel('Amplitude', color=theme['text'])
+        ax.tick_params(colors=theme['text'])
+        ax.grid(True, alpha=0.3, color=theme['text'])
+        
+        # Remove top and right spines
+        ax.spines['top'].set_visible(False)
+        ax.spines['right'].set_visible(False)
+        ax.spines['bottom'].set_color(theme['text'])
+        ax.spines['left'].set_color(theme['text'])
+        
+        fig.tight_layout()
+        canvas.draw()
+        pixels = np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+        
+        # Axes area in image rows (top down), where markers go
+        box = ax.get_window_extent()
+        rows = pixels.shape[0]
+        rect = (int(round(box.x0)), int(round(rows - box.y1)), int(round(box.x1)), int(round(rows - box.y0)))
+        return BaseImage(pixels, rect, duration)
+    
+    def suggest_splits(self, audio_file_path, progress=no_progress, **options):
+        """Propose split points at silence gaps and timbre/energy changes"""
         try:
-            # Load audio
-            audio = AudioSegment.from_file(audio_file_path)
-            duration_ms = len(audio)
-            
-            # Convert split points to milliseconds
-            split_points_ms = [int(point * 1000) for point in split_points if 0 <= point <= duration_ms/1000]
-            
-            segments = []
-            temp_files = []
-            
-            # Create segments
-            start = 0
-            for i, end_ms in enumerate(split_points_ms + [duration_ms]):
-                if start < end_ms:
-                    segment = audio[start:end_ms]
-                    
-                    # Save segment
-                    temp_file = os.path.join(self.temp_dir, f"segment_{uuid.uuid4()}.{output_format}")
-                    segment.export(temp_file, format=output_format)
-                    temp_files.append(temp_file)
-                    
-                    segments.append({
-                        'index': i + 1,
-                        'start_time': start / 1000,
-                        'end_time': end_ms / 1000,
-                        'duration': (end_ms - start) / 1000,
-                        'filename': f"segment_{i + 1}.{output_format}",
-                        'temp_path': temp_file
-                    })
+            progress('decode')
+            pcm = self.pcm_store.get(audio_file_path)
+            with self.cpu_limiter.slot(), metrics.stage('suggest', pcm.frames * pcm.channels * 4):
+                return suggest_splits(pcm.mono_blocks(), pcm.sample_rate, pcm.frames,
+                                      progress=lambda done, total: progress('analyze', done, total),
+                                      **options)
+        except limits.Overloaded:
+            raise
+        except Exception as e:
+            print(f"Error suggesting splits: {e}")
+            return None
+    
+    def _plan_segments(self, pcm, split_points, output_format):
+        """Segment dicts and export jobs ([(start_frame, end_frame, temp_file), ...]) for split points"""
+        sr = pcm.sample_rate
+        # Convert split points to sample frames
+        split_frames = [int(round(point * sr)) for point in split_points if 0 <= point <= pcm.duration]
+        
+        segments = []
+        jobs = []
+        start = 0
+        for i, end in enumerate(split_frames + [pcm.frames]):
+            if start < end:
+                temp_file = os.path.join(self.temp_dir, f"segment_{uuid.uuid4()}.{output_format}")
+                jobs.append((start, end, temp_file))
                 
-                start = end_ms
+                segments.append({
+                    'index': i + 1,
+                    'start_time': start / sr,
+                    'end_time': end / sr,
+                    'duration': (end - start) / sr,
+                    'filename': f"segment_{i + 1}.{output_format}",
+                    'temp_path': temp_file
+                })
             
-            return segments, temp_files
+            start = end
+        return segments, jobs
+    
+    def analyze_segments(self, pcm, segments):
+        """Attach level `stats` to segment dicts, from one pass over the decoded source"""
+        sr = pcm.sample_rate
+        ranges = [(int(round(s['start_time'] * sr)), int(round(s['end_time'] * sr))) for s in segments]
+        with self.cpu_limiter.slot(), metrics.stage('segment_stats', pcm.frames * pcm.channels * 4):
+            stats = segment_stats.analyze(pcm, ranges)
+        for segment, item in zip(segments, stats):
+            segment['stats'] = item
+    
+    def _prepare_export(self, pcm, segments, analyze, normalize_lufs):
+        """Analyze segments if asked; returns per-segment gains for loudness normalization, or None"""
+        if not (analyze or normalize_lufs is not None):
+            return None
+        self.analyze_segments(pcm, segments)
+        if normalize_lufs is None:
+            return None
+        gains = [segment_stats.normalization_gain(s['stats'], normalize_lufs) for s in segments]
+        for segment, gain in zip(segments, gains):
+            segment['gain_db'] = gain
+        return gains
+    
+    def _export_segments(self, pcm, jobs, output_format, gains=None):
+        """
+        Export `jobs` like SegmentExporter.iter_export, yielding (job_index, error).
+
+        Segments already in the segment cache come first, without encoding;
+        the rest are encoded and added to the cache.
+        """
+        gains = gains or [0.0] * len(jobs)
+        keys = [self.segment_cache.key(pcm.key, start, end, output_format,
+                                       {**ENCODER_SETTINGS, 'gain_db': gain} if gain else ENCODER_SETTINGS)
+                for (start, end, _), gain in zip(jobs, gains)]
+        missing = []
+        for index, (key, (_, _, temp_file)) in enumerate(zip(keys, jobs)):
+            hit = self.segment_cache.fetch(key, output_format, temp_file)
+            metrics.cache_result('segment', hit)
+            if hit:
+                yield index, None
+            else:
+                missing.append(index)
+        
+        if not missing:
+            return
+
+        # Encode on a helper thread that keeps the pool fed and hands each
+        # finished segment over as it completes. It holds the encode slot only
+        # while encoding: a slow consumer (a ZIP streamed to a slow client)
+        # never keeps the slot, and the queue holds every result, so the
+        # helper never waits on the consumer.
+        results = queue.Queue(maxsize=len(missing) + 1)
+        cancelled = threading.Event()
+
+        def encode():
+            try:
+                with self.encode_limiter.slot(), metrics.stage('export') as stage, closing(
+                        self.exporter.iter_export(pcm, [jobs[index] for index in missing], output_format,
+                                                  [gains[index] for index in missing])) as exported:
+                    for pos, error in exported:
+                        index = missing[pos]
+                        if not error:
+                            self.segment_cache.store(keys[index], output_format, jobs[index][2])
+                            stage.add_bytes(os.path.getsize(jobs[index][2]))
+                        results.put((index, error))
+                        if cancelled.is_set():
+                            break  # Closing iter_export cancels what has not started
+                results.put(None)
+            except BaseException as e:
+                results.put(e)
+
+        # Same context, so the caller's queue deadline and stage timings apply
+        threading.Thread(target=contextvars.copy_context().run, args=(encode,),
+                         name='export', daemon=True).start()
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            cancelled.set()
+    
+    def iter_split_audio(self, audio_file_path, split_points, output_format='mp3', mode='encode',
+                         accurate=False, analyze=False, normalize_lufs=None, progress=no_progress):
+        """
+        Split audio at specified points, yielding each segment as soon as its file is ready.
+
+        Segments come in completion order; failed ones carry an 'error' and no
+        'temp_path'. Failures of the whole source raise. Closing the generator
+        cancels segments that have not started.
+
+        With `analyze`, each segment gets level `stats` (see segment_stats);
+        with `normalize_lufs`, segments are also encoded with the gain that
+        brings them to that integrated loudness, reported as `gain_db`.
+        """
+        progress('decode')
+        # Slice the decoded PCM instead of decoding the source again
+        pcm = self.pcm_store.get(audio_file_path)
+        if mode == 'copy' and normalize_lufs is not None:
+            print("Loudness normalization needs re-encoding; ignoring copy mode")
+            mode = 'encode'
+        
+        # Same codec in and out: cut packets without transcoding
+        if mode == 'copy':
+            try:
+                progress('export')
+                with self.encode_limiter.slot(), metrics.stage('stream_copy') as stage:
+                    segments = split_copy(audio_file_path, pcm, split_points, output_format,
+                                          self.temp_dir, accurate=accurate)
+                    stage.add_bytes(sum(os.path.getsize(s['temp_path']) for s in segments if s['temp_path']))
+            except ValueError as e:
+                print(f"Stream copy unavailable, re-encoding: {e}")
+            else:
+                if analyze:
+                    progress('analyze')
+                    self.analyze_segments(pcm, segments)
+                yield from segments
+                return
+        
+        segments, jobs = self._plan_segments(pcm, split_points, output_format)
+        if analyze or normalize_lufs is not None:
+            progress('analyze')
+        gains = self._prepare_export(pcm, segments, analyze, normalize_lufs)
+        
+        # Reuse cached segments and encode the rest on the export pool;
+        # failures are reported per segment
+        progress('export', 0, len(jobs))
+        with closing(self._export_segments(pcm, jobs, output_format, gains)) as exported:
+            for done, (index, error) in enumerate(exported, 1):
+                segment = segments[index]
+                if error:
+                    print(f"Error exporting segment {segment['index']}: {error}")
+                    segment['temp_path'] = None
+                    segment['error'] = error
+                progress('export', done, len(jobs))
+                yield segment
+    
+    def split_audio(self, audio_file_path, split_points, output_format='mp3', mode='encode',
+                    accurate=False, analyze=False, normalize_lufs=None, progress=no_progress):
+        """
+        Split audio at specified points (see iter_split_audio).
+
+        Returns (segments in index order, paths of the files written), or
+        (None, None) if the source could not be split.
+        """
+        try:
+            segments = self.iter_split_audio(audio_file_path, split_points, output_format, mode,
+                                             accurate, analyze, normalize_lufs, progress)
+            # Closed right away if progress raises, cancelling segments not yet started
+            with closing(segments):
+                segments = sorted(segments, key=lambda segment: segment['index'])
+            return segments, [s['temp_path'] for s in segments if s['temp_path']]
             
+        except limits.Overloaded:
+            raise
         except Exception as e:
             print(f"Error splitting audio: {e}")
             return None, None
 
 # Initialize processor
 processor = AudioProcessor()
+jobs = JobManager(JOBS_DIR, workers=JOB_WORKERS)
+
+def warm_up():
+    """
+    Load the libraries stages import lazily (librosa, scipy, matplotlib, pydub,
+    yt-dlp and its extractors) so the first request doesn't pay for them.
+    serve.py calls this before forking, so workers share the loaded code.
+    """
+    import librosa
+    import scipy.fft
+    from pydub import AudioSegment
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    librosa.filters.mel(sr=44100, n_fft=1024, n_mels=16)
+    # Matching a URL against every extractor imports all of them
+    processor.download_cache.key_for('https://example.com/warm-up')
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.server_timing = metrics.begin_request()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(endpoint, request.method, response.status_code,
+                                time.perf_counter() - started)
+    timing = metrics.end_request(g.pop('server_timing', None))
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Pipeline stage, cache and request metrics in Prometheus text format"""
+    if not metrics.ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/')
 def home():
     return jsonify({'message': 'Python Audio Processor API'})
 
+METADATA_OPTS = {
+    'quiet': False,  # Enable verbose for logs
+    'no_warnings': False,
+    'extract_flat': False,  # Full extraction for metadata
+    'skip_download': True,
+    'sleep_interval': 1,  # Avoid rate limits
+    'max_sleep_interval': 5,
+    'extractor_args': {
+        'youtube': [
+            'skip=hls,no_check_certificate'  # Skip HLS and cert issues
+        ]
+    },
+    'format': 'bestaudio[ext=m4a]/bestaudio/best',  # Prefer M4A audio
+    'noplaylist': True,  # Only extract first video, not entire playlist
+}
+
+# Refreshing a signed audio URL only needs the extractor's format list: no
+# rate-limit sleeps, format selection or per-format processing
+AUDIO_URL_OPTS = {key: value for key, value in METADATA_OPTS.items()
+                  if key not in ('sleep_interval', 'max_sleep_interval')}
+AUDIO_URL_OPTS.update(quiet=True, no_warnings=True)
+
+def extract_info(url):
+    """Full yt-dlp extraction without downloading; first entry for playlists"""
+    import yt_dlp
+    
+    with yt_dlp.YoutubeDL(METADATA_OPTS) as ydl:
+        info = ydl.extract_info(url, download=False)
+        print(f"Raw info keys: {list(info.keys()) if info else 'None'}")  # Debug: Check extracted fields
+        
+        if 'entries' in info and info['entries']:
+            entry = info['entries'][0]  # Take first for radio/playlist
+            print(f"Using entry[0]: {entry.get('title', 'No title')}")  # Debug
+            info = entry
+        return info
+
+def best_audio_format(info):
+    """Highest-bitrate audio-only format, or None"""
+    audio_formats = [f for f in info.get('formats') or [] if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
+    if not audio_formats:
+        return None
+    return max(audio_formats, key=lambda f: f.get('abr') or 0)  # Highest bitrate
+
+def fetch_metadata(url):
+    """Extract display metadata and a direct audio URL for one link"""
+    print(f"Fetching metadata for URL: {url}")  # Debug log
+    with metrics.stage('metadata'):
+        info = extract_info(url)
+    
+    # Enhanced field extraction
+    metadata = {
+        'title': info.get('title', 'Unknown Title'),
+        'album': info.get('album', info.get('playlist_title', 'Unknown Album')),
+        'author': info.get('uploader', info.get('channel', info.get('artist', 'Unknown Artist'))),
+        'duration': info.get('duration', 0),
+        'thumbnail': info.get('thumbnail', info.get('webpage_url', '')) or None,
+        'filesize': info.get('filesize_approx', info.get('filesize', 'Unknown Size')),
+        'format': info.get('ext', 'Unknown Format'),  # e.g., 'm4a'
+        'url': url,
+        'direct_audio_url': None,
+        'bitrate': info.get('abr', 'Unknown'),
+        'filesize_bytes': info.get('filesize_approx', info.get('filesize', None))
+    }
+    
+    # Try to get direct audio URL from formats
+    best_audio = best_audio_format(info)
+    if best_audio:
+        metadata['direct_audio_url'] = best_audio.get('url')
+        metadata['format'] = best_audio.get('ext', metadata['format'])
+        print(f"Selected audio format: {metadata['format']}")  # Debug
+    
+    # Format file size if available
+    if metadata['filesize_bytes']:
+        size_bytes = metadata['filesize_bytes']
+        if size_bytes > 1024 * 1024:  # MB
+            metadata['filesize_formatted'] = f"{size_bytes / (1024 * 1024):.1f} MB"
+        else:  # KB
+            metadata['filesize_formatted'] = f"{size_bytes / 1024:.0f} KB"
+    else:
+        metadata['filesize_formatted'] = 'Unknown'
+    
+    print(f"Final metadata: {json.dumps(metadata, indent=2)}")  # Debug log
+    return metadata
+
+def resolve_audio_url(url):
+    """Fresh (direct_audio_url, format) for a link whose signed URL expired"""
+    import yt_dlp
+    
+    with metrics.stage('metadata_audio_url'):
+        with yt_dlp.YoutubeDL(AUDIO_URL_OPTS) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+        if info.get('_type', 'video') != 'video':
+            # Playlists and redirects only resolve their formats when processed
+            info = extract_info(url)
+        best_audio = best_audio_format(info)
+    if not best_audio:
+        return None, None
+    return best_audio.get('url'), best_audio.get('ext')
+
+metadata_cache = MetadataCache(fetch_metadata, resolve_audio_url, ttl=METADATA_TTL,
+                               max_entries=METADATA_MAX_ENTRIES, workers=METADATA_WORKERS)
+
 @app.route('/metadata', methods=['POST'])
 def extract_metadata():
     """Extract metadata from URL using yt-dlp without downloading"""
@@ -200,150 +813,615 @@ def extract_metadata():
         if not url:
             return jsonify({'error': 'No URL provided'}), 400
         
-        print(f"Fetching metadata for URL: {url}")  # Debug log
-        
-        ydl_opts = {
-            'quiet': False,  # Enable verbose for logs
-            'no_warnings': False,
-            'extract_flat': False,  # Full extraction for metadata
-            'skip_download': True,
-            'sleep_interval': 1,  # Avoid rate limits
-            'max_sleep_interval': 5,
-            'extractor_args': {
-                'youtube': [
-                    'skip=hls,no_check_certificate'  # Skip HLS and cert issues
-                ]
-            },
-            'format': 'bestaudio[ext=m4a]/bestaudio/best',  # Prefer M4A audio
-            'noplaylist': True,  # Only extract first video, not entire playlist
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            print(f"Raw info keys: {list(info.keys()) if info else 'None'}")  # Debug: Check extracted fields
-            
-            if 'entries' in info and info['entries']:
-                entry = info['entries'][0]  # Take first for radio/playlist
-                print(f"Using entry[0]: {entry.get('title', 'No title')}")  # Debug
-                info = entry
-            
-            # Enhanced field extraction
-            metadata = {
-                'title': info.get('title', 'Unknown Title'),
-                'album': info.get('album', info.get('playlist_title', 'Unknown Album')),
-                'author': info.get('uploader', info.get('channel', info.get('artist', 'Unknown Artist'))),
-                'duration': info.get('duration', 0),
-                'thumbnail': info.get('thumbnail', info.get('webpage_url', '')) or None,
-                'filesize': info.get('filesize_approx', info.get('filesize', 'Unknown Size')),
-                'format': info.get('ext', 'Unknown Format'),  # e.g., 'm4a'
-                'url': url,
-                'direct_audio_url': None,
-                'bitrate': info.get('abr', 'Unknown'),
-                'filesize_bytes': info.get('filesize_approx', info.get('filesize', None))
-            }
-            
-            # Try to get direct audio URL from formats
-            if 'formats' in info:
-                audio_formats = [f for f in info['formats'] if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-                if audio_formats:
-                    best_audio = max(audio_formats, key=lambda f: f.get('abr', 0))  # Highest bitrate
-                    metadata['direct_audio_url'] = best_audio.get('url')
-                    metadata['format'] = best_audio.get('ext', metadata['format'])
-                    print(f"Selected audio format: {metadata['format']}")  # Debug
-            
-            # Format file size if available
-            if metadata['filesize_bytes']:
-                size_bytes = metadata['filesize_bytes']
-                if size_bytes > 1024 * 1024:  # MB
-                    metadata['filesize_formatted'] = f"{size_bytes / (1024 * 1024):.1f} MB"
-                else:  # KB
-                    metadata['filesize_formatted'] = f"{size_bytes / 1024:.0f} KB"
-            else:
-                metadata['filesize_formatted'] = 'Unknown'
-            
-            print(f"Final metadata: {json.dumps(metadata, indent=2)}")  # Debug log
-            return jsonify(metadata)
+        return jsonify(metadata_cache.get(url))
             
     except Exception as e:
         error_msg = f'Failed to fetch metadata: {str(e)}. Try updating yt-dlp or checking URL access.'
         print(f"ERROR: {error_msg}")  # Log error
         return jsonify({'error': error_msg}), 500
 
+@app.route('/metadata/batch', methods=['POST'])
+def extract_metadata_batch():
+    """Metadata for many URLs, resolved concurrently"""
+    try:
+        data = request.get_json() or {}
+        urls = data.get('urls')
+        
+        if not urls or not isinstance(urls, list):
+            return jsonify({'error': 'No URLs provided'}), 400
+        if len(urls) > METADATA_BATCH_MAX:
+            return jsonify({'error': f'At most {METADATA_BATCH_MAX} URLs per batch'}), 400
+        
+        results = metadata_cache.get_many(urls)
+        for result in results:
+            if 'error' in result:
+                result['error'] = f"Failed to fetch metadata: {result['error']}"
+        return jsonify({'results': results})
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def negotiate_peaks_encoding(data=None):
+    """
+    Peak encoding for this request: (encoding, compress, error).
+
+    `encoding` is None for JSON float lists, else 'int8' or 'int16'. Chosen by
+    the `peaks` query parameter or body field, else by an Accept header that
+    prefers the binary peaks type (int16). `compress=1` zlib-compresses it.
+    """
+    data = data or {}
+    encoding = request.args.get('peaks') or data.get('peaks')
+    if not encoding:
+        best = request.accept_mimetypes.best_match(['application/json', PEAKS_MIMETYPE])
+        encoding = 'int16' if best == PEAKS_MIMETYPE else 'json'
+    if encoding != 'json' and encoding not in ENCODINGS:
+        return None, False, f"peaks must be one of json, {', '.join(ENCODINGS)}"
+    compress = str(request.args.get('compress', data.get('compress', ''))).lower() in ('1', 'true', 'yes')
+    return (None if encoding == 'json' else encoding), compress, None
+
+def parse_process_request(data):
+    """Validate a /process-audio body; returns (params, error)"""
+    data = data or {}
+    params = {
+        'url': data.get('url'),
+        'waveform_mode': data.get('waveform_mode'),
+        'annotated': bool(data.get('annotated_image', False)),
+    }
+    if not params['url']:
+        return None, 'No audio URL provided'
+    if params['waveform_mode'] and params['waveform_mode'] not in WAVEFORM_MODES:
+        return None, f"waveform_mode must be one of {', '.join(WAVEFORM_MODES)}"
+    params['peaks'], params['compress'], error = negotiate_peaks_encoding(data)
+    if error:
+        return None, error
+    return params, None
+
+def run_process_audio(params, progress=no_progress):
+    """Download, analyze and render one URL"""
+    audio_url = params['url']
+    
+    # Download audio file using yt-dlp
+    print(f"Downloading audio from: {audio_url}")
+    temp_file, duration = processor.download_audio(audio_url, progress=progress)
+    
+    if not temp_file:
+        raise ProcessingError('Failed to download audio')
+    
+    print(f"Audio downloaded to: {temp_file}")
+    
+    # Later /split-audio and /waveform calls refer to the source by asset id
+    asset = processor.register_asset(temp_file, url=audio_url, duration=duration)
+    temp_file = asset['path']
+    
+    # Generate waveform data
+    encoding = params.get('peaks')
+    waveform_data = processor.generate_waveform_data(temp_file, params['waveform_mode'], progress=progress,
+                                                     as_lists=not encoding)
+    waveform_image = processor.create_waveform_image(temp_file, annotated=params['annotated'],
+                                                     progress=progress)
+    
+    if not (waveform_data and waveform_image):
+        raise ProcessingError('Failed to process audio')
+    # Extractors without a duration (plain file links) get the decoded one
+    duration = duration or waveform_data['duration']
+    
+    if encoding:
+        # Packed peaks; bucket times follow from duration and samples_per_bucket
+        payload = encode_overview(waveform_data, ENCODINGS[encoding], params.get('compress', False))
+        waveform_data = {
+            'encoding': encoding,
+            'compressed': params.get('compress', False),
+            'content_type': PEAKS_MIMETYPE,
+            'data': to_base64(payload),
+        }
+    
+    return {
+        'success': True,
+        'waveform_data': waveform_data,
+        'waveform_image': waveform_image,
+        'duration': duration,
+        'asset_id': asset['asset_id'],
+        'file_path': temp_file
+    }
+
+def overloaded_response(e):
+    """429 telling the client when a saturated resource is likely to have room again"""
+    response = jsonify({'error': str(e), 'resource': e.resource, 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.route('/process-audio', methods=['POST'])
 def process_audio():
     """Process audio file and return waveform data"""
     try:
-        data = request.get_json()
-        audio_url = data.get('url')
+        params, error = parse_process_request(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not audio_url:
-            return jsonify({'error': 'No audio URL provided'}), 400
-        
-        # Download audio file using yt-dlp
-        print(f"Downloading audio from: {audio_url}")
-        temp_file, duration = processor.download_audio(audio_url)
+        return jsonify(run_process_audio(params))
+            
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Process audio error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def request_source():
+    """Source file named by the `asset_id` (or `file`) query parameter, or an error response"""
+    asset_id = request.args.get('asset_id')
+    file_path = request.args.get('file')
+    if asset_id:
+        file_path = processor.resolve_asset(asset_id)
+    if not file_path:
+        return None, (jsonify({'error': 'No asset_id or file provided'}), 400)
+    # Only serve files that this processor wrote or downloaded
+    file_path = os.path.realpath(file_path)
+    if not processor.owns_file(file_path):
+        return None, (jsonify({'error': 'Unknown file'}), 404)
+    return file_path, None
+
+@app.route('/waveform', methods=['GET'])
+def waveform():
+    """Return peak buckets for a zoom window of a processed file"""
+    try:
+        start = request.args.get('start', 0.0, type=float)
+        end = request.args.get('end', None, type=float)
+        width = request.args.get('width', 1000, type=int)
+        encoding, compress, error = negotiate_peaks_encoding()
+
+        if error:
+            return jsonify({'error': error}), 400
+        file_path, error = request_source()
+        if error:
+            return error
+        if width < 1 or width > 10000:
+            return jsonify({'error': 'width must be between 1 and 10000'}), 400
+
+        peaks = processor.query_waveform(file_path, start, end, width, encoding, compress)
+        if peaks is None:
+            return jsonify({'error': 'Failed to query waveform'}), 500
+        if encoding:
+            return Response(peaks, mimetype=PEAKS_MIMETYPE, headers={'Vary': 'Accept'})
+        return jsonify(peaks)
+
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/spectrogram', methods=['GET'])
+def spectrogram():
+    """Tile layout (zoom levels, seconds per tile, tile counts) of a file's spectrogram"""
+    try:
+        file_path, error = request_source()
+        if error:
+            return error
+        return jsonify(processor.spectrogram_layout(file_path))
+    
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/spectrogram/tile', methods=['GET'])
+def spectrogram_tile():
+    """One spectrogram tile by (asset, level, x), as PNG or raw 8-bit dB values"""
+    try:
+        level = request.args.get('level', type=int)
+        x = request.args.get('x', type=int)
+        scale = request.args.get('scale', 'mel')
+        rows = request.args.get('rows', 128, type=int)
+        fmt = request.args.get('format', 'png')
         
-        if not temp_file:
-            return jsonify({'error': 'Failed to download audio'}), 500
+        if level is None or x is None:
+            return jsonify({'error': 'level and x are required'}), 400
+        if scale not in spectrogram_tiles.SCALES:
+            return jsonify({'error': f"scale must be one of {', '.join(spectrogram_tiles.SCALES)}"}), 400
+        low, high = spectrogram_tiles.ROWS_RANGE
+        if not low <= rows <= high:
+            return jsonify({'error': f'rows must be between {low} and {high}'}), 400
+        if fmt not in ('png', 'raw'):
+            return jsonify({'error': "format must be 'png' or 'raw'"}), 400
+        file_path, error = request_source()
+        if error:
+            return error
         
-        print(f"Audio downloaded to: {temp_file}")
+        try:
+            data, source_hash = processor.spectrogram_tile(file_path, level, x, scale, rows, fmt == 'png')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+        response = Response(data, mimetype='image/png' if fmt == 'png' else spectrogram_tiles.MIMETYPE)
+        response.set_etag(f'{source_hash[:32]}-{scale}{rows}-{level}-{x}-{fmt}')
+        response.cache_control.max_age = TILE_MAX_AGE
+        return response.make_conditional(request)
+    
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/waveform/image', methods=['GET'])
+def waveform_image():
+    """Waveform PNG with split markers; the base is cached, so marker edits only re-composite"""
+    try:
+        width = request.args.get('width', IMAGE_WIDTH, type=int)
+        height = request.args.get('height', IMAGE_HEIGHT, type=int)
+        theme = request.args.get('theme', 'dark')
+        annotated = request.args.get('annotated', 'false').lower() in ('1', 'true', 'yes')
+        try:
+            points = [float(p) for p in request.args.get('split_points', '').split(',') if p.strip()]
+        except ValueError:
+            return jsonify({'error': 'split_points must be comma-separated seconds'}), 400
         
-        # Generate waveform data
-        waveform_data = processor.generate_waveform_data(temp_file)
-        waveform_image = processor.create_waveform_image(temp_file)
+        if not 100 <= width <= 4000 or not 50 <= height <= 2000:
+            return jsonify({'error': 'width must be between 100 and 4000, height between 50 and 2000'}), 400
+        if theme not in THEMES:
+            return jsonify({'error': f"theme must be one of {', '.join(THEMES)}"}), 400
+        file_path, error = request_source()
+        if error:
+            return error
         
-        if waveform_data and waveform_image:
-            return jsonify({
-                'success': True,
-                'waveform_data': waveform_data,
-                'waveform_image': waveform_image,
-                'duration': duration,
-                'file_path': temp_file
-            })
+        # The ETag is known before rendering, so revalidations skip all the work
+        etag = processor.waveform_image_etag(file_path, points, annotated, width, height, theme)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
         else:
-            return jsonify({'error': 'Failed to process audio'}), 500
-            
+            png, etag = processor.waveform_png(file_path, points, annotated, width, height, theme)
+            response = Response(png, mimetype='image/png')
+        response.set_etag(etag)
+        response.cache_control.max_age = IMAGE_MAX_AGE
+        return response.make_conditional(request)
+    
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
-        print(f"Process audio error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def parse_split_request(data):
+    """Validate a /split-audio body; returns (params, error)"""
+    data = data or {}
+    params = {
+        'asset_id': data.get('asset_id'),
+        'url': data.get('url'),
+        'split_points': data.get('split_points', []),
+        'format': data.get('format', 'mp3'),
+        'mode': data.get('mode', 'encode'),
+        'accurate': bool(data.get('sample_accurate', False)),
+        'analyze': bool(data.get('analyze', False)),
+        'normalize_lufs': data.get('normalize_lufs'),
+    }
+    if not (params['asset_id'] or params['url']) or not params['split_points']:
+        return None, 'Missing required parameters'
+    if params['mode'] not in ('encode', 'copy'):
+        return None, "mode must be 'encode' or 'copy'"
+    if params['normalize_lufs'] is not None:
+        try:
+            params['normalize_lufs'] = float(params['normalize_lufs'])
+        except (TypeError, ValueError):
+            return None, 'normalize_lufs must be a number'
+        if not -70 <= params['normalize_lufs'] <= 0:
+            return None, 'normalize_lufs must be between -70 and 0'
+    return params, None
+
+def source_path(params, progress=no_progress):
+    """Source file for a request naming an `asset_id` or a `url`"""
+    if params.get('asset_id'):
+        return processor.resolve_asset(params['asset_id'])
+    # No asset yet: the download cache makes a repeat of /process-audio's fetch free
+    temp_file, duration = processor.download_audio(params['url'], progress=progress)
+    if not temp_file:
+        raise ProcessingError('Failed to download audio')
+    return processor.register_asset(temp_file, url=params['url'], duration=duration)['path']
+
+def run_split_audio(params, progress=no_progress):
+    """Split one source at the requested points"""
+    temp_file = source_path(params, progress)
+    
+    # Split audio
+    segments, temp_files = processor.split_audio(temp_file, params['split_points'], params['format'],
+                                                 params['mode'], params['accurate'], params['analyze'],
+                                                 params['normalize_lufs'], progress=progress)
+    
+    if not segments:
+        raise ProcessingError('Failed to split audio')
+    
+    for segment in segments:
+        if segment['temp_path']:
+            segment['download_url'] = (f"/download-segment/{os.path.basename(segment['temp_path'])}"
+                                       f"?name={quote(segment['filename'])}")
+    
+    return {
+        'success': True,
+        'segments': segments
+    }
+
 @app.route('/split-audio', methods=['POST'])
 def split_audio():
     """Split audio at specified points"""
     try:
-        data = request.get_json()
-        audio_url = data.get('url')
-        split_points = data.get('split_points', [])
-        format = data.get('format', 'mp3')
+        params, error = parse_split_request(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not audio_url or not split_points:
-            return jsonify({'error': 'Missing required parameters'}), 400
+        return jsonify(run_split_audio(params))
+            
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_split_batch_request(data):
+    """Validate a /split-batch body; returns (params, error)"""
+    data = data or {}
+    sources = data.get('sources')
+    if not isinstance(sources, list) or not sources:
+        return None, 'No sources provided'
+    if len(sources) > SPLIT_BATCH_MAX_SOURCES:
+        return None, f'At most {SPLIT_BATCH_MAX_SOURCES} sources per batch'
+    
+    params = {'sources': [], 'archive_name': safe_arcname(os.path.basename(data.get('archive_name') or 'segments.zip'))}
+    for number, source in enumerate(sources, 1):
+        if not isinstance(source, dict):
+            return None, f'Source {number} must be an object'
+        # Per-source settings fall back to the batch-wide ones
+        item, error = parse_split_request({**data, **source})
+        if error:
+            return None, f'Source {number}: {error}'
+        item['title'] = str(source.get('title') or f'source_{number}')
+        item['names'] = source.get('names') or []
+        item['name_template'] = source.get('name_template') or data.get('name_template') or SPLIT_NAME_TEMPLATE
+        if not isinstance(item['names'], list):
+            return None, f'Source {number}: names must be a list'
+        try:
+            segment_name(item, number, {'index': 1, 'start_time': 0.0, 'end_time': 1.0})
+        except (KeyError, IndexError, ValueError) as e:
+            return None, f'Source {number}: invalid name_template ({e})'
+        params['sources'].append(item)
+    return params, None
+
+def segment_name(source, number, segment):
+    """Archive path of a segment from its source's name template"""
+    index = segment['index']
+    names = source['names']
+    return source['name_template'].format(
+        source=number,
+        title=source['title'],
+        index=index,
+        name=names[index - 1] if index <= len(names) and names[index - 1] else f'segment_{index}',
+        start=segment['start_time'],
+        end=segment['end_time'],
+        ext=source['format'],
+    )
+
+def stream_split_batch(params):
+    """
+    ZIP archive bytes for a batch split, produced as segments finish encoding.
+
+    Sources are fetched one ahead of the one being encoded. Each segment is
+    appended to the archive and its temp file removed as soon as it is ready;
+    a manifest.json with every segment's times, name and any error ends the
+    archive, since the status code is sent before the work is done.
+    """
+    archive = ZipStream()
+    manifest = []
+    fetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-fetch')
+    
+    # Once the response has started there is no 429 to send: wait for slots instead
+    def fetch(source):
+        with limits.waiting(None):
+            return source_path(source)
+    
+    try:
+        paths = [fetcher.submit(fetch, source) for source in params['sources']]
+        for number, (source, path) in enumerate(zip(params['sources'], paths), 1):
+            entry = {'source': number, 'title': source['title'], 'url': source['url'],
+                     'asset_id': source['asset_id'], 'segments': []}
+            manifest.append(entry)
+            try:
+                segments = processor.iter_split_audio(path.result(), source['split_points'], source['format'],
+                                                      source['mode'], source['accurate'], source['analyze'],
+                                                      source['normalize_lufs'])
+                with closing(segments), limits.waiting(None):
+                    for segment in segments:
+                        item = {k: segment[k] for k in ('index', 'start_time', 'end_time', 'duration', 'stats', 'gain_db')
+                                if k in segment}
+                        entry['segments'].append(item)
+                        if not segment['temp_path']:
+                            item['error'] = segment['error']
+                            continue
+                        try:
+                            item['name'] = yield from archive.add_file(
+                                segment_name(source, number, segment), segment['temp_path'])
+                        finally:
+                            os.remove(segment['temp_path'])
+            except Exception as e:
+                print(f"Error splitting batch source {number}: {e}")
+                entry['error'] = str(e)
+            entry['segments'].sort(key=lambda item: item['index'])
         
-        # Download audio file (simplified)
-        temp_file = os.path.join(processor.temp_dir, f"audio_{uuid.uuid4()}.mp3")
+        yield from archive.add_bytes('manifest.json', json.dumps({'sources': manifest}, indent=2))
+        yield from archive.close()
+    finally:
+        fetcher.shutdown(wait=False, cancel_futures=True)
+
+@app.route('/split-batch', methods=['POST'])
+def split_batch():
+    """Split one or more sources and stream every segment back in a single ZIP"""
+    try:
+        params, error = parse_split_batch_request(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
+        # Unknown assets fail the request before any bytes are sent
+        for source in params['sources']:
+            if source['asset_id']:
+                processor.resolve_asset(source['asset_id'])
         
-        # Split audio
-        segments, temp_files = processor.split_audio(temp_file, split_points, format)
+        name = params['archive_name']
+        disposition = (f'attachment; filename="{name.encode("ascii", "replace").decode()}"; '
+                       f"filename*=UTF-8''{quote(name)}")
+        return Response(stream_with_context(stream_split_batch(params)), mimetype='application/zip',
+                        headers={'Content-Disposition': disposition, 'X-Accel-Buffering': 'no'})
+    
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def parse_suggest_request(data):
+    """Validate a /suggest-splits body; returns (params, error)"""
+    data = data or {}
+    params = {
+        'asset_id': data.get('asset_id'),
+        'url': data.get('url'),
+        'options': {},
+    }
+    if not (params['asset_id'] or params['url']):
+        return None, 'No asset_id or URL provided'
+    for name, default in SUGGEST_DEFAULTS.items():
+        value = data.get(name)
+        if value is None:
+            continue
+        try:
+            if isinstance(default, bool):
+                value = bool(value)
+            elif name == 'max_splits':
+                value = int(value)
+            else:
+                value = float(value)
+        except (TypeError, ValueError):
+            return None, f'{name} must be a number'
+        if name in ('min_silence', 'novelty_window') and value <= 0:
+            return None, f'{name} must be positive'
+        if name in ('min_segment', 'max_splits') and value < 0:
+            return None, f'{name} must not be negative'
+        params['options'][name] = value
+    return params, None
+
+def run_suggest_splits(params, progress=no_progress):
+    """Analyze one source and propose split points"""
+    temp_file = source_path(params, progress)
+    suggestion = processor.suggest_splits(temp_file, progress=progress, **params['options'])
+    if suggestion is None:
+        raise ProcessingError('Failed to analyze audio')
+    return {'success': True, **suggestion}
+
+@app.route('/suggest-splits', methods=['POST'])
+def suggest_split_points():
+    """Propose split points from silence gaps and energy/timbre changes"""
+    try:
+        params, error = parse_suggest_request(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
         
-        if segments:
-            return jsonify({
-                'success': True,
-                'segments': segments
-            })
-        else:
-            return jsonify({'error': 'Failed to split audio'}), 500
-            
+        return jsonify(run_suggest_splits(params))
+    
+    except limits.Overloaded as e:
+        return overloaded_response(e)
+    except UnknownAsset as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+JOB_PIPELINES = {
+    'process-audio': (parse_process_request, run_process_audio),
+    'split-audio': (parse_split_request, run_split_audio),
+    'suggest-splits': (parse_suggest_request, run_suggest_splits),
+}
+
+def run_job(job, run, params):
+    """Job body; background work waits for resource slots rather than failing with 429"""
+    with limits.waiting(None):
+        return run(params, progress=job.report)
+
+@app.route('/jobs/<kind>', methods=['POST'])
+def submit_job(kind):
+    """Queue /process-audio or /split-audio work and return a job id right away"""
+    try:
+        if kind not in JOB_PIPELINES:
+            return jsonify({'error': f'Unknown job type: {kind}'}), 404
+        parse, run = JOB_PIPELINES[kind]
+        params, error = parse(request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
+        
+        job = jobs.submit(kind, run_job, run, params)
+        return jsonify({
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/jobs/{job.id}',
+            'events_url': f'/jobs/{job.id}/events',
+        }), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Current state, per-stage progress and (when done) result of a job"""
+    state = jobs.status(job_id)
+    if state is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(state)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events with the job state on every change"""
+    if jobs.status(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return Response(stream_with_context(jobs.events(job_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    state = jobs.cancel(job_id)
+    if state is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(state)
+
+# Content types for exported formats; the system mimetypes table lacks some of them
+SEGMENT_MIMETYPES = {
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav',
+    'flac': 'audio/flac',
+    'm4a': 'audio/mp4',
+    'aac': 'audio/mp4',
+    'ogg': 'audio/ogg',
+    'opus': 'audio/ogg',
+}
+
 @app.route('/download-segment/<path:filename>')
 def download_segment(filename):
-    """Download a specific segment"""
+    """Download a specific segment, with Range and conditional GET support"""
     try:
-        # In production, implement proper file serving
-        return jsonify({'error': 'Download not implemented yet'}), 501
+        ext = filename.rsplit('.', 1)[-1].lower()
+        # send_from_directory rejects paths outside the temp dir and streams the
+        # file in blocks instead of reading it into memory
+        return send_from_directory(
+            processor.temp_dir, filename,
+            mimetype=SEGMENT_MIMETYPES.get(ext),
+            as_attachment=request.args.get('download', '1') != '0',
+            download_name=os.path.basename(request.args.get('name') or filename),
+            conditional=True,
+            etag=True,
+            max_age=SEGMENT_MAX_AGE,
+        )
+    except NotFound:
+        return jsonify({'error': 'Unknown segment'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    if os.environ.get('AUDIO_WARM_UP') == '1':
+        warm_up()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Headless batch splitting of local files.
+
+Takes a manifest (CSV or JSON rows of file, split points and format) or a
+directory of audio files and splits every file with `AudioProcessor` directly,
+one file per process in a pool, with no HTTP server in between. Each file's
+segments land in their own folder under the output directory, written to a
+scratch folder first and renamed into place once complete.
+
+Finished files are appended to a checkpoint in the output directory; a rerun
+with the same arguments skips them (unless the source changed) and retries
+failures, so a killed run resumes where it stopped. A JSON report lists every
+file with its segments or error, plus throughput in files and audio hours per
+minute.
+
+    python batch_split.py manifest.csv --out segments/
+    python batch_split.py recordings/ --out segments/ --every 600 --format flac
+    python batch_split.py recordings/ --out segments/ --suggest --workers 8
+
+CSV manifests have a header with `file`, `split_points` (seconds separated by
+`;` or spaces) and optionally `format` and `name`; JSON manifests are a list
+of objects with the same keys (`split_points` as a list). Relative paths are
+resolved against the manifest's folder.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from zip_stream import safe_arcname
+
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.webm', '.aif', '.aiff')
+CHECKPOINT_NAME = '.batch_checkpoint.jsonl'
+FORMATS = ('mp3', 'wav', 'flac', 'm4a', 'ogg', 'opus')
+
+
+class ManifestError(Exception):
+    """The manifest or input directory cannot be read"""
+
+
+def parse_points(value):
+    """Split points from a list or a string of seconds separated by ';', ',' or spaces"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = [p for p in re.split(r'[;,\s]+', value.strip().strip('[]')) if p]
+    return sorted(float(p) for p in value)
+
+
+def read_manifest(path):
+    """Rows ({'file', 'split_points', 'format', 'name'}) from a CSV or JSON manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    try:
+        with open(path, newline='') as f:
+            if path.lower().endswith('.json'):
+                rows = json.load(f)
+                if isinstance(rows, dict):
+                    rows = rows.get('files', [])
+            else:
+                rows = list(csv.DictReader(f))
+    except (OSError, ValueError, csv.Error) as e:
+        raise ManifestError(f"Cannot read manifest {path}: {e}") from e
+
+    items = []
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict) or not row.get('file'):
+            raise ManifestError(f"Manifest row {number} has no file")
+        try:
+            points = parse_points(row.get('split_points'))
+        except (TypeError, ValueError) as e:
+            raise ManifestError(f"Manifest row {number}: bad split_points ({e})") from e
+        items.append({
+            'file': os.path.normpath(os.path.join(base, os.path.expanduser(row['file']))),
+            'split_points': points,
+            'format': row.get('format') or None,
+            'name': row.get('name') or None,
+        })
+    return items
+
+
+def scan_directory(root):
+    """Rows for every audio file under `root`, named by their path relative to it"""
+    items = []
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(AUDIO_EXTENSIONS):
+                path = os.path.join(folder, filename)
+                name = os.path.splitext(os.path.relpath(path, root))[0]
+                items.append({'file': path, 'split_points': None, 'format': None, 'name': name})
+    if not items:
+        raise ManifestError(f"No audio files under {root}")
+    return items
+
+
+def assign_names(items):
+    """Give every item a unique output folder name, stable across runs"""
+    taken = set()
+    for item in items:
+        base = safe_arcname(item['name'] or os.path.splitext(os.path.basename(item['file']))[0])
+        name, n = base, 1
+        while name in taken:
+            n += 1
+            name = f"{base} ({n})"
+        taken.add(name)
+        item['name'] = name
+    return items
+
+
+def item_key(item, options):
+    """Checkpoint key: the source's identity plus everything that shapes its output"""
+    try:
+        st = os.stat(item['file'])
+        identity = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        identity = None
+    spec = json.dumps([item['file'], identity, item['split_points'], item['format'], item['name'], options],
+                      sort_keys=True)
+    return hashlib.sha256(spec.encode()).hexdigest()
+
+
+def load_checkpoint(path):
+    """{key: result} of files finished by earlier runs"""
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Torn last line of a killed run
+                done[record['key']] = record['result']
+    except FileNotFoundError:
+        pass
+    return done
+
+
+_processor = None
+
+
+def init_worker():
+    """Pool initializer: one AudioProcessor per worker, encoding inline since files are the parallel unit"""
+    global _processor
+    os.environ.setdefault('AUDIO_EXPORT_WORKERS', '1')
+    os.environ.setdefault('AUDIO_METRICS', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import audio_processor
+    _processor = audio_processor.processor
+
+
+def split_file(item, out_dir, options):
+    """Worker body: split one file into `out_dir/<name>/`; returns its report entry"""
+    import limits
+    started = time.perf_counter()
+    result = {'file': item['file'], 'name': item['name'], 'status': 'failed'}
+    scratch = os.path.join(out_dir, f".{uuid.uuid4().hex}.part")
+    try:
+        with limits.waiting(None):
+            duration = _processor.pcm_store.get(item['file']).duration
+            result['duration'] = round(duration, 3)
+            points = item['split_points']
+            if points is None and options['every']:
+                points = [options['every'] * i for i in range(1, int(duration // options['every']) + 1)
+                          if options['every'] * i < duration]
+            if points is None and options['suggest']:
+                suggestion = _processor.suggest_splits(item['file'])
+                if suggestion is None:
+                    raise RuntimeError('Failed to analyze audio')
+                points = suggestion['split_points']
+            if points is None:
+                raise RuntimeError('No split points (give them in the manifest, or use --every or --suggest)')
+            result['split_points'] = points
+
+            output_format = item['format'] or options['format']
+            # iter_split_audio rather than split_audio, so a failure reaches the report
+            segments = sorted(_processor.iter_split_audio(item['file'], points, output_format, options['mode'],
+                                                          options['accurate'], options['analyze'],
+                                                          options['normalize_lufs']),
+                              key=lambda segment: segment['index'])
+        if not segments:
+            raise RuntimeError('No segments to split')
+
+        os.makedirs(scratch)
+        errors = 0
+        for segment in segments:
+            temp_path = segment.pop('temp_path')
+            if not temp_path:
+                errors += 1
+                continue
+            segment['filename'] = f"{segment['index']:02d}{os.path.splitext(temp_path)[1]}"
+            shutil.move(temp_path, os.path.join(scratch, segment['filename']))
+
+        final = os.path.join(out_dir, item['name'])
+        if os.path.isdir(final):
+            shutil.rmtree(final)  # Left by a run killed before its checkpoint line
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(scratch, final)
+        result.update(status='ok' if not errors else 'partial', output_dir=final, segments=segments)
+        if errors:
+            result['error'] = f"{errors} segment(s) failed to export"
+    except Exception as e:
+        # Decoder errors often have no message; the type still tells what went wrong
+        result['error'] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        shutil.rmtree(scratch, ignore_errors=True)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def throughput(results, wall):
+    minutes = wall / 60 if wall > 0 else 0
+    audio_hours = sum(r.get('duration', 0) for r in results if r['status'] != 'failed') / 3600
+    return {
+        'files': len(results),
+        'audio_hours': round(audio_hours, 3),
+        'wall_seconds': round(wall, 1),
+        'files_per_minute': round(len(results) / minutes, 2) if minutes else None,
+        'audio_hours_per_minute': round(audio_hours / minutes, 3) if minutes else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Split many local audio files without the HTTP server')
+    parser.add_argument('input', help='CSV/JSON manifest or a directory of audio files')
+    parser.add_argument('--out', required=True, help='Output directory, one folder of segments per file')
+    parser.add_argument('--format', default='mp3', choices=FORMATS, help='Default output format')
+    parser.add_argument('--mode', default='encode', choices=('encode', 'copy'))
+    parser.add_argument('--sample-accurate', action='store_true', help='Copy mode: re-encode boundary packets')
+    parser.add_argument('--every', type=float, help='Split files without split points every N seconds')
+    parser.add_argument('--suggest', action='store_true', help='Split files without split points where suggested')
+    parser.add_argument('--analyze', action='store_true', help='Add per-segment levels to the report')
+    parser.add_argument('--normalize-lufs', type=float, help='Encode segments at this integrated loudness')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Files processed at once')
+    parser.add_argument('--report', help='Report path (default: <out>/report.json)')
+    parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and redo every file')
+    args = parser.parse_args(argv)
+
+    try:
+        items = scan_directory(args.input) if os.path.isdir(args.input) else read_manifest(args.input)
+    except ManifestError as e:
+        raise SystemExit(str(e))
+    for item in items:
+        if item['format'] and item['format'] not in FORMATS:
+            raise SystemExit(f"{item['file']}: format must be one of {', '.join(FORMATS)}")
+    assign_names(items)
+
+    options = {'format': args.format, 'mode': args.mode, 'accurate': args.sample_accurate,
+               'every': args.every, 'suggest': args.suggest, 'analyze': args.analyze,
+               'normalize_lufs': args.normalize_lufs}
+    out_dir = os.path.abspath(args.out)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        if name.endswith('.part'):
+            shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_NAME)
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    done = load_checkpoint(checkpoint_path)
+
+    keys = [item_key(item, options) for item in items]
+    results = [None] * len(items)
+    pending = []
+    for i, key in enumerate(keys):
+        previous = done.get(key)
+        if previous and previous['status'] == 'ok':
+            results[i] = {**previous, 'resumed': True}
+        else:
+            pending.append(i)
+    print(f"{len(items)} files, {len(items) - len(pending)} already done, {len(pending)} to split "
+          f"with {args.workers} workers")
+
+    started = time.perf_counter()
+    finished = []
+    with open(checkpoint_path, 'a') as checkpoint, \
+            ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=init_worker) as pool:
+        futures = {pool.submit(split_file, items[i], out_dir, options): i for i in pending}
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:  # A worker died
+                    result = {'file': items[i]['file'], 'name': items[i]['name'], 'status': 'failed',
+                              'error': f"Worker crashed: {e}"}
+                results[i] = result
+                finished.append(result)
+                checkpoint.write(json.dumps({'key': keys[i], 'result': result}) + '\n')
+                checkpoint.flush()
+                line = f"[{len(finished)}/{len(pending)}] {result['status']:<7} {result['file']}"
+                if result.get('error'):
+                    line += f": {result['error']}"
+                print(line)
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("Interrupted; rerun the same command to resume")
+            raise SystemExit(130)
+    wall = time.perf_counter() - started
+
+    this_run = throughput(finished, wall)
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'input': os.path.abspath(args.input),
+        'output': out_dir,
+        'options': options,
+        'summary': {
+            **this_run,
+            'total_files': len(items),
+            'resumed': len(items) - len(pending),
+            'ok': sum(1 for r in results if r['status'] == 'ok'),
+            'partial': sum(1 for r in results if r['status'] == 'partial'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+        },
+        'files': results,
+    }
+    report_path = args.report or os.path.join(out_dir, 'report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Split {this_run['files']} files ({this_run['audio_hours']} h of audio) in {this_run['wall_seconds']}s: "
+          f"{this_run['files_per_minute'] or 0} files/min, {this_run['audio_hours_per_minute'] or 0} audio h/min")
+    print(f"Report written to {report_path}")
+    if report['summary']['failed'] or report['summary']['partial']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
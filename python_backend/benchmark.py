@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the AudioProcessor pipeline.
+
+Generates synthetic signals (the sine mix with decay envelope from
+test_api.py, repeated every 10 seconds) at several durations, sample rates and
+channel counts, then times each pipeline stage in a fresh process:
+
+    ingest           pipelined download path: file bytes piped through ffmpeg into
+                     the PCM store with peaks built on the fly (read locally)
+    waveform         generate_waveform_data, memory mode, cold PCM store
+    waveform_stream  generate_waveform_data, stream mode
+    image            create_waveform_image with split markers
+    split            split_audio into 8 mp3 segments
+    suggest          suggest_splits
+
+In-memory caches are cold for every stage; the on-disk PCM store written by
+`waveform` is reused by the later stages, as it would be in the server.
+Each stage records wall time, peak RSS and throughput (audio seconds per CPU
+second, including ffmpeg and export worker processes). Results can be saved
+as a baseline and later runs compared against it; any stage slower or larger
+than the baseline beyond the tolerance makes the run exit non-zero. With
+`--compare` (the CI invocation) a stage without a baseline fails too, so a
+missing or stale baseline cannot pass silently. benchmark_baseline.json holds
+a reference for the --quick cases; timings only compare on like hardware, so
+regenerate it on the machine that runs the comparison.
+
+Everything runs offline. Examples:
+
+    python benchmark.py --quick
+    python benchmark.py --save-baseline
+    python benchmark.py --quick --compare
+    python benchmark.py --durations 1h --rates 48000 --channels 1 --stages waveform,image
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), 'audio_splitter_bench')
+
+DURATIONS = {'1m': 60, '10m': 600, '1h': 3600, '3h': 10800}
+STAGES = ('ingest', 'waveform', 'waveform_stream', 'image', 'split', 'suggest')
+# Every duration at 44.1 kHz stereo, plus other rates and channel counts at 10 minutes
+DEFAULT_CASES = ([(d, 44100, 2) for d in DURATIONS]
+                 + [('10m', 22050, 1), ('10m', 48000, 1), ('10m', 48000, 2), ('10m', 96000, 2)])
+QUICK_CASES = [('1m', 44100, 2), ('10m', 44100, 2), ('1m', 48000, 1)]
+BLOCK_SECONDS = 10
+
+
+def mock_signal(start, frames, sample_rate, channels):
+    """test_api.py's 440/880/220 Hz mix with its decay envelope, restarted every 10 s"""
+    t = (start + np.arange(frames)) / sample_rate
+    signal = (0.5 * np.sin(2 * np.pi * 440 * t)
+              + 0.3 * np.sin(2 * np.pi * 880 * t)
+              + 0.2 * np.sin(2 * np.pi * 220 * t))
+    signal *= np.exp(-(t % 10) / 10)
+    if channels == 1:
+        return signal[:, None].astype(np.float32)
+    # Slightly different right channel so stereo is not trivially mono
+    right = signal * 0.8 + 0.1 * np.sin(2 * np.pi * 330 * t) * np.exp(-(t % 10) / 10)
+    return np.stack([signal, right], axis=1)[:, :channels].astype(np.float32)
+
+
+def synthetic_file(work_dir, duration, sample_rate, channels):
+    """16-bit WAV of the mock signal, generated once per (duration, rate, channels)"""
+    path = os.path.join(work_dir, f"mock_{duration}s_{sample_rate}hz_{channels}ch.wav")
+    if os.path.exists(path):
+        return path
+    tmp = f"{path}.tmp"
+    total = int(duration * sample_rate)
+    block = BLOCK_SECONDS * sample_rate
+    with sf.SoundFile(tmp, 'w', samplerate=sample_rate, channels=channels,
+                      subtype='PCM_16', format='WAV') as out:
+        for start in range(0, total, block):
+            out.write(mock_signal(start, min(block, total - start), sample_rate, channels))
+    os.replace(tmp, path)
+    return path
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run_stage(stage, path, duration, store_dir, out_dir, queue):
+    """Child process body: run one stage and report its measurements"""
+    try:
+        os.environ['AUDIO_PCM_STORE_DIR'] = store_dir
+        os.environ['AUDIO_JOBS_DIR'] = os.path.join(out_dir, 'jobs')
+        os.environ['AUDIO_ASSETS_DIR'] = os.path.join(out_dir, 'assets')
+        os.environ['AUDIO_DOWNLOAD_CACHE_DIR'] = os.path.join(out_dir, 'downloads')
+        tempfile.tempdir = out_dir  # The processor's scratch dir goes away with the run
+        sys.path.insert(0, HERE)
+        import audio_processor
+        import ingest
+
+        processor = audio_processor.processor
+        split_points = [duration * i / 8 for i in range(1, 8)]
+
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        if stage == 'ingest':
+            def chunks(size=ingest.READ_SIZE):
+                total = os.path.getsize(path)
+                with open(path, 'rb') as f:
+                    for data in iter(lambda: f.read(size), b''):
+                        yield data, total
+            fetched = ingest.ingest(chunks(), os.path.join(out_dir, 'ingested.wav'), processor.pcm_store.root)
+            ok = fetched['pcm_path'] is not None
+            if ok:
+                os.remove(fetched['pcm_path'])
+        elif stage == 'waveform':
+            ok = processor.generate_waveform_data(path, 'memory') is not None
+        elif stage == 'waveform_stream':
+            ok = processor.generate_waveform_data(path, 'stream') is not None
+        elif stage == 'image':
+            ok = processor.create_waveform_image(path, split_points) is not None
+        elif stage == 'split':
+            segments, _ = processor.split_audio(path, split_points, 'mp3')
+            ok = bool(segments) and all(s.get('temp_path') for s in segments)
+            processor.exporter.shutdown()  # Reap workers so their CPU time is counted
+        elif stage == 'suggest':
+            ok = processor.suggest_splits(path) is not None
+        else:
+            raise ValueError(f"Unknown stage: {stage}")
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+
+        queue.put({
+            'ok': ok,
+            'wall_s': round(wall, 3),
+            'cpu_s': round(cpu, 3),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'peak_child_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+            'throughput': round(duration / cpu, 1) if cpu > 0 else None,
+            'realtime_factor': round(duration / wall, 1) if wall > 0 else None,
+        })
+    except Exception as e:
+        queue.put({'ok': False, 'error': f"{type(e).__name__}: {e}"})
+
+
+def measure(stage, path, duration, store_dir, out_dir, timeout):
+    """Run a stage in a fresh process so caches and peak RSS start clean"""
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_stage, args=(stage, path, duration, store_dir, out_dir, queue))
+    proc.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        proc.kill()
+        result = {'ok': False, 'error': f"timed out after {timeout}s"}
+    proc.join()
+    return result
+
+
+def case_id(label, sample_rate, channels):
+    return f"{label}/{sample_rate}/{channels}ch"
+
+
+def compare(results, baseline, wall_tolerance, rss_tolerance):
+    """Return a list of regression messages against a baseline"""
+    regressions = []
+    for case, stages in results.items():
+        for stage, result in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if not base or not result.get('ok') or not base.get('ok'):
+                continue
+            if result['wall_s'] > base['wall_s'] * (1 + wall_tolerance) and result['wall_s'] - base['wall_s'] > 0.05:
+                regressions.append(f"{case} {stage}: wall {base['wall_s']}s -> {result['wall_s']}s")
+            if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + rss_tolerance):
+                regressions.append(f"{case} {stage}: peak RSS {base['peak_rss_mb']} MB -> {result['peak_rss_mb']} MB")
+    return regressions
+
+
+def print_row(case, stage, result, base=None):
+    if not result.get('ok'):
+        print(f"{case:<20} {stage:<16} FAILED {result.get('error', '')}")
+        return
+    delta = ''
+    if base and base.get('ok') and base['wall_s']:
+        delta = f"{(result['wall_s'] / base['wall_s'] - 1) * 100:+.0f}%"
+    print(f"{case:<20} {stage:<16} {result['wall_s']:>9.2f} {delta:>6} {result['peak_rss_mb']:>9.0f}"
+          f" {result['throughput'] or 0:>10.1f} {result['realtime_factor'] or 0:>9.1f}")
+
+
+def parse_cases(args):
+    if args.quick:
+        return QUICK_CASES
+    if not (args.durations or args.rates or args.channels):
+        return DEFAULT_CASES
+    durations = args.durations.split(',') if args.durations else list(DURATIONS)
+    rates = [int(r) for r in args.rates.split(',')] if args.rates else [44100]
+    channels = [int(c) for c in args.channels.split(',')] if args.channels else [2]
+    for label in durations:
+        if label not in DURATIONS:
+            raise SystemExit(f"Unknown duration {label}; choose from {', '.join(DURATIONS)}")
+    return [(d, r, c) for d in durations for r in rates for c in channels]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the audio pipeline on synthetic signals')
+    parser.add_argument('--quick', action='store_true', help='Only short signals')
+    parser.add_argument('--durations', help=f"Comma-separated, from {', '.join(DURATIONS)}")
+    parser.add_argument('--rates', help='Comma-separated sample rates')
+    parser.add_argument('--channels', help='Comma-separated channel counts')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma-separated stages to run')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='Where synthetic signals are kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline results file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store these results as the baseline')
+    parser.add_argument('--compare', action='store_true',
+                        help='Fail unless every measured stage has a baseline to compare against (for CI)')
+    parser.add_argument('--output', help='Also write results as JSON here')
+    parser.add_argument('--wall-tolerance', type=float, default=0.25, help='Allowed wall time increase (0.25 = 25%%)')
+    parser.add_argument('--rss-tolerance', type=float, default=0.20, help='Allowed peak RSS increase')
+    parser.add_argument('--timeout', type=float, default=3600, help='Seconds before a stage is abandoned')
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(',') if s]
+    for stage in stages:
+        if stage not in STAGES:
+            raise SystemExit(f"Unknown stage {stage}; choose from {', '.join(STAGES)}")
+    cases = parse_cases(args)
+
+    if args.compare and args.save_baseline:
+        raise SystemExit("--compare and --save-baseline are exclusive")
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get('results', {})
+    elif args.compare:
+        raise SystemExit(f"No baseline at {args.baseline}; create one with --save-baseline")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    print(f"{'case':<20} {'stage':<16} {'wall s':>9} {'vs base':>6} {'peak MB':>9} {'audio s/cpu s':>10} {'x realtime':>9}")
+    results = {}
+    failed = False
+    for label, sample_rate, channels in cases:
+        duration = DURATIONS[label]
+        case = case_id(label, sample_rate, channels)
+        path = synthetic_file(args.work_dir, duration, sample_rate, channels)
+        run_dir = tempfile.mkdtemp(dir=args.work_dir, prefix='run_')
+        store_dir = os.path.join(run_dir, 'pcm')
+        try:
+            results[case] = {}
+            for stage in stages:
+                result = measure(stage, path, duration, store_dir, run_dir, args.timeout)
+                results[case][stage] = result
+                failed |= not result.get('ok')
+                print_row(case, stage, result, baseline.get(case, {}).get(stage))
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                    'cpus': os.cpu_count()},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        # Merge so partial runs only replace the cases they measured
+        merged = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                merged = json.load(f).get('results', {})
+        for case, stage_results in results.items():
+            merged.setdefault(case, {}).update(stage_results)
+        with open(args.baseline, 'w') as f:
+            json.dump({**report, 'results': merged}, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+
+    regressions = compare(results, baseline, args.wall_tolerance, args.rss_tolerance)
+    if regressions:
+        print("\nREGRESSIONS against baseline:")
+        for message in regressions:
+            print(f"  {message}")
+    missing = [f"{case} {stage}" for case, stage_results in results.items()
+               for stage in stage_results if not baseline.get(case, {}).get(stage)]
+    if args.compare and missing:
+        print("\nNo baseline for:")
+        for name in missing:
+            print(f"  {name}")
+    if failed:
+        print("\nSome stages FAILED")
+    if regressions or failed or (args.compare and missing):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
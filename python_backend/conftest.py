@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures
+"""
+
+import subprocess
+
+import pytest
+
+
+@pytest.fixture
+def tone(tmp_path):
+    """Encode a 5 s stereo tone mix to tmp_path/`name` with extra ffmpeg `args`; returns the path"""
+    def encode(name, *args, seconds=5):
+        path = str(tmp_path / name)
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'sine=f=440:d={seconds}',
+                        '-f', 'lavfi', '-i', f'sine=f=660:d={seconds}', '-filter_complex', 'amerge', *args, path],
+                       check=True)
+        return path
+    return encode
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    """An AudioProcessor with its own caches"""
+    import audio_processor
+    for name in ('PCM_STORE_DIR', 'DOWNLOAD_CACHE_DIR', 'ASSETS_DIR', 'SEGMENT_CACHE_DIR'):
+        monkeypatch.setattr(audio_processor, name, str(tmp_path / name.lower()))
+    return audio_processor.AudioProcessor()
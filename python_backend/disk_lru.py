@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Size-bounded least-recently-used eviction for on-disk cache directories.
+
+Cache entries are groups of files sharing a stem (`<key>.pcm`, `<key>.json`).
+Recency is the newest mtime in the group, refreshed with `touch` on every hit,
+so several processes can share one cache directory without an index file.
+"""
+
+import fcntl
+import os
+import shutil
+import time
+
+# In-progress writes are never counted or evicted
+PARTIAL_SUFFIXES = ('.tmp', '.part', '.lock')
+
+
+def touch(path):
+    """Mark a cache file as recently used"""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def entry_key(filename):
+    return filename.split('.', 1)[0]
+
+
+def scan(root):
+    """Return {key: (last_used, total_bytes, [paths])} for a cache directory"""
+    entries = {}
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return entries
+
+    for name in names:
+        if name.endswith(PARTIAL_SUFFIXES):
+            continue
+        path = os.path.join(root, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue  # Evicted by another process
+        if not os.path.isfile(path):
+            continue
+        last_used, size, paths = entries.get(entry_key(name), (0.0, 0, []))
+        paths.append(path)
+        entries[entry_key(name)] = (max(last_used, st.st_mtime), size + st.st_size, paths)
+    return entries
+
+
+def evict(root, max_bytes, protect=()):
+    """Delete least recently used entries until the directory fits `max_bytes`"""
+    entries = scan(root)
+    total = sum(size for _, size, _ in entries.values())
+    evicted = []
+    if total <= max_bytes:
+        return evicted
+
+    for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if total <= max_bytes:
+            break
+        if key in protect:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)  # Open memmaps keep their pages until closed
+            except FileNotFoundError:
+                pass
+        total -= size
+        evicted.append(key)
+    return evicted
+
+
+def remove_stale_partials(root, max_age=3600):
+    """
+    Delete leftovers from writers that died mid-write: partial files, scratch
+    directories, and lock files nobody holds any more
+    """
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(PARTIAL_SUFFIXES):
+            continue
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif name.endswith('.lock'):
+                _remove_unheld_lock(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _remove_unheld_lock(path):
+    with open(path, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # Still guarding a download
+        os.remove(path)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Single-flight, disk-LRU cache for downloaded sources.
+
+Entries are keyed by the extractor and media id yt-dlp recognizes in the URL
+(e.g. `Youtube-dQw4w9WgXcQ`), falling back to a hash of the normalized URL,
+so different spellings of the same link share one download. A hit never
+touches the network. Concurrent misses for the same key, from threads or other
+worker processes, wait on a per-key file lock and reuse the first download,
+for no longer than the download limiter's queue deadline.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import disk_lru
+import limits
+
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|si|feature|pp)$')
+LOCK_POLL = 0.1  # Seconds between attempts on a key locked by another download
+
+
+def normalize_url(url):
+    """Lowercase scheme and host, drop fragments and tracking parameters, sort the query"""
+    parts = urlsplit(url.strip())
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not TRACKING_PARAMS.match(k))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/',
+                       urlencode(query), ''))
+
+
+class KeyResolver:
+    """Map URLs to cache keys without network access"""
+
+    MAX_REMEMBERED = 1024
+
+    def __init__(self):
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._extractors = None
+
+    def __call__(self, url):
+        with self._lock:
+            if url in self._keys:
+                self._keys.move_to_end(url)
+                return self._keys[url]
+
+        key = self._extractor_key(url)
+        if key is None:
+            key = 'url-' + hashlib.sha256(normalize_url(url).encode()).hexdigest()[:32]
+
+        with self._lock:
+            self._keys[url] = key
+            while len(self._keys) > self.MAX_REMEMBERED:
+                self._keys.popitem(last=False)
+        return key
+
+    def _extractor_key(self, url):
+        if self._extractors is None:
+            import yt_dlp  # Deferred: loading the extractor list is the slow part of startup
+            self._extractors = [ie for ie in yt_dlp.extractor.gen_extractor_classes()
+                                if ie.ie_key() != 'Generic']
+        for ie in self._extractors:
+            try:
+                if not ie.suitable(url):
+                    continue
+                media_id = ie.get_temp_id(url)
+            except Exception:
+                continue
+            if media_id:
+                return re.sub(r'[^A-Za-z0-9_-]', '_', f"{ie.ie_key()}-{media_id}")
+        return None
+
+
+class DownloadCache:
+    """Downloaded files under `root`, at most `max_bytes` in total"""
+
+    def __init__(self, root, max_bytes, limiter=limits.UNLIMITED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.limiter = limiter  # Its queue deadline bounds waits on another download
+        self.key_for = KeyResolver()
+        os.makedirs(root, exist_ok=True)
+        disk_lru.remove_stale_partials(root)
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def lookup(self, key):
+        """Return (path, meta) for a cached key, or None"""
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        path = os.path.join(self.root, meta['file'])
+        if not os.path.exists(path):
+            return None
+        disk_lru.touch(path)
+        disk_lru.touch(self._meta_path(key))
+        return path, meta
+
+    def get(self, url, fetch):
+        """
+        Return (path, meta, hit) for `url`.
+
+        On a miss `fetch(scratch_dir)` must download into `scratch_dir` and return
+        (filename, meta_dict); the file is then moved into the cache.
+        """
+        key = self.key_for(url)
+        cached = self.lookup(key)
+        if cached:
+            return cached[0], cached[1], True
+
+        # Per-key lock file: one download per key across threads and processes
+        with open(os.path.join(self.root, f"{key}.lock"), 'w') as lock:
+            self._wait_for(lock)
+            try:
+                cached = self.lookup(key)
+                if cached:
+                    return cached[0], cached[1], True
+                path, meta = self._download(key, url, fetch)
+                return path, meta, False
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _wait_for(self, lock):
+        """Take a key's file lock, raising Overloaded past the limiter's deadline"""
+        timeout = self.limiter.patience()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    self.limiter.reject()
+                time.sleep(LOCK_POLL)
+
+    def _download(self, key, url, fetch):
+        scratch = tempfile.mkdtemp(dir=self.root, prefix=f"{key}.", suffix='.part')
+        try:
+            filename, meta = fetch(scratch)
+            ext = os.path.splitext(filename)[1]
+            final = os.path.join(self.root, f"{key}{ext}")
+            os.replace(filename, final)
+
+            meta = {**meta, 'file': os.path.basename(final), 'url': url, 'key': key}
+            tmp = f"{self._meta_path(key)}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp, self._meta_path(key))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        for evicted in disk_lru.evict(self.root, self.max_bytes, protect={key}):
+            # Lock files go with their entry; a caller still holding an old one at worst downloads again
+            try:
+                os.remove(os.path.join(self.root, f"{evicted}.lock"))
+            except FileNotFoundError:
+                pass
+        # Also clears locks of keys that failed or were never cached, so they don't pile up
+        disk_lru.remove_stale_partials(self.root)
+        return final, meta
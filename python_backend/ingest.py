@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Pipelined download and decode.
+
+Direct HTTP(S) media is fetched in ranged chunks. Every chunk is appended to
+the source file, hashed, and piped into ffmpeg at once, so decoding into the
+PCM store and building the peak pyramid run while the download is still in
+progress. The source keeps its native container; nothing is re-encoded.
+Download progress reports carry a low-resolution preview of the peaks decoded
+so far, so a client following a job sees the waveform grow.
+
+The PCM must come out as PCMStore's file decode would, since both are stored
+under the same content hash. Containers libsndfile reads (WAV, FLAC, Ogg,
+MP3...) keep ffmpeg's float output, but a decoder reading a pipe cannot trim
+the encoder padding at the end of an MP3, so the last frames are held back
+until the finished file's header gives the exact length. Lossless formats
+then match sample for sample. MP3 and Vorbis are decoded by ffmpeg here and
+by libsndfile from a file; the two agree to within 1e-5, under one 16-bit
+step, so which path stored a hash first only shows in float peaks and stats
+at that level. Everything else goes through audioread's 16-bit ffmpeg output
+on the file path, so the piped samples are rounded to the same grid and match
+exactly. If the lengths or formats disagree, or
+ffmpeg cannot decode the stream from a pipe (an MP4 with its index at the
+end, for instance), the download still completes and the caller decodes the
+finished file as usual. Fetch errors raise IngestError so the caller can fall
+back to a regular download.
+"""
+
+import hashlib
+import http.client
+import os
+import re
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+
+from jobs import no_progress
+from pcm_store import mono_mix, quantize_16bit, sndfile_info
+from waveform_peaks import PeakPyramidBuilder
+
+FETCH_CHUNK = 10 * 1024 ** 2  # Bytes per ranged request; yt-dlp uses the same size against throttling
+READ_SIZE = 256 * 1024
+DECODE_FRAMES = 1 << 16        # Frames per block read back from ffmpeg
+PREVIEW_POINTS = 1000          # Preview resolution for the whole file
+PREVIEW_INTERVAL = 1.0         # Seconds between previews
+PADDING_FRAMES = 1 << 13       # Trailing frames held back for trimming encoder padding
+TIMEOUT = 30
+
+INPUT_RE = re.compile(r"^Input #0, (.+), from ")
+OUTPUT_STREAM_RE = re.compile(r"Audio: pcm_f32le, (\d+) Hz, ([^,]+)")
+CHANNELS_RE = re.compile(r"^(\d+) channels")
+LAYOUT_RE = re.compile(r"^(\d+)\.(\d+)")
+NAMED_LAYOUTS = {'mono': 1, 'stereo': 2, 'downmix': 2, 'quad': 4, 'hexagonal': 6, 'octagonal': 8}
+# ffmpeg demuxers of containers libsndfile decodes itself (AudioStream's first choice)
+SNDFILE_DEMUXERS = {'wav', 'w64', 'aiff', 'flac', 'ogg', 'mp3', 'caf', 'au', 'voc'}
+
+
+class IngestError(Exception):
+    """The media could not be fetched; fall back to a regular download"""
+
+
+def direct_media(info):
+    """(url, http_headers) if a yt-dlp info dict resolves to one plain HTTP(S) file, else None"""
+    if info.get('requested_formats') or info.get('protocol') not in ('http', 'https'):
+        return None
+    if not info.get('url'):
+        return None
+    return info['url'], dict(info.get('http_headers') or {})
+
+
+def layout_channels(layout):
+    """Channel count of an ffmpeg channel layout description ('stereo', '5.1(side)', '3 channels')"""
+    layout = layout.strip()
+    match = CHANNELS_RE.match(layout)
+    if match:
+        return int(match.group(1))
+    name = layout.split('(')[0]
+    if name in NAMED_LAYOUTS:
+        return NAMED_LAYOUTS[name]
+    match = LAYOUT_RE.match(name)
+    if match:
+        return int(match.group(1)) + int(match.group(2))
+    return None
+
+
+def fetch_chunks(url, headers=None, chunk_size=FETCH_CHUNK, timeout=TIMEOUT):
+    """
+    Yield (data, total_bytes) pieces of the body at `url`.
+
+    Uses Range requests of `chunk_size` bytes while the server honours them,
+    else reads the single full response. `total_bytes` is None when unknown.
+    """
+    headers = dict(headers or {})
+    pos = 0
+    total = None
+    while total is None or pos < total:
+        request = urllib.request.Request(url, headers={**headers, 'Range': f'bytes={pos}-{pos + chunk_size - 1}'})
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and pos > 0:
+                return  # Past the end of a body whose size was not announced
+            raise IngestError(f"HTTP {e.code} fetching media") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise IngestError(f"Could not fetch media: {e}") from e
+
+        with response:
+            ranged = response.status == 206
+            length = response.headers.get('Content-Length')
+            length = int(length) if length and length.isdigit() else None
+            if ranged:
+                size = response.headers.get('Content-Range', '').rpartition('/')[2]
+                total = int(size) if size.isdigit() else None
+            else:
+                total = pos + length if length is not None else None
+            received = 0
+            try:
+                for data in iter(lambda: response.read(READ_SIZE), b''):
+                    received += len(data)
+                    yield data, total
+            except (OSError, http.client.HTTPException) as e:
+                raise IngestError(f"Media download interrupted: {e}") from e
+        # A connection closed early ends the body without an error
+        if length is not None and received < length:
+            raise IngestError(f"Media download interrupted after {pos + received} of {total or '?'} bytes")
+        pos += received
+        if not ranged or received == 0 or (total is None and received < chunk_size):
+            return
+
+
+class PipeDecoder:
+    """ffmpeg decoding a byte stream from stdin into float32 PCM on stdout"""
+
+    def __init__(self):
+        self.proc = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-nostats', '-i', 'pipe:0', '-map', '0:a:0',
+             '-f', 'f32le', '-acodec', 'pcm_f32le', 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.sample_rate = None
+        self.channels = None
+        self.demuxers = set()
+        self.broken = False  # ffmpeg stopped reading input
+        self.log = []
+        self._format = threading.Event()
+        self._stderr = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr.start()
+
+    def _read_stderr(self):
+        in_output = False
+        for raw in self.proc.stderr:
+            line = raw.decode('utf-8', 'replace').rstrip()
+            self.log = (self.log + [line])[-20:]
+            match = INPUT_RE.match(line)
+            if match:
+                self.demuxers = set(match.group(1).split(','))
+            elif line.startswith('Output #0'):
+                in_output = True
+            elif in_output and self.sample_rate is None:
+                match = OUTPUT_STREAM_RE.search(line)
+                if match:
+                    self.channels = layout_channels(match.group(2))
+                    self.sample_rate = int(match.group(1))
+                    self._format.set()
+        self._format.set()  # ffmpeg is gone; nothing more will be learnt
+
+    def wait_format(self):
+        """True once the output format is known; False if ffmpeg gave up first"""
+        self._format.wait()
+        return bool(self.sample_rate and self.channels)
+
+    @property
+    def sndfile(self):
+        """True if the file path would decode this container with libsndfile rather than audioread"""
+        return bool(self.demuxers & SNDFILE_DEMUXERS)
+
+    def feed(self, data):
+        if self.broken:
+            return
+        try:
+            self.proc.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            self.broken = True
+
+    def close_input(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+    def kill(self):
+        self.close_input()
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+    def finish(self):
+        """Wait for ffmpeg; True if it decoded the whole stream"""
+        code = self.proc.wait()
+        self._stderr.join()
+        return code == 0 and not self.broken
+
+
+class _Feeder(threading.Thread):
+    """Copies fetched chunks to the destination file, the hash and the decoder"""
+
+    def __init__(self, chunks, dest, decoder):
+        super().__init__(daemon=True)
+        self.chunks = chunks
+        self.dest = dest
+        self.decoder = decoder
+        self.digest = hashlib.sha256()
+        self.downloaded = 0
+        self.total = None
+        self.error = None
+        self.stop = threading.Event()
+
+    def run(self):
+        try:
+            with open(self.dest, 'wb') as out:
+                for data, total in self.chunks:
+                    if self.stop.is_set():
+                        return
+                    out.write(data)
+                    self.digest.update(data)
+                    self.downloaded += len(data)
+                    self.total = total
+                    self.decoder.feed(data)  # Blocks while ffmpeg is busy
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.decoder.close_input()
+
+
+def preview(builder, expected_frames):
+    """Min/max of what has been decoded so far, at PREVIEW_POINTS over the expected length"""
+    pyramid = builder.snapshot()
+    if pyramid is None:
+        return None
+    points = PREVIEW_POINTS
+    if expected_frames:
+        points = max(1, int(PREVIEW_POINTS * min(1.0, pyramid.length / expected_frames)))
+    peaks = pyramid.query(0, pyramid.length, points, exact=False)
+    return {
+        'seconds': round(pyramid.length / pyramid.sample_rate, 3),
+        'expected_duration': round(expected_frames / pyramid.sample_rate, 3) if expected_frames else None,
+        'min': np.round(peaks['min'].astype(np.float64), 3).tolist(),
+        'max': np.round(peaks['max'].astype(np.float64), 3).tolist(),
+    }
+
+
+def _match_file_decode(dest, pcm_path, decoder, frames):
+    """
+    Frame count of the piped PCM once cut to what decoding the finished file
+    gives (trimming MP3 end padding in place), or 0 if it cannot match.
+    """
+    header = sndfile_info(dest)
+    if (header is not None) != decoder.sndfile:
+        print("Streamed decode used a different decoder than the file would, decoding after download")
+        return 0
+    if header is None:
+        return frames  # Same ffmpeg decode as audioread's; nothing to trim
+    sample_rate, channels, expected = header
+    if (sample_rate, channels) != (decoder.sample_rate, decoder.channels) \
+            or not expected <= frames <= expected + PADDING_FRAMES:
+        print(f"Streamed decode gave {frames} frames at {decoder.sample_rate} Hz x {decoder.channels}, "
+              f"the file has {expected} at {sample_rate} Hz x {channels}; decoding after download")
+        return 0
+    if frames > expected:
+        os.truncate(pcm_path, expected * 4 * channels)
+    return expected
+
+
+def ingest(chunks, dest, scratch_dir, expected_duration=None, progress=no_progress):
+    """
+    Write (data, total) `chunks` to `dest` while decoding them.
+
+    Returns a dict with the source's `sha256` and `bytes`. If ffmpeg decoded
+    the stream, it also holds `pcm_path` (a .tmp file of float32 PCM in
+    `scratch_dir` for PCMStore.adopt), `sample_rate`, `channels`, `frames`
+    and the peak `pyramid`; otherwise `pcm_path` is None.
+    """
+    decoder = PipeDecoder()
+    feeder = _Feeder(chunks, dest, decoder)
+    pcm_path = os.path.join(scratch_dir, f"ingest-{uuid.uuid4().hex}.pcm.tmp")
+    frames = 0
+    builder = None
+    decoded = False
+    feeder.start()
+    try:
+        reported_at = 0.0
+
+        def report(force=False):
+            nonlocal reported_at
+            now = time.monotonic()
+            if not force and now - reported_at < PREVIEW_INTERVAL:
+                return
+            reported_at = now
+            expected = None
+            if builder and expected_duration:
+                expected = expected_duration * builder.sample_rate
+            elif builder and feeder.total and feeder.downloaded:
+                # No duration from the extractor: extrapolate from the bytes decoded so far
+                expected = builder.length * feeder.total / feeder.downloaded
+            progress('download', feeder.downloaded, feeder.total,
+                     preview=preview(builder, expected) if builder else None)
+
+        if decoder.wait_format():
+            builder = PeakPyramidBuilder(decoder.sample_rate)
+            frame_bytes = 4 * decoder.channels
+            held = np.zeros(0, dtype=np.float32)  # Mono tail not yet in the pyramid
+            with open(pcm_path, 'wb') as out:
+                carry = b''
+                while True:
+                    data = decoder.proc.stdout.read(DECODE_FRAMES * frame_bytes)
+                    if not data:
+                        break
+                    data = carry + data
+                    usable = len(data) - len(data) % frame_bytes
+                    carry = data[usable:]
+                    block = np.frombuffer(data[:usable], dtype='<f4').reshape(-1, decoder.channels)
+                    if not decoder.sndfile:
+                        block = quantize_16bit(block)
+                    out.write(block.tobytes())
+                    held = np.concatenate([held, mono_mix(block)])
+                    if len(held) > PADDING_FRAMES:
+                        builder.add(held[:-PADDING_FRAMES])
+                        held = held[-PADDING_FRAMES:]
+                    frames += len(block)
+                    report()
+        else:
+            decoder.proc.stdout.read()  # Nothing decodable; drain so ffmpeg can exit
+
+        while feeder.is_alive():
+            feeder.join(PREVIEW_INTERVAL)
+            report()
+        if feeder.error is not None:
+            raise feeder.error
+        decoded = decoder.finish() and frames > 0
+        if not decoded:
+            print(f"Streaming decode unavailable, decoding after download: {' | '.join(decoder.log[-3:])}")
+        else:
+            frames = _match_file_decode(dest, pcm_path, decoder, frames)
+            decoded = frames > 0
+            if decoded:
+                builder.add(held[:frames - builder.length])
+        report(force=True)
+    except BaseException:
+        feeder.stop.set()
+        decoder.kill()
+        feeder.join()
+        for path in (pcm_path, dest):  # A partial source would pass for a finished one
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        decoder.kill()
+
+    result = {'sha256': feeder.digest.hexdigest(), 'bytes': feeder.downloaded, 'pcm_path': None}
+    if decoded:
+        result.update(pcm_path=pcm_path, sample_rate=decoder.sample_rate, channels=decoder.channels,
+                      frames=frames, pyramid=builder.finish())
+    elif os.path.exists(pcm_path):
+        os.remove(pcm_path)
+    return result
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+In-process job queue with per-stage progress.
+
+Long-running work (download, decode, render, export) runs on a small thread
+pool instead of inside the HTTP request. Each job's state is mirrored to a
+JSON file in `jobs_dir`, and cancellation is a marker file next to it, so a
+status request or cancel served by another worker process sees the same job
+without Redis or any other outside service.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import disk_lru
+
+TERMINAL_STATES = ('succeeded', 'failed', 'cancelled')
+
+
+def no_progress(stage, current=None, total=None, preview=None):
+    """Progress callback for work run outside a job; takes what Job.report does"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation has been requested"""
+
+
+class Job:
+    WRITE_INTERVAL = 0.25  # Seconds between progress-only status file writes
+
+    def __init__(self, manager, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.stage = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.version = 0
+        self._manager = manager
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+        self._written_at = 0.0
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at,
+        }
+
+    @property
+    def cancelled(self):
+        if not self._cancel.is_set() and os.path.exists(self._manager.cancel_path(self.id)):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def report(self, stage, current=None, total=None, preview=None):
+        """
+        Record progress for a stage; also the cancellation point for running work.
+
+        `preview` is partial output to show before the stage ends (e.g. the
+        peaks decoded so far while downloading).
+        """
+        self.check_cancelled()
+        entry = {}
+        if current is not None:
+            entry['current'] = current
+        if total:
+            entry['total'] = total
+            entry['percent'] = round(100.0 * current / total, 1) if current is not None else None
+        if preview is not None:
+            entry['preview'] = preview
+        self._set(stage=stage, progress={**self.progress, stage: entry}, force=stage != self.stage)
+
+    def _set(self, force=True, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.updated_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+        if force or self.updated_at - self._written_at >= self.WRITE_INTERVAL:
+            self._written_at = self.updated_at
+            self._manager.write_status(self)
+
+    def wait_for_change(self, version, timeout):
+        """Block until the job changes past `version` or `timeout` expires"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout=timeout)
+            return self.version
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and tracks their state"""
+
+    def __init__(self, jobs_dir, workers=2, ttl=3600):
+        self.jobs_dir = jobs_dir
+        self.ttl = ttl
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def status_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def cancel_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.cancel")
+
+    def write_status(self, job):
+        tmp = f"{self.status_path(job.id)}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp, self.status_path(job.id))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write job status {job.id}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """Queue `fn(job, *args, **kwargs)`; its return value becomes the job result"""
+        self._expire()
+        job = Job(self, kind)
+        with self._lock:
+            self._jobs[job.id] = job
+        self.write_status(job)
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        try:
+            job.check_cancelled()
+            job._set(status='running')
+            result = fn(job, *args, **kwargs)
+            job.check_cancelled()
+            job._set(status='succeeded', stage='done', result=result)
+        except JobCancelled:
+            job._set(status='cancelled')
+        except Exception as e:
+            if job.cancelled:
+                job._set(status='cancelled')
+            else:
+                print(f"Job {job.id} failed: {e}")
+                job._set(status='failed', error=str(e))
+
+    def get(self, job_id):
+        """Live Job from this process, else None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """Job state as a dict, from memory or from the shared status file"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        try:
+            with open(self.status_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def cancel(self, job_id):
+        """Request cancellation; returns the job state or None if unknown"""
+        state = self.status(job_id)
+        if state is None:
+            return None
+        if state['status'] not in TERMINAL_STATES:
+            open(self.cancel_path(job_id), 'w').close()
+            job = self.get(job_id)
+            if job is not None:
+                job._cancel.set()
+                if job.status == 'queued':
+                    job._set(status='cancelled')
+        state = self.status(job_id)
+        state['cancel_requested'] = True
+        return state
+
+    def events(self, job_id, heartbeat=15.0):
+        """Yield server-sent events for a job until it finishes"""
+        job = self.get(job_id)
+        last_sent = None
+        last_yield = time.time()
+        while True:
+            if job is not None:
+                version = job.version
+                state = job.to_dict()
+            else:
+                # Job runs in another worker process: follow its status file
+                state = self.status(job_id)
+                if state is None:
+                    return
+            now = time.time()
+            if state != last_sent:
+                yield f"event: {state['status']}\ndata: {json.dumps(state)}\n\n"
+                last_sent, last_yield = state, now
+            elif now - last_yield >= heartbeat:
+                yield ": keep-alive\n\n"
+                last_yield = now
+            if state['status'] in TERMINAL_STATES:
+                return
+            if job is not None:
+                job.wait_for_change(version, heartbeat)
+            else:
+                time.sleep(0.5)
+
+    def _expire(self):
+        """Forget finished jobs older than the TTL, in memory and on disk"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.status in TERMINAL_STATES and job.updated_at < cutoff:
+                    del self._jobs[job_id]
+        disk_lru.remove_stale_partials(self.jobs_dir)
+        try:
+            names = os.listdir(self.jobs_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Bounded concurrency per resource, with backpressure.
+
+Each heavy resource (network downloads, CPU-bound decode/render/analysis,
+segment encoding) gets a `Limiter` with a fixed number of slots. Work waits
+for a slot in a bounded queue for at most a deadline; past that, or when the
+queue is already full, `Overloaded` is raised and the server answers 429 with
+a Retry-After estimated from how long slots are usually held. Background jobs
+and already-started streams wait without a deadline (`waiting(None)`).
+
+Slots are re-entrant per thread, so a stage that holds one can call another
+stage guarded by the same limiter without deadlocking.
+"""
+
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+import metrics
+
+_DEFAULT = object()
+_patience = contextvars.ContextVar('limit_patience', default=_DEFAULT)
+
+
+class Overloaded(Exception):
+    """A resource stayed saturated past the queue deadline"""
+
+    def __init__(self, resource, retry_after):
+        super().__init__(f"Server busy ({resource}); retry in {retry_after}s")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+@contextlib.contextmanager
+def waiting(timeout):
+    """Queue for slots up to `timeout` seconds (None: no deadline) inside this block"""
+    token = _patience.set(timeout)
+    try:
+        yield
+    finally:
+        _patience.reset(token)
+
+
+class Limiter:
+    """`slots` concurrent holders; up to `max_queue` more wait at most `timeout` seconds"""
+
+    def __init__(self, name, slots, max_queue=16, timeout=10.0):
+        self.name = name
+        self.slots = max(1, slots)
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self._hold = 1.0  # Moving average of seconds a slot is held
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def retry_after(self):
+        """Seconds until a queued request would likely get a slot"""
+        return int(min(60, max(1, math.ceil(self._hold * (self.queued + 1) / self.slots))))
+
+    def patience(self):
+        """Seconds the current caller may wait on this resource (None: no deadline)"""
+        timeout = _patience.get()
+        return self.timeout if timeout is _DEFAULT else timeout
+
+    def reject(self):
+        """Count a rejection and raise Overloaded"""
+        metrics.limiter_rejected(self.name)
+        raise Overloaded(self.name, self.retry_after())
+
+    def _acquire(self):
+        timeout = self.patience()
+        start = time.monotonic()
+        with self._cond:
+            if self.active >= self.slots:
+                if timeout is not None and (timeout <= 0 or self.queued >= self.max_queue):
+                    self.reject()
+                self.queued += 1
+                try:
+                    while self.active >= self.slots:
+                        remaining = None if timeout is None else start + timeout - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            self.reject()
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.active += 1
+        metrics.limiter_wait(self.name, time.monotonic() - start)
+
+    def _release(self, held):
+        with self._cond:
+            self.active -= 1
+            self._hold = 0.8 * self._hold + 0.2 * held
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one slot for the duration of the block"""
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+
+        self._acquire()
+        self._local.depth = 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            self._release(time.monotonic() - start)
+
+
+class _Unlimited:
+    name = 'unlimited'
+
+    def patience(self):
+        return None
+
+    @contextlib.contextmanager
+    def slot(self):
+        yield
+
+
+UNLIMITED = _Unlimited()
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test of the HTTP API, fully offline.
+
+A local HTTP server stands in for the internet: it serves synthetic WAV files
+(benchmark.py's signal) of several lengths with Range support, which yt-dlp's
+generic extractor resolves as direct media links. The backend is started with
+serve.py on a free port and scratch cache directories (or an already running
+one is targeted with --backend), every source is processed once to get asset
+ids to split, and then a number of concurrent clients send a weighted mix of
+
+    metadata   POST /metadata for a source URL
+    process    POST /process-audio for a source URL
+    split      POST /split-audio of a processed source at random points
+
+for a fixed time or number of requests. The report gives per-endpoint latency
+percentiles, error and 429 rates, throughput, and the server's memory over
+time (RSS and PSS summed over the master and its workers, sampled from /proc
+when the backend was started here or --server-pid is given).
+
+    python load_test.py --clients 8 --duration 60
+    python load_test.py --mix process=1,split=3 --lengths 60,600 --unique-urls
+    python load_test.py --backend http://127.0.0.1:5000 --server-pid 1234 --requests 200
+"""
+
+import argparse
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import requests
+
+from benchmark import synthetic_file
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WORK_DIR = os.path.join(tempfile.gettempdir(), 'audio_splitter_load')
+OPERATIONS = ('metadata', 'process', 'split')
+DEFAULT_MIX = 'metadata=1,process=1,split=2'
+PERCENTILES = (50, 90, 99)
+MAX_ERROR_SAMPLES = 5
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    """Static WAV files from the server's root, with single byte ranges"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _resolve(self):
+        name = os.path.basename(self.path.split('?')[0])
+        path = os.path.join(self.server.root, name)
+        return path if name and os.path.isfile(path) else None
+
+    def _empty(self, status, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _respond(self, body):
+        path = self._resolve()
+        if path is None:
+            return self._empty(404)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start >= size:
+                return self._empty(416, [('Content-Range', f'bytes */{size}')])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'audio/wav')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not body:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            while left > 0:
+                data = f.read(min(1 << 16, left))
+                if not data:
+                    break
+                left -= len(data)
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+
+    def do_GET(self):
+        self._respond(body=True)
+
+    def do_HEAD(self):
+        self._respond(body=False)
+
+
+def start_media_server(root):
+    """Serve `root` on a free local port in a background thread; returns (server, base_url)"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    server.daemon_threads = True
+    server.root = root
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(work_dir, workers, timeout=120):
+    """serve.py on a free port with its caches under `work_dir`; returns (process, base_url)"""
+    port = free_port()
+    state = os.path.join(work_dir, 'backend')
+    shutil.rmtree(state, ignore_errors=True)
+    env = dict(os.environ)
+    for name, sub in (('AUDIO_PCM_STORE_DIR', 'pcm'), ('AUDIO_DOWNLOAD_CACHE_DIR', 'downloads'),
+                      ('AUDIO_ASSETS_DIR', 'assets'), ('AUDIO_JOBS_DIR', 'jobs'),
+                      ('AUDIO_SEGMENT_CACHE_DIR', 'segments')):
+        env[name] = os.path.join(state, sub)
+    os.makedirs(state)
+    log = open(os.path.join(work_dir, 'backend.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, 'serve.py'), '--host', '127.0.0.1',
+                                '--port', str(port), '--workers', str(workers)],
+                               env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with status {process.returncode}; see {work_dir}/backend.log")
+        try:
+            requests.get(f"{base_url}/metrics", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('Backend did not start in time')
+
+
+def stop_backend(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def process_tree(pid):
+    """`pid` and all its descendants, from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after its closing parenthesis
+                ppid = int(f.read().rpartition(')')[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def memory_kb(pid):
+    """(RSS, PSS) of one process in KiB; PSS splits pages shared with forked workers"""
+    rss = pss = 0
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Rss:'):
+                    rss = int(line.split()[1])
+                elif line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+    except OSError:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss = pss = int(line.split()[1])
+        except OSError:
+            pass
+    return rss, pss
+
+
+class MemorySampler:
+    """Samples the summed memory of a server process tree every `interval` seconds"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._start = time.monotonic()
+
+    def _run(self):
+        while not self._stop.is_set():
+            pids = process_tree(self.pid)
+            totals = [sum(values) for values in zip(*(memory_kb(pid) for pid in pids))] or [0, 0]
+            self.samples.append({'t': round(time.monotonic() - self._start, 2), 'processes': len(pids),
+                                 'rss_mb': round(totals[0] / 1024, 1), 'pss_mb': round(totals[1] / 1024, 1)})
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def parse_mix(text):
+    """'metadata=1,process=2' -> {'metadata': 1.0, 'process': 2.0}"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name!r}; use {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError('The mix needs at least one operation with a positive weight')
+    return mix
+
+
+class LoadTest:
+    """Clients sharing the sources, processed assets and the result log"""
+
+    def __init__(self, backend, sources, mix, args):
+        self.backend = backend
+        self.sources = sources          # [(url, duration)]
+        self.assets = []                # [(asset_id, duration)]
+        self.mix = mix
+        self.args = args
+        self.results = []               # (operation, start offset, seconds, status, error)
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._counter = 0
+
+    def source_url(self, url):
+        """The source URL, made unique per request with --unique-urls to miss the URL-keyed caches"""
+        if not self.args.unique_urls:
+            return url
+        with self._lock:
+            self._counter += 1
+            return f"{url}?r={self._counter}"
+
+    def request(self, session, operation, rng):
+        if operation == 'metadata':
+            url, _ = rng.choice(self.sources)
+            return session.post(f"{self.backend}/metadata", json={'url': self.source_url(url)},
+                                timeout=self.args.timeout)
+        if operation == 'process':
+            url, _ = rng.choice(self.sources)
+            return session.post(f"{self.backend}/process-audio", json={'url': self.source_url(url)},
+                                timeout=self.args.timeout)
+        asset_id, duration = rng.choice(self.assets)
+        points = sorted(round(rng.uniform(0, duration), 2) for _ in range(self.args.splits))
+        return session.post(f"{self.backend}/split-audio", timeout=self.args.timeout,
+                            json={'asset_id': asset_id, 'split_points': points, 'format': self.args.format})
+
+    def prepare(self):
+        """Process every source once, so splits have assets from the start"""
+        with requests.Session() as session:
+            for url, duration in self.sources:
+                response = session.post(f"{self.backend}/process-audio", json={'url': url},
+                                        timeout=self.args.timeout)
+                if response.status_code != 200:
+                    raise RuntimeError(f"Processing {url} failed: {response.status_code} {response.text[:200]}")
+                self.assets.append((response.json()['asset_id'], duration))
+
+    def _next(self, deadline):
+        with self._lock:
+            if self.args.requests and self._issued >= self.args.requests:
+                return False
+            if deadline and time.monotonic() >= deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def client(self, index, started, deadline):
+        rng = random.Random(self.args.seed * 1000 + index)
+        operations = list(self.mix)
+        weights = [self.mix[name] for name in operations]
+        with requests.Session() as session:
+            while self._next(deadline):
+                operation = rng.choices(operations, weights)[0]
+                start = time.monotonic()
+                status, error = None, None
+                try:
+                    response = self.request(session, operation, rng)
+                    status = response.status_code
+                    if status != 200:
+                        error = response.text[:200]
+                except requests.RequestException as e:
+                    error = f"{type(e).__name__}: {e}"
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self.results.append((operation, start - started, elapsed, status, error))
+
+    def run(self):
+        started = time.monotonic()
+        deadline = started + self.args.duration if self.args.duration else None
+        clients = [threading.Thread(target=self.client, args=(i, started, deadline))
+                   for i in range(self.args.clients)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        return time.monotonic() - started
+
+
+def summarize(results, wall):
+    """Per-operation and overall latency, error and throughput figures"""
+    report = {}
+    for operation in OPERATIONS + ('all',):
+        rows = [r for r in results if operation in ('all', r[0])]
+        if not rows:
+            continue
+        latencies = np.array([r[2] for r in rows])
+        ok = [r for r in rows if r[3] == 200]
+        rejected = sum(1 for r in rows if r[3] == 429)
+        failed = len(rows) - len(ok) - rejected
+        entry = {
+            'requests': len(rows),
+            'ok': len(ok),
+            'rejected_429': rejected,
+            'errors': failed,
+            'error_rate': round(failed / len(rows), 4),
+            'throughput_rps': round(len(ok) / wall, 3) if wall > 0 else None,
+            'mean_s': round(float(latencies.mean()), 3),
+            'max_s': round(float(latencies.max()), 3),
+            'statuses': dict(Counter(str(r[3]) for r in rows)),
+        }
+        for p in PERCENTILES:
+            entry[f'p{p}_s'] = round(float(np.percentile(latencies, p)), 3)
+        entry['error_samples'] = [r[4] for r in rows if r[3] not in (200, 429)][:MAX_ERROR_SAMPLES]
+        report[operation] = entry
+    return report
+
+
+def print_report(summary, wall, memory):
+    header = f"{'operation':<10} {'requests':>8} {'ok':>6} {'429':>5} {'errors':>6} {'req/s':>7}"
+    header += ''.join(f" {f'p{p}':>8}" for p in PERCENTILES) + f" {'max':>8}"
+    print(header)
+    for operation, entry in summary.items():
+        row = (f"{operation:<10} {entry['requests']:>8} {entry['ok']:>6} {entry['rejected_429']:>5} "
+               f"{entry['errors']:>6} {entry['throughput_rps']:>7}")
+        row += ''.join(f" {entry[f'p{p}_s']:>7}s" for p in PERCENTILES) + f" {entry['max_s']:>7}s"
+        print(row)
+    print(f"\nWall time: {wall:.1f}s")
+    if memory:
+        peak_rss = max(s['rss_mb'] for s in memory)
+        peak_pss = max(s['pss_mb'] for s in memory)
+        print(f"Server memory: {memory[0]['pss_mb']} MB PSS at start, peak {peak_pss} MB PSS / {peak_rss} MB RSS, "
+              f"{memory[-1]['pss_mb']} MB PSS at the end ({len(memory)} samples)")
+    for operation, entry in summary.items():
+        if operation != 'all':
+            for error in entry['error_samples']:
+                print(f"  {operation} error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test of the API against local synthetic media')
+    parser.add_argument('--clients', type=int, default=4, help='Concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run (0: until --requests)')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0: no limit)')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Operation weights, from {', '.join(OPERATIONS)}")
+    parser.add_argument('--lengths', default='30,120,600', help='Comma-separated source lengths in seconds')
+    parser.add_argument('--splits', type=int, default=4, help='Random split points per split request')
+    parser.add_argument('--format', default='mp3', help='Output format of split requests')
+    parser.add_argument('--unique-urls', action='store_true',
+                        help='Add a unique query to every source URL so URL-keyed caches miss')
+    parser.add_argument('--backend', help='Base URL of a running backend (default: start serve.py)')
+    parser.add_argument('--server-pid', type=int, help='PID of that backend, to sample its memory')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes of the started backend')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='Seconds between memory samples')
+    parser.add_argument('--timeout', type=float, default=300, help='Seconds before a request is abandoned')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR, help='Where synthetic sources and backend state go')
+    parser.add_argument('--output', help='Also write the report as JSON here')
+    parser.add_argument('--max-error-rate', type=float, default=0.0,
+                        help='Exit 1 if the share of failed requests (not counting 429s) is higher')
+    args = parser.parse_args()
+
+    if not args.duration and not args.requests:
+        parser.error('Give --duration or --requests')
+    try:
+        mix = parse_mix(args.mix)
+        lengths = [float(x) for x in args.lengths.split(',')]
+    except ValueError as e:
+        parser.error(str(e))
+
+    media_dir = os.path.join(args.work_dir, 'media')
+    os.makedirs(media_dir, exist_ok=True)
+    print(f"Generating {len(lengths)} sources in {media_dir}")
+    files = [synthetic_file(media_dir, length, 44100, 2) for length in lengths]
+    media_server, media_url = start_media_server(media_dir)
+    sources = [(f"{media_url}/{os.path.basename(path)}", length) for path, length in zip(files, lengths)]
+
+    backend_process = None
+    backend, server_pid = args.backend, args.server_pid
+    if not backend:
+        print(f"Starting backend with {args.workers} workers")
+        backend_process, backend = start_backend(args.work_dir, args.workers)
+        server_pid = backend_process.pid
+
+    sampler = MemorySampler(server_pid, args.sample_interval).start() if server_pid else None
+    try:
+        test = LoadTest(backend.rstrip('/'), sources, mix, args)
+        prepare_start = time.monotonic()
+        test.prepare()
+        prepare_wall = time.monotonic() - prepare_start
+        print(f"Processed {len(sources)} sources in {prepare_wall:.1f}s; "
+              f"running {args.clients} clients against {backend}")
+        wall = test.run()
+    finally:
+        memory = sampler.stop() if sampler else []
+        if backend_process:
+            stop_backend(backend_process)
+        media_server.shutdown()
+
+    summary = summarize(test.results, wall)
+    print_report(summary, wall, memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'prepare_s': round(prepare_wall, 3), 'wall_s': round(wall, 3),
+                       'summary': summary, 'memory': memory}, f, indent=2)
+    if not test.results:
+        sys.exit(1)
+    sys.exit(1 if summary['all']['error_rate'] > args.max_error_rate else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+In-process cache for URL metadata.
+
+Entries live for `ttl` seconds, with at most `max_entries` URLs kept
+(least recently used first out). Concurrent lookups of the same URL share one
+extraction. Direct audio URLs usually expire much sooner than the rest of the
+metadata (YouTube signs them for a few hours), so they carry their own expiry
+and are re-resolved on their own while the cached title, duration etc. are kept.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from download_cache import normalize_url
+from single_flight import KeyLocks
+
+EXPIRY_MARGIN = 60  # Re-resolve direct URLs this many seconds before they expire
+
+
+def audio_url_expiry(direct_url, resolved_at, default_ttl):
+    """When a signed direct URL stops working, from its expire/Expires parameter if any"""
+    if direct_url:
+        query = parse_qs(urlsplit(direct_url).query)
+        for name in ('expire', 'Expires', 'X-Amz-Expires'):
+            try:
+                value = int(query[name][0])
+            except (KeyError, ValueError):
+                continue
+            # X-Amz-Expires is relative to signing; the others are epoch seconds
+            expires = resolved_at + value if name == 'X-Amz-Expires' else value
+            return expires - EXPIRY_MARGIN
+    return resolved_at + default_ttl
+
+
+class MetadataCache:
+    """
+    Metadata dicts by URL.
+
+    `fetch(url)` returns the full metadata dict; `resolve_audio_url(url)` returns
+    just (direct_audio_url, format) for refreshing an expired direct URL.
+    """
+
+    def __init__(self, fetch, resolve_audio_url, ttl=6 * 3600, max_entries=512,
+                 audio_url_ttl=1800, workers=4):
+        self.fetch = fetch
+        self.resolve_audio_url = resolve_audio_url
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.audio_url_ttl = audio_url_ttl
+        self.workers = workers
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+        self._pool = None
+
+    def _lookup(self, key):
+        """Cached entry for key (None if missing or stale)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() >= entry['fetched_at'] + self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _usable(self, entry):
+        return entry is not None and (not entry['metadata'].get('direct_audio_url')
+                                      or time.time() < entry['audio_expires'])
+
+    def get(self, url):
+        """Metadata for `url`, extracting it at most once per TTL"""
+        key = normalize_url(url)
+
+        def usable():
+            entry = self._lookup(key)
+            return entry if self._usable(entry) else None
+
+        def compute():
+            entry = self._lookup(key)
+            entry = self._fetch(url) if entry is None else self._refresh_audio_url(url, entry)
+            self._store(key, entry)
+            return entry
+
+        entry, hit = self._key_locks.get_or_compute(key, usable, compute)
+        metrics.cache_result('metadata', hit)
+        return dict(entry['metadata'])
+
+    def _fetch(self, url):
+        now = time.time()
+        metadata = self.fetch(url)
+        return {
+            'metadata': metadata,
+            'fetched_at': now,
+            'audio_expires': audio_url_expiry(metadata.get('direct_audio_url'), now, self.audio_url_ttl),
+        }
+
+    def _refresh_audio_url(self, url, entry):
+        now = time.time()
+        direct_url, fmt = self.resolve_audio_url(url)
+        metadata = dict(entry['metadata'], direct_audio_url=direct_url)
+        if fmt:
+            metadata['format'] = fmt
+        return {
+            'metadata': metadata,
+            'fetched_at': entry['fetched_at'],
+            'audio_expires': audio_url_expiry(direct_url, now, self.audio_url_ttl),
+        }
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='metadata')
+            return self._pool
+
+    def get_many(self, urls):
+        """Resolve many URLs concurrently; one {'url', 'metadata'|'error'} per URL, in order"""
+        def resolve(url):
+            try:
+                return {'url': url, 'metadata': self.get(url)}
+            except Exception as e:
+                return {'url': url, 'error': str(e)}
+
+        return list(self._get_pool().map(resolve, urls))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
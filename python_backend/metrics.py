@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Lightweight pipeline instrumentation in Prometheus text format.
+
+`stage(name)` wraps a pipeline stage and records its duration, the bytes it
+processed and how much it raised the process's peak RSS. `cache_result`
+counts cache hits and misses. Metrics are per process, like prometheus_client
+without its multiprocess mode; scrape every worker.
+
+Recording costs a perf_counter, a getrusage call and a short lock per stage.
+With AUDIO_METRICS=0 `stage` returns a shared no-op and nothing is recorded.
+With AUDIO_SERVER_TIMING=1 stages run inside an HTTP request are also
+reported in its `Server-Timing` header.
+"""
+
+import bisect
+import contextvars
+import os
+import resource
+import threading
+import time
+
+ENABLED = os.environ.get('AUDIO_METRICS', '1') != '0'
+SERVER_TIMING = ENABLED and os.environ.get('AUDIO_SERVER_TIMING', '0') == '1'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+MEMORY_BUCKETS = tuple(float(1 << n) for n in range(20, 33, 2))  # 1 MiB to 4 GiB
+
+_timings = contextvars.ContextVar('server_timings', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_number(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            if i < len(self.buckets):
+                series[i] += 1  # Larger values only show up in +Inf, which is the count
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _format_labels(self.labels, values, [f'le="{_format_number(float(bound))}"'])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _format_labels(self.labels, values, ['le="+Inf"'])
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                labels = _format_labels(self.labels, values)
+                lines.append(f"{self.name}_sum{labels} {_format_number(float(series[-2]))}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('audio_stage_duration_seconds', 'Time spent in each pipeline stage.', ('stage',))
+STAGE_BYTES = Counter('audio_stage_bytes_total', 'Bytes read or written by each pipeline stage.', ('stage',))
+STAGE_ERRORS = Counter('audio_stage_errors_total', 'Pipeline stages that raised.', ('stage',))
+STAGE_MEMORY = Histogram('audio_stage_peak_rss_delta_bytes',
+                         'Growth of the process peak RSS during a stage (0 when it stayed under the old peak).',
+                         ('stage',), MEMORY_BUCKETS)
+CACHE_REQUESTS = Counter('audio_cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+HTTP_SECONDS = Histogram('audio_http_request_duration_seconds', 'HTTP request latency.',
+                         ('endpoint', 'method', 'status'))
+LIMIT_WAIT_SECONDS = Histogram('audio_limiter_wait_seconds', 'Time spent queued for a resource slot.',
+                               ('resource',))
+LIMIT_REJECTIONS = Counter('audio_limiter_rejections_total',
+                           'Requests turned away because a resource was saturated.', ('resource',))
+ALL_METRICS = (STAGE_SECONDS, STAGE_BYTES, STAGE_ERRORS, STAGE_MEMORY, CACHE_REQUESTS, HTTP_SECONDS,
+               LIMIT_WAIT_SECONDS, LIMIT_REJECTIONS)
+
+
+def _peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage:
+    """Context manager timing one stage; `add_bytes` records data processed"""
+
+    __slots__ = ('name', 'nbytes', '_start', '_rss')
+
+    def __init__(self, name, nbytes=0):
+        self.name = name
+        self.nbytes = nbytes
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self._rss = _peak_rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        STAGE_SECONDS.observe(elapsed, self.name)
+        STAGE_MEMORY.observe(_peak_rss_bytes() - self._rss, self.name)
+        if self.nbytes:
+            STAGE_BYTES.inc(self.name, amount=self.nbytes)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(self.name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+
+class _NullStage:
+    def add_bytes(self, nbytes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+def stage(name, nbytes=0):
+    """Time a pipeline stage: `with metrics.stage('decode') as s: ...`"""
+    return Stage(name, nbytes) if ENABLED else NULL_STAGE
+
+
+def cache_result(cache, hit):
+    if ENABLED:
+        CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+def limiter_wait(resource, seconds):
+    if ENABLED:
+        LIMIT_WAIT_SECONDS.observe(seconds, resource)
+
+
+def limiter_rejected(resource):
+    if ENABLED:
+        LIMIT_REJECTIONS.inc(resource)
+
+
+def observe_request(endpoint, method, status, seconds):
+    if ENABLED:
+        HTTP_SECONDS.observe(seconds, endpoint, method, str(status))
+
+
+def begin_request():
+    """Start collecting stage timings for the current request; returns a reset token"""
+    return _timings.set([]) if SERVER_TIMING else None
+
+
+def end_request(token):
+    """`Server-Timing` header value for the request (or None) and stop collecting"""
+    if token is None:
+        return None
+    timings = _timings.get() or []
+    _timings.reset(token)
+    if not timings:
+        return None
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
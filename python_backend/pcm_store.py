@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Decode-once PCM store.
+
+Each source file is decoded a single time into raw float32 PCM on disk, keyed
+by a hash of its content. Later stages (peaks, rendering, slicing, analysis)
+read that file through `np.memmap`, so repeated work on the same source costs
+page-cache reads instead of fresh decodes and full in-memory copies.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import audioread
+import numpy as np
+import soundfile
+
+import disk_lru
+import limits
+import metrics
+from single_flight import KeyLocks
+
+BLOCK_FRAMES = 1 << 18  # Frames per decoded block (~6s at 44.1kHz)
+
+
+class AudioStream:
+    """Decode an audio file block by block as float32 (frames, channels) arrays"""
+
+    def __init__(self, path):
+        self.path = path
+        self._sf = None
+        self._ar = None
+        # Same backend order as librosa.load: libsndfile first, then audioread/ffmpeg
+        try:
+            self._sf = soundfile.SoundFile(path)
+            self.sample_rate = self._sf.samplerate
+            self.channels = self._sf.channels
+        except Exception:
+            self._ar = audioread.audio_open(path)
+            self.sample_rate = self._ar.samplerate
+            self.channels = self._ar.channels
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._sf is not None:
+            self._sf.close()
+        if self._ar is not None:
+            self._ar.close()
+
+    def blocks(self, block_frames=BLOCK_FRAMES):
+        """Yield float32 blocks of at most `block_frames` frames"""
+        if self._sf is not None:
+            while True:
+                block = self._sf.read(block_frames, dtype='float32', always_2d=True)
+                if not len(block):
+                    return
+                yield block
+            return
+
+        # audioread hands out small int16 buffers; coalesce them into blocks
+        block_bytes = block_frames * self.channels * 2
+        pending = []
+        pending_bytes = 0
+        for buf in self._ar:
+            pending.append(buf)
+            pending_bytes += len(buf)
+            if pending_bytes >= block_bytes:
+                yield self._to_float(b''.join(pending))
+                pending, pending_bytes = [], 0
+        if pending_bytes:
+            yield self._to_float(b''.join(pending))
+
+    def _to_float(self, data):
+        ints = np.frombuffer(data, dtype='<i2')
+        ints = ints[:len(ints) - len(ints) % self.channels]
+        return (ints.astype(np.float32) / 32768.0).reshape(-1, self.channels)
+
+
+def sndfile_info(path):
+    """(sample_rate, channels, frames) from the header if libsndfile reads `path`, else None"""
+    try:
+        info = soundfile.info(path)
+    except Exception:
+        return None
+    return info.samplerate, info.channels, info.frames
+
+
+def quantize_16bit(block):
+    """Round float samples to the 16-bit values audioread would have produced"""
+    return np.clip(np.rint(block * 32768), -32768, 32767).astype(np.float32) / np.float32(32768)
+
+
+def mono_mix(block):
+    """Down-mix a (frames, channels) block the way librosa.to_mono does"""
+    if block.shape[1] == 1:
+        return block[:, 0]
+    return np.mean(block, axis=1, dtype=np.float32)
+
+
+class MonoView:
+    """Read-only mono view of a multi-channel memmap supporting fancy indexing"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        return mono_mix(np.asarray(self.samples[idx]).reshape(-1, self.samples.shape[1]))
+
+
+class PCMEntry:
+    """A decoded source: float32 PCM on disk plus its format"""
+
+    def __init__(self, key, pcm_path, sample_rate, channels, frames):
+        self.key = key
+        self.pcm_path = pcm_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frames = frames
+        if frames:
+            self.samples = np.memmap(pcm_path, dtype=np.float32, mode='r',
+                                     shape=(frames, channels))
+        else:
+            self.samples = np.zeros((0, channels), dtype=np.float32)
+
+    @property
+    def duration(self):
+        return self.frames / self.sample_rate if self.sample_rate else 0.0
+
+    @property
+    def mono(self):
+        """Mono signal indexable like a 1-D array, without materializing it"""
+        if self.channels == 1:
+            return self.samples[:, 0]
+        return MonoView(self.samples)
+
+    def read_mono(self, start=0, end=None):
+        """Read a mono range [start, end) into memory"""
+        end = self.frames if end is None else min(end, self.frames)
+        return np.ascontiguousarray(mono_mix(self.samples[start:end]), dtype=np.float32)
+
+    def mono_blocks(self, start=0, end=None, block_frames=BLOCK_FRAMES):
+        """Yield the mono range [start, end) in blocks"""
+        end = self.frames if end is None else min(end, self.frames)
+        for pos in range(start, end, block_frames):
+            yield self.read_mono(pos, min(pos + block_frames, end))
+
+
+class PCMStore:
+    """Content-hash keyed store of decoded PCM with size-bounded LRU eviction"""
+
+    MAX_HASHED_FILES = 256
+
+    def __init__(self, root, max_bytes, limiter=limits.UNLIMITED):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.limiter = limiter  # Bounds concurrent decodes
+        os.makedirs(root, exist_ok=True)
+        disk_lru.remove_stale_partials(root)
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+
+    @staticmethod
+    def _stamp(path):
+        # Not mtime: LRU touches bump it on every use. Sources are only ever
+        # replaced (new inode), never rewritten in place, and moves and hard
+        # links into the download cache and asset registry keep the inode.
+        st = os.stat(path)
+        return st.st_dev, st.st_ino, st.st_size
+
+    def content_hash(self, path):
+        """SHA-256 of the file content, remembered per (inode, size)"""
+        stamp = self._stamp(path)
+        with self._lock:
+            cached = self._hashes.get(stamp)
+            if cached:
+                self._hashes.move_to_end(stamp)
+                return cached
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        self._remember(stamp, key)
+        return key
+
+    def _remember(self, stamp, key):
+        with self._lock:
+            self._hashes[stamp] = key
+            self._hashes.move_to_end(stamp)
+            while len(self._hashes) > self.MAX_HASHED_FILES:
+                self._hashes.popitem(last=False)
+
+    def remember_hash(self, path, key):
+        """Record the content hash of a file hashed while it was written"""
+        self._remember(self._stamp(path), key)
+
+    def get(self, path):
+        """Return the PCMEntry for a source file, decoding it on first use"""
+        key = self.content_hash(path)
+        entry, hit = self._key_locks.get_or_compute(key, lambda: self._open(key),
+                                                    lambda: self._decode(key, path))
+        metrics.cache_result('pcm', hit)
+        return entry
+
+    def _paths(self, key):
+        return os.path.join(self.root, f"{key}.pcm"), os.path.join(self.root, f"{key}.json")
+
+    def _open(self, key):
+        pcm_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            entry = PCMEntry(key, pcm_path, meta['sample_rate'], meta['channels'], meta['frames'])
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        disk_lru.touch(pcm_path)
+        disk_lru.touch(meta_path)
+        return entry
+
+    def _decode(self, key, source_path):
+        pcm_path, meta_path = self._paths(key)
+        tmp_pcm = f"{pcm_path}.{uuid.uuid4().hex}.tmp"
+        frames = 0
+        try:
+            with self.limiter.slot(), metrics.stage('decode', os.path.getsize(source_path)), \
+                    AudioStream(source_path) as stream, open(tmp_pcm, 'wb') as out:
+                for block in stream.blocks():
+                    out.write(np.ascontiguousarray(block, dtype=np.float32).tobytes())
+                    frames += len(block)
+            return self._install(key, tmp_pcm, stream.sample_rate, stream.channels, frames)
+        finally:
+            if os.path.exists(tmp_pcm):
+                os.remove(tmp_pcm)
+
+    def adopt(self, key, tmp_pcm, sample_rate, channels, frames):
+        """
+        Install float32 PCM decoded elsewhere (e.g. while downloading) as the
+        entry for `key`; `tmp_pcm` must be in the store's directory and is
+        consumed. Returns the PCMEntry.
+        """
+        try:
+            entry, _ = self._key_locks.get_or_compute(
+                key, lambda: self._open(key),
+                lambda: self._install(key, tmp_pcm, sample_rate, channels, frames))
+            return entry
+        finally:
+            if os.path.exists(tmp_pcm):
+                os.remove(tmp_pcm)
+
+    def _install(self, key, tmp_pcm, sample_rate, channels, frames):
+        pcm_path, meta_path = self._paths(key)
+        os.replace(tmp_pcm, pcm_path)
+        meta = {
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'frames': frames,
+        }
+
+        # Metadata last: its presence marks the entry complete
+        tmp_meta = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_meta, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, meta_path)
+
+        disk_lru.evict(self.root, self.max_bytes, protect={key})
+        return PCMEntry(key, pcm_path, sample_rate, channels, frames)
+
+
+def segment_from_pcm(entry, start_frame, end_frame, gain_db=0.0):
+    """Build a 16-bit pydub AudioSegment from a frame range of a PCM entry, `gain_db` applied"""
+    from pydub import AudioSegment
+    block = np.asarray(entry.samples[start_frame:end_frame])
+    if gain_db:
+        block = block * np.float32(10 ** (gain_db / 20))
+    ints = (np.clip(block, -1.0, 32767 / 32768) * 32768).astype('<i2')
+    return AudioSegment(data=ints.tobytes(), sample_width=2,
+                        frame_rate=entry.sample_rate, channels=entry.channels)
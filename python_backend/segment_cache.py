@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Disk-LRU cache of encoded segments.
+
+An encoded segment depends only on the decoded source, its exact frame range,
+the output format and the encoder settings, so those make up the key. When a
+user moves one split marker and submits again, every segment whose range did
+not change is taken from here and only the segments next to the moved marker
+are encoded.
+
+Hits are hard-linked into the requester's output path (copied across file
+systems), so consumers may delete or serve their copy freely and eviction never
+pulls a file out from under a download. Since a link shares its inode with the
+files already served, recency is kept on an empty `<key>.used` marker instead
+of the segment's own mtime, which backs the ETags of those downloads.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import disk_lru
+
+
+class SegmentCache:
+    """Encoded segments under `root`, at most `max_bytes` in total"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        disk_lru.remove_stale_partials(root)
+
+    @staticmethod
+    def key(source_hash, start, end, output_format, settings):
+        """Cache key of frames [start, end) of a source encoded with `settings`"""
+        spec = json.dumps([source_hash, start, end, output_format, settings], sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def _path(self, key, output_format):
+        return os.path.join(self.root, f"{key}.{output_format}")
+
+    @staticmethod
+    def _link(src, dest):
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def fetch(self, key, output_format, dest):
+        """Place the cached segment at `dest`; False on a miss"""
+        path = self._path(key, output_format)
+        try:
+            self._link(path, dest)
+        except FileNotFoundError:
+            return False
+        self._mark_used(key)
+        return True
+
+    def _mark_used(self, key):
+        marker = os.path.join(self.root, f"{key}.used")
+        try:
+            with open(marker, 'a'):
+                pass
+            os.utime(marker, None)
+        except OSError:
+            pass
+
+    def store(self, key, output_format, path):
+        """Add the freshly encoded file at `path` (left in place) to the cache"""
+        final = self._path(key, output_format)
+        tmp = f"{final}.{uuid.uuid4().hex}.tmp"
+        try:
+            self._link(path, tmp)
+            os.replace(tmp, final)
+        except OSError as e:
+            print(f"Could not cache segment {key}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._mark_used(key)
+        disk_lru.evict(self.root, self.max_bytes, protect={key})
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Parallel segment export.
+
+Segments are encoded on a bounded process pool. Workers re-open the decoded
+source from the PCM store by path, so only a few integers cross the process
+boundary per segment and the samples are shared through the page cache.
+
+The pool is created on first use, inside a server that is already running
+request, job and metadata threads. Forking such a process can copy a lock
+another thread holds into the child and deadlock it, so workers are started
+from a forkserver instead, which has this module preloaded.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from pcm_store import PCMEntry, segment_from_pcm
+
+# Everything besides the samples and format that shapes an exported file. Part
+# of the segment cache key: change it whenever export_segment's output changes.
+ENCODER_SETTINGS = {'encoder': 'pydub', 'sample_width': 2, 'version': 1}
+
+
+def export_segment(pcm_path, sample_rate, channels, frames, start, end, temp_file, output_format, gain_db=0.0):
+    """Encode frames [start, end) of a decoded source to `temp_file`, `gain_db` applied"""
+    pcm = PCMEntry(None, pcm_path, sample_rate, channels, frames)
+    segment_from_pcm(pcm, start, end, gain_db).export(temp_file, format=output_format).close()
+    return temp_file
+
+
+class SegmentExporter:
+    """Encode many segments of one source concurrently"""
+
+    def __init__(self, workers=None):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _reset_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def iter_export(self, pcm, jobs, output_format, gains=None):
+        """
+        Export `jobs` ([(start_frame, end_frame, temp_file), ...]) from a PCM entry,
+        with optional per-job `gains` in dB.
+
+        Yields (job_index, error message or None) as each segment finishes.
+        Closing the generator early cancels the segments that have not started.
+        """
+        gains = gains or [0.0] * len(jobs)
+        args = [(pcm.pcm_path, pcm.sample_rate, pcm.channels, pcm.frames,
+                 start, end, temp_file, output_format, gain_db)
+                for (start, end, temp_file), gain_db in zip(jobs, gains)]
+
+        if self.workers == 1 or len(args) <= 1:
+            for i, a in enumerate(args):
+                yield i, self._run_inline(a)
+            return
+
+        pool = self._get_pool()
+        try:
+            futures = {pool.submit(export_segment, *a): i for i, a in enumerate(args)}
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            for i, a in enumerate(args):
+                yield i, self._run_inline(a)
+            return
+
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    error = None
+                except BrokenProcessPool as e:
+                    self._reset_pool(pool)
+                    error = f"Worker crashed: {e}"
+                except Exception as e:
+                    error = str(e)
+                yield futures[future], error
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    @staticmethod
+    def _run_inline(args):
+        try:
+            export_segment(*args)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Per-segment level analytics from one pass over the decoded source.
+
+For every segment: sample peak, RMS, integrated loudness (ITU-R BS.1770 /
+EBU R128: K-weighting, 400 ms blocks every 100 ms, absolute and relative
+gates), clipped-sample count and leading/trailing silence.
+
+The PCM is read block by block once for all segments together. Each block is
+K-weighted (filter state carried across blocks) and reduced onto a grid of
+intervals: 100 ms steps anchored at every segment start, plus the segment
+boundaries. Per interval only a few sums, maxima and the first/last loud
+sample are kept, so memory stays proportional to the number of intervals and
+the exact per-segment figures, including gating blocks aligned to each
+segment's start, are assembled from them afterwards.
+"""
+
+import math
+
+import numpy as np
+
+from pcm_store import BLOCK_FRAMES
+
+GATE_STEP = 0.1          # Seconds between gating block starts
+GATE_STEPS = 4           # Steps per 400 ms gating block
+ABSOLUTE_GATE = -70.0    # LUFS
+RELATIVE_GATE = -10.0    # LU below the absolute-gated loudness
+CLIP_LEVEL = 32767 / 32768  # Samples at or above this (the 16-bit maximum) count as clipped
+SILENCE_DB = -60.0       # Samples quieter than this (dBFS) are silence
+PEAK_CEILING_DB = -1.0   # Loudness normalization never raises a peak above this
+
+
+def k_weighting(sample_rate):
+    """Second-order sections of the BS.1770 K-weighting filter (shelf, then high-pass) at any rate"""
+    # Pre-filter shelf
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # RLB high-pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+def channel_weights(channels):
+    """BS.1770 channel weights: 1.0, except 5.1 drops LFE and boosts the surrounds"""
+    if channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    return np.ones(channels)
+
+
+def _db(value, scale=20):
+    return round(scale * math.log10(value), 2) if value > 0 else None
+
+
+def _integrated_loudness(energies, step_frames):
+    """Gated loudness from K-weighted energies of consecutive full 100 ms steps"""
+    if len(energies) < GATE_STEPS:
+        return None
+    sums = np.convolve(energies, np.ones(GATE_STEPS), mode='valid')
+    z = sums / (GATE_STEPS * step_frames)
+    z = z[z > 10 ** ((ABSOLUTE_GATE + 0.691) / 10)]
+    if not len(z):
+        return None
+    relative = -0.691 + 10 * math.log10(z.mean()) + RELATIVE_GATE
+    z = z[z > 10 ** ((relative + 0.691) / 10)]
+    return round(-0.691 + 10 * math.log10(z.mean()), 2)
+
+
+def analyze(pcm, ranges, silence_db=SILENCE_DB, block_frames=BLOCK_FRAMES):
+    """
+    Level figures for frame ranges [(start, end), ...] of a PCM entry.
+
+    Ranges must not overlap. Returns one dict per range, in order, with
+    `peak_db` and `rms_db` (dBFS), `loudness_lufs`, `clipped_samples`, and
+    `leading_silence`/`trailing_silence` in seconds. Levels of digital
+    silence, and the loudness of ranges shorter than 400 ms, are None.
+    """
+    from scipy.signal import sosfilt  # Deferred: scipy.signal is slow to import and only analysis needs it
+
+    sr = pcm.sample_rate
+    step = max(1, int(round(GATE_STEP * sr)))
+    ranges = [(max(0, int(s)), min(pcm.frames, int(e))) for s, e in ranges]
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    spans = [ranges[i] for i in order if ranges[i][1] > ranges[i][0]]
+    if not spans:
+        return [_empty_stats(e - s, sr) for s, e in ranges]
+
+    # Interval grid: 100 ms steps from each segment start, ending at its end
+    edges = np.unique(np.concatenate([np.append(np.arange(s, e, step), e) for s, e in spans]))
+    count = len(edges) - 1
+    kw = np.zeros(count)
+    squares = np.zeros(count)
+    peaks = np.zeros(count, dtype=np.float32)
+    clipped = np.zeros(count, dtype=np.int64)
+    first_loud = np.full(count, -1, dtype=np.int64)
+    last_loud = np.full(count, -1, dtype=np.int64)
+
+    sos = k_weighting(sr)
+    weights = channel_weights(pcm.channels)
+    zi = np.zeros((len(sos), pcm.channels, 2))
+    threshold = 10 ** (silence_db / 20)
+    for b0 in range(edges[0], edges[-1], block_frames):
+        b1 = min(b0 + block_frames, edges[-1])
+        # Channels first: reducing across a few channels is then elementwise
+        x = np.ascontiguousarray(pcm.samples[b0:b1].T, dtype=np.float32)
+        y, zi = sosfilt(sos, x, axis=1, zi=zi)
+        magnitude = np.abs(x)
+        level = magnitude.max(axis=0)
+
+        # Pieces of the block, one per interval it touches
+        first = np.searchsorted(edges, b0, 'right') - 1
+        cuts = edges[(edges > b0) & (edges < b1)] - b0
+        starts = np.concatenate([[0], cuts])
+        ends = np.append(cuts, b1 - b0)
+        idx = first + np.arange(len(starts))
+
+        kw[idx] += np.add.reduceat(weights @ (y * y), starts)
+        squares[idx] += np.add.reduceat(np.square(x, dtype=np.float64).mean(axis=0), starts)
+        clipped[idx] += np.add.reduceat((magnitude >= CLIP_LEVEL).sum(axis=0), starts)
+        peaks[idx] = np.maximum(peaks[idx], np.maximum.reduceat(level, starts))
+
+        loud = np.flatnonzero(level > threshold)
+        if len(loud):
+            lo = np.searchsorted(loud, starts)
+            hi = np.searchsorted(loud, ends) - 1
+            has = hi >= lo
+            new = has & (first_loud[idx] < 0)
+            first_loud[idx[new]] = b0 + loud[lo[new]]
+            last_loud[idx[has]] = b0 + loud[hi[has]]
+
+    results = [None] * len(ranges)
+    for i, (s, e) in enumerate(ranges):
+        if e <= s:
+            results[i] = _empty_stats(e - s, sr)
+            continue
+        a, b = np.searchsorted(edges, s), np.searchsorted(edges, e)
+        lengths = np.diff(edges[a:b + 1])
+        full = kw[a:b][lengths == step]
+        loud_first = first_loud[a:b][first_loud[a:b] >= 0]
+        loud_last = last_loud[a:b][last_loud[a:b] >= 0]
+        if len(loud_first):
+            leading = (loud_first[0] - s) / sr
+            trailing = (e - 1 - loud_last[-1]) / sr
+        else:
+            leading = trailing = (e - s) / sr
+        results[i] = {
+            'peak_db': _db(float(peaks[a:b].max())),
+            'rms_db': _db(squares[a:b].sum() / (e - s), scale=10),
+            'loudness_lufs': _integrated_loudness(full, step),
+            'clipped_samples': int(clipped[a:b].sum()),
+            'leading_silence': round(float(leading), 3),
+            'trailing_silence': round(float(trailing), 3),
+        }
+    return results
+
+
+def _empty_stats(frames, sample_rate):
+    duration = round(max(0, frames) / sample_rate, 3)
+    return {'peak_db': None, 'rms_db': None, 'loudness_lufs': None, 'clipped_samples': 0,
+            'leading_silence': duration, 'trailing_silence': duration}
+
+
+def normalization_gain(stats, target_lufs, peak_ceiling_db=PEAK_CEILING_DB):
+    """
+    dB of gain bringing a segment to `target_lufs`, reduced if needed so its
+    sample peak stays at or below `peak_ceiling_db`. 0 for silent segments.
+    """
+    if stats['loudness_lufs'] is None:
+        return 0.0
+    gain = target_lufs - stats['loudness_lufs']
+    if stats['peak_db'] is not None:
+        gain = min(gain, peak_ceiling_db - stats['peak_db'])
+    return round(gain, 2)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Production entry point: preforking server for the audio processor.
+
+The master imports the app, runs `warm_up()` so librosa, scipy, matplotlib
+and yt-dlp's extractors are loaded once, opens the listening socket and then
+forks the workers. Workers inherit the loaded code copy-on-write, so each one
+costs little extra memory and none of them pays the import time on its first
+request. Each worker serves the shared socket with a threaded WSGI server;
+workers that die are replaced.
+
+    python serve.py --port 5000 --workers 4
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+DEFAULT_WORKERS = int(os.environ.get('AUDIO_SERVER_WORKERS', os.cpu_count() or 1))
+RESPAWN_DELAY = 1.0  # Seconds between respawns, so a crashing worker can't spin
+
+
+def run_worker(app, host, port, sock):
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def spawn(app, host, port, sock):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, host, port, sock)
+        except BaseException as e:
+            print(f"Worker {os.getpid()} exiting: {e!r}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)  # Skip the master's atexit handlers (they remove shared temp dirs)
+    return pid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the audio processor with preforked workers')
+    parser.add_argument('--host', default=os.environ.get('AUDIO_SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('AUDIO_SERVER_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--no-warm-up', action='store_true', help='Skip preloading the heavy libraries')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    import audio_processor
+    if not args.no_warm_up:
+        audio_processor.warm_up()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    # Keep everything loaded so far out of the collector, so workers don't
+    # touch (and copy) those pages when they collect
+    gc.collect()
+    gc.freeze()
+
+    app = audio_processor.app
+    workers = {spawn(app, args.host, args.port, sock) for _ in range(max(1, args.workers))}
+    print(f"Serving on {args.host}:{args.port} with {len(workers)} workers "
+          f"(ready in {time.perf_counter() - started:.2f}s)")
+    sys.stdout.flush()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}; restarting")
+            time.sleep(RESPAWN_DELAY)
+            workers.add(spawn(app, args.host, args.port, sock))
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
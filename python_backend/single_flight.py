@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Per-key locks for single-flight computations.
+
+Caches that compute an entry on a miss (decodes, tiles, renders, metadata
+extractions) let one caller per key do the work while later callers for the
+same key wait and then find the stored result. `get_or_compute` is that
+idiom: look up without a lock, then look up again under the key's lock and
+compute only if the entry is still missing. A key's lock lives while anyone
+holds or waits on it, and is dropped once the last of them leaves, even when
+the work raises.
+"""
+
+import contextlib
+import threading
+
+
+class KeyLocks:
+    """One lock per key, created on demand and forgotten after use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [lock, holders and waiters]
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        """Hold the lock for `key` for the duration of the block"""
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def get_or_compute(self, key, lookup, compute):
+        """
+        (value, hit) for `key`: `lookup()` returns the stored value or None,
+        `compute()` makes and stores it on a miss. One caller per key computes
+        at a time; callers that waited for it find its result.
+        """
+        value = lookup()
+        if value is not None:
+            return value, True
+        with self.hold(key):
+            value = lookup()
+            if value is not None:
+                return value, True
+            return compute(), False
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Zoomable spectrogram tiles.
+
+The spectrogram of a source is cut into tiles of TILE_COLUMNS time columns,
+addressed by (level, x). Level 0 fits the whole file in one tile and every
+level below doubles the resolution, down to MIN_HOP samples per column. A tile
+is computed only when it is requested: each column takes the power spectrum of
+at most MAX_WINDOWS_PER_COLUMN N_FFT-sample windows read straight from the
+decoded PCM, so any tile costs about the same at any zoom level and a
+multi-hour file never has to be transformed as a whole.
+
+Columns are mapped onto `rows` mel bands or log-spaced frequency bands and
+stored as dB below full scale quantized to 8 bits, kept in an LRU cache
+bounded by bytes. Tiles are served as PNG through a colormap or as the raw
+8-bit values with a 40-byte little-endian header:
+
+    magic    4s   b'ASPT'
+    version  B    1
+    scale    B    0: mel, 1: log
+    rows     H    frequency bands, lowest first
+    columns  H    columns in the tile (TILE_COLUMNS)
+    valid    H    columns that lie inside the file
+    level    H
+    reserved H
+    x        I    tile index within the level
+    start    d    seconds at the left edge of the tile
+    column_seconds d
+    db_floor f    dB value of byte 0; byte 255 is 0 dBFS
+
+followed by rows * columns bytes, row-major from the lowest band.
+"""
+
+import math
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import limits
+from single_flight import KeyLocks
+from waveform_render import encode_png
+
+TILE_COLUMNS = 256
+MIN_HOP = 256       # Samples per column on the finest level
+N_FFT = 2048
+MAX_WINDOWS_PER_COLUMN = 4  # Windows averaged per column on coarse levels
+FMIN = 20.0
+DB_FLOOR = -100.0
+SCALES = ('mel', 'log')
+ROWS_RANGE = (16, 512)
+
+MAGIC = b'ASPT'
+VERSION = 1
+MIMETYPE = 'application/x-audio-spectrogram'
+HEADER = struct.Struct('<4sBBHHHHHIddf')
+
+# Colormap anchors (dark to bright) interpolated into a 256-entry table
+COLORMAP = ('#000004', '#280b54', '#65156e', '#9f2a63', '#d44842', '#f57d15', '#fac127', '#fcffa4')
+
+
+def _colormap_lut(anchors=COLORMAP):
+    rgb = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in anchors], dtype=np.float32)
+    positions = np.linspace(0, 255, len(anchors))
+    steps = np.arange(256)
+    return np.stack([np.interp(steps, positions, rgb[:, i]) for i in range(3)], axis=1)
+
+
+LUT = _colormap_lut()
+
+
+def level_count(frames):
+    """Number of zoom levels for a source of `frames` samples"""
+    tiles_at_finest = max(1, math.ceil(frames / (MIN_HOP * TILE_COLUMNS)))
+    return math.ceil(math.log2(tiles_at_finest)) + 1
+
+
+def hop_for(frames, level):
+    """Samples per column at `level`"""
+    return MIN_HOP << (level_count(frames) - 1 - level)
+
+
+def layout(frames, sample_rate):
+    """Levels, their column duration and tile count, for clients laying out tiles"""
+    levels = []
+    for level in range(level_count(frames)):
+        hop = hop_for(frames, level)
+        levels.append({
+            'level': level,
+            'column_seconds': hop / sample_rate,
+            'tile_seconds': hop * TILE_COLUMNS / sample_rate,
+            'tiles': max(1, math.ceil(frames / (hop * TILE_COLUMNS))),
+        })
+    return {
+        'duration': frames / sample_rate if sample_rate else 0.0,
+        'sample_rate': sample_rate,
+        'tile_columns': TILE_COLUMNS,
+        'db_floor': DB_FLOOR,
+        'levels': levels,
+    }
+
+
+def band_matrix(scale, rows, sample_rate):
+    """(rows, N_FFT // 2 + 1) weights mapping a power spectrum onto frequency bands"""
+    if scale == 'mel':
+        import librosa  # Deferred: only mel tiles need it, and it is slow to import
+        return librosa.filters.mel(sr=sample_rate, n_fft=N_FFT, n_mels=rows, fmin=FMIN, norm=None)
+
+    # Log-spaced bands, each averaging the FFT bins inside it (or the nearest bin)
+    freqs = np.fft.rfftfreq(N_FFT, 1.0 / sample_rate)
+    edges = np.geomspace(FMIN, sample_rate / 2, rows + 1)
+    weights = np.zeros((rows, len(freqs)), dtype=np.float32)
+    for row in range(rows):
+        inside = (freqs >= edges[row]) & (freqs < edges[row + 1])
+        if inside.any():
+            weights[row, inside] = 1.0 / inside.sum()
+        else:
+            weights[row, np.argmin(np.abs(freqs - math.sqrt(edges[row] * edges[row + 1])))] = 1.0
+    return weights
+
+
+def compute_tile(pcm, level, x, scale='mel', rows=128, bands=None):
+    """
+    Quantized spectrogram tile: uint8 array (rows, TILE_COLUMNS), lowest band first.
+
+    Returns (tile, valid_columns).
+    """
+    hop = hop_for(pcm.frames, level)
+    first = x * TILE_COLUMNS
+    valid = max(0, min(TILE_COLUMNS, math.ceil(pcm.frames / hop) - first))
+    tile = np.zeros((rows, TILE_COLUMNS), dtype=np.uint8)
+    if valid == 0:
+        return tile, 0
+
+    # Window starts: k evenly spaced windows inside each column, centered on them
+    per_column = int(np.clip(hop // N_FFT, 1, MAX_WINDOWS_PER_COLUMN))
+    columns = first + np.arange(valid)
+    offsets = (np.arange(per_column) + 0.5) * hop / per_column
+    centers = (columns[:, None] * hop + offsets[None, :]).astype(np.int64).ravel()
+    index = centers[:, None] - N_FFT // 2 + np.arange(N_FFT)[None, :]
+    inside = (index >= 0) & (index < pcm.frames)
+    frames = np.zeros(index.shape, dtype=np.float32)
+    frames[inside] = pcm.mono[index[inside]]
+
+    window = np.hanning(N_FFT).astype(np.float32)
+    spectra = np.fft.rfft(frames * window, axis=1)
+    power = (spectra.real ** 2 + spectra.imag ** 2).astype(np.float32)
+    power = power.reshape(valid, per_column, -1).mean(axis=1)
+
+    if bands is None:
+        bands = band_matrix(scale, rows, pcm.sample_rate)
+    # A full-scale sine lands at 0 dB
+    reference = (window.sum() / 2) ** 2
+    db = 10 * np.log10(power @ bands.T / reference + 1e-12)
+    tile[:, :valid] = np.round(np.clip((db.T - DB_FLOOR) / -DB_FLOOR, 0, 1) * 255).astype(np.uint8)
+    return tile, valid
+
+
+def encode_raw(tile, valid, level, x, scale, column_seconds):
+    rows, columns = tile.shape
+    header = HEADER.pack(MAGIC, VERSION, SCALES.index(scale), rows, columns, valid, level, 0, x,
+                         x * columns * column_seconds, column_seconds, DB_FLOOR)
+    return header + np.ascontiguousarray(tile).tobytes()
+
+
+def decode_raw(data):
+    """Unpack the raw tile format into (header dict, uint8 array)"""
+    magic, version, scale, rows, columns, valid, level, _, x, start, column_seconds, db_floor = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version 1 spectrogram tile")
+    tile = np.frombuffer(data, dtype=np.uint8, offset=HEADER.size).reshape(rows, columns)
+    return {
+        'scale': SCALES[scale], 'rows': rows, 'columns': columns, 'valid': valid, 'level': level,
+        'x': x, 'start': start, 'column_seconds': column_seconds, 'db_floor': db_floor,
+    }, tile
+
+
+def encode_tile_png(tile):
+    """Colormapped PNG with the highest band on top"""
+    return encode_png(LUT[tile[::-1]])
+
+
+class SpectrogramTiles:
+    """Tiles by (source, scale, rows, level, x), computed on demand with byte-bounded LRU caching"""
+
+    def __init__(self, max_bytes=64 * 1024 ** 2, limiter=limits.UNLIMITED):
+        self.max_bytes = max_bytes
+        self.limiter = limiter  # Bounds concurrent tile computations
+        self._tiles = OrderedDict()
+        self._bands = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+
+    def _bands_for(self, scale, rows, sample_rate):
+        key = (scale, rows, sample_rate)
+        with self._lock:
+            bands = self._bands.get(key)
+        if bands is None:
+            bands = band_matrix(scale, rows, sample_rate).astype(np.float32)
+            with self._lock:
+                self._bands[key] = bands
+        return bands
+
+    def _lookup(self, key):
+        with self._lock:
+            cached = self._tiles.get(key)
+            if cached is not None:
+                self._tiles.move_to_end(key)
+            return cached
+
+    def _store(self, key, value):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = value
+            self._size += value[0].nbytes
+            while self._size > self.max_bytes and len(self._tiles) > 1:
+                _, (tile, _) = self._tiles.popitem(last=False)
+                self._size -= tile.nbytes
+
+    def get(self, pcm, level, x, scale='mel', rows=128):
+        """(tile, valid_columns, hit) for one tile of a PCM entry"""
+        key = (pcm.key, scale, rows, level, x)
+
+        def compute():
+            with self.limiter.slot():
+                value = compute_tile(pcm, level, x, scale, rows,
+                                     self._bands_for(scale, rows, pcm.sample_rate))
+            self._store(key, value)
+            return value
+
+        (tile, valid), hit = self._key_locks.get_or_compute(key, lambda: self._lookup(key), compute)
+        return tile, valid, hit
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._size = 0
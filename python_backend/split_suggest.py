@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Automatic split point suggestions.
+
+The decoded signal is read block by block and reduced to two small series:
+per-frame RMS loudness and per-window log mel band energies (an FFT of every
+fourth 1024-sample frame, batched per block). Memory is a few bytes per
+frame, so multi-hour files analyze in seconds with bounded memory.
+
+Two kinds of candidates come out of them:
+
+- silence: runs of frames below `silence_db` lasting at least `min_silence`
+  seconds, split in the middle of the gap
+- novelty: points where the average timbre/energy of the `novelty_window`
+  seconds before and after differ most (a Foote-style novelty curve over
+  half-second windows), snapped to the quietest nearby frame
+
+Candidates are accepted greedily, silence gaps (longest first) before novelty
+peaks (strongest first), keeping every segment at least `min_segment` long.
+"""
+
+import numpy as np
+
+HOP = 1024            # Samples per analysis frame
+SPECTRAL_STRIDE = 4   # Mel energies from every fourth frame; windows still average ~5 spectra
+WINDOW_SECONDS = 0.5  # Novelty is computed over windows of this length
+N_MELS = 16
+
+DEFAULTS = {
+    'silence_db': -45.0,        # Frames quieter than this (dBFS RMS) are silent
+    'min_silence': 1.0,         # Seconds of silence that make a gap
+    'min_segment': 30.0,        # Shortest segment the suggestions may create
+    'novelty': True,            # Also look for boundaries without silence
+    'novelty_threshold': 2.0,   # Feature change (in per-band standard deviations) a boundary needs
+    'novelty_window': 10.0,     # Seconds compared on each side of a boundary
+    'max_splits': None,         # Keep at most this many split points
+}
+
+
+class FrameFeatures:
+    """Accumulates per-frame RMS and per-window mel energies from sample blocks"""
+
+    def __init__(self, sample_rate, total_samples):
+        self.sample_rate = sample_rate
+        self.frames = total_samples // HOP
+        self.frames_per_window = max(1, int(round(WINDOW_SECONDS * sample_rate / HOP)))
+        windows = -(-self.frames // self.frames_per_window)
+        self.rms = np.zeros(self.frames, dtype=np.float32)
+        self.mel_sums = np.zeros((windows, N_MELS), dtype=np.float64)
+        self.mel_counts = np.zeros(windows, dtype=np.int64)
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._pos = 0  # Frames consumed so far
+        # librosa and scipy load on first analysis, not at server startup
+        import librosa
+        import scipy.fft
+        self._rfft = scipy.fft.rfft
+        self._window = np.hanning(HOP).astype(np.float32)
+        self._mel = librosa.filters.mel(sr=sample_rate, n_fft=HOP, n_mels=N_MELS).T.astype(np.float32)
+
+    def add(self, block):
+        samples = np.concatenate([self._carry, np.asarray(block, dtype=np.float32)])
+        n = min(len(samples) // HOP, self.frames - self._pos)
+        self._carry = samples[n * HOP:]
+        if n <= 0:
+            return
+        frames = samples[:n * HOP].reshape(n, HOP)
+        self.rms[self._pos:self._pos + n] = np.sqrt(np.mean(frames * frames, axis=1))
+
+        first = -self._pos % SPECTRAL_STRIDE
+        spectra = self._rfft(frames[first::SPECTRAL_STRIDE] * self._window, axis=1)
+        power = (spectra.real ** 2 + spectra.imag ** 2).astype(np.float32)
+        bands = np.log10(power @ self._mel + 1e-10)
+        windows = (self._pos + first + SPECTRAL_STRIDE * np.arange(len(bands))) // self.frames_per_window
+        np.add.at(self.mel_sums, windows, bands)
+        np.add.at(self.mel_counts, windows, 1)
+        self._pos += n
+
+    def frame_time(self, frame):
+        return frame * HOP / self.sample_rate
+
+    def window_means(self):
+        counts = np.maximum(self.mel_counts, 1)[:, None]
+        return self.mel_sums / counts
+
+
+def silence_gaps(rms, silence_db, min_frames):
+    """(first_frame, end_frame) of every silent run at least `min_frames` long"""
+    silent = 20 * np.log10(np.maximum(rms, 1e-10)) < silence_db
+    edges = np.diff(np.concatenate([[0], silent.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_frames
+    return list(zip(starts[keep], ends[keep]))
+
+
+def novelty_curve(features, half_width):
+    """Distance between the mean feature vectors before and after each window boundary"""
+    count = len(features)
+    if count < 2 * half_width or half_width < 1:
+        return np.zeros(count)
+    # Standardize each band so loud and quiet bands weigh the same
+    std = features.std(axis=0)
+    z = (features - features.mean(axis=0)) / np.where(std > 0, std, 1)
+    cumsum = np.vstack([np.zeros((1, z.shape[1])), np.cumsum(z, axis=0)])
+    boundaries = np.arange(half_width, count - half_width + 1)
+    before = (cumsum[boundaries] - cumsum[boundaries - half_width]) / half_width
+    after = (cumsum[boundaries + half_width] - cumsum[boundaries]) / half_width
+    curve = np.zeros(count + 1)
+    curve[boundaries] = np.linalg.norm(after - before, axis=1)
+    return curve
+
+
+def novelty_peaks(curve, half_width, threshold):
+    """Boundary indices that are local maxima within ±half_width and reach `threshold`"""
+    if len(curve) == 0:
+        return []
+    # Sliding maximum over 2*half_width+1 boundaries
+    padded = np.pad(curve, half_width, constant_values=-np.inf)
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * half_width + 1)
+    local_max = windows.max(axis=1)
+    return np.flatnonzero((curve >= threshold) & (curve >= local_max)).tolist()
+
+
+def select(candidates, duration, min_segment, max_splits=None):
+    """Greedy pick of candidate times keeping every segment at least `min_segment` long"""
+    chosen = []
+    for candidate in candidates:
+        t = candidate['time']
+        if t < min_segment or duration - t < min_segment:
+            continue
+        if any(abs(t - other['time']) < min_segment for other in chosen):
+            continue
+        chosen.append(candidate)
+        if max_splits is not None and len(chosen) >= max_splits:
+            break
+    return sorted(chosen, key=lambda c: c['time'])
+
+
+def suggest_splits(blocks, sample_rate, total_samples, progress=None, **options):
+    """
+    Suggest split points for a mono signal given as sample blocks.
+
+    Returns {'split_points': [...], 'candidates': [...], 'duration': ..., 'options': ...};
+    `split_points` can be passed straight to /split-audio.
+    """
+    unknown = set(options) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    opts = {**DEFAULTS, **{k: v for k, v in options.items() if v is not None}}
+
+    features = FrameFeatures(sample_rate, total_samples)
+    done = 0
+    for block in blocks:
+        features.add(block)
+        done += len(block)
+        if progress:
+            progress(done, total_samples)
+
+    duration = total_samples / sample_rate
+    frame_seconds = HOP / sample_rate
+    candidates = []
+
+    for start, end in silence_gaps(features.rms, opts['silence_db'],
+                                   max(1, int(np.ceil(opts['min_silence'] / frame_seconds)))):
+        if start == 0 or end >= features.frames:
+            continue  # Leading or trailing silence is not a boundary
+        candidates.append({
+            'time': round(features.frame_time((start + end) / 2), 3),
+            'kind': 'silence',
+            'score': round(features.frame_time(end - start), 3),
+            'gap_start': round(features.frame_time(start), 3),
+            'gap_end': round(features.frame_time(end), 3),
+        })
+    candidates.sort(key=lambda c: -c['score'])
+
+    if opts['novelty']:
+        half_width = max(1, int(round(opts['novelty_window'] / WINDOW_SECONDS)))
+        curve = novelty_curve(features.window_means(), half_width)
+        peaks = novelty_peaks(curve, half_width, opts['novelty_threshold'])
+        fpw = features.frames_per_window
+        novel = []
+        for boundary in peaks:
+            # Snap to the quietest frame within one window of the boundary
+            lo = max(0, (boundary - 1) * fpw)
+            hi = min(features.frames, (boundary + 1) * fpw)
+            frame = lo + int(np.argmin(features.rms[lo:hi])) if hi > lo else boundary * fpw
+            novel.append({
+                'time': round(features.frame_time(frame), 3),
+                'kind': 'novelty',
+                'score': round(float(curve[boundary]), 2),
+            })
+        candidates += sorted(novel, key=lambda c: -c['score'])
+
+    chosen = select(candidates, duration, opts['min_segment'], opts['max_splits'])
+    return {
+        'split_points': [c['time'] for c in chosen],
+        'candidates': chosen,
+        'duration': duration,
+        'options': opts,
+    }
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Lossless stream-copy splitting.
+
+When the requested output format matches the source codec, segments are cut
+at packet (frame) boundaries with `ffmpeg -c copy` in a single pass instead of
+being decoded and re-encoded. Each cut is reported with its distance from the
+requested split point. In sample-accurate mode only the partial packets at
+each cut are re-encoded from the decoded PCM; the rest of the segment is still
+copied and the pieces are joined with ffmpeg's concat demuxer. That only works
+for FLAC: lossy encoders prime and pad every piece they write, which would
+leave gaps at the joins, so accurate lossy segments are re-encoded whole from
+the PCM, where the container carries the encoder delay and padding. Accurate
+segments report the duration they actually decode to: exact for MP3, Opus and
+FLAC, while AAC ends padded to a whole 1024-sample frame.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import uuid
+from fractions import Fraction
+
+import numpy as np
+
+from pcm_store import segment_from_pcm
+
+# Output format -> (source codec it can copy, ffmpeg muxer, encoder for boundary pieces)
+COPY_FORMATS = {
+    'mp3': ('mp3', 'mp3', 'libmp3lame'),
+    'm4a': ('aac', 'ipod', 'aac'),
+    'aac': ('aac', 'ipod', 'aac'),
+    'opus': ('opus', 'ogg', 'libopus'),
+    'flac': ('flac', 'flac', 'flac'),
+}
+
+AUDIO_STREAM_RE = re.compile(r"Stream #0:\d+.*?: Audio: (\w+).*?(\d+) Hz(?:.*?(\d+) kb/s)?")
+TIME_BASE_RE = re.compile(r"#tb 0: (\d+)/(\d+)")
+
+# Codecs whose boundary pieces can be re-encoded and joined without gaps
+JOINABLE_CODECS = {'flac'}
+
+
+class SourceProbe:
+    """Codec and packet start times of the first audio stream"""
+
+    def __init__(self, codec, bit_rate, packet_starts, end):
+        self.codec = codec
+        self.bit_rate = bit_rate
+        self.packet_starts = packet_starts  # Seconds, first packet at 0
+        self.end = end
+
+    def floor(self, t):
+        """Start of the last packet at or before t"""
+        i = np.searchsorted(self.packet_starts, t, side='right') - 1
+        return float(self.packet_starts[max(i, 0)])
+
+    def ceil(self, t):
+        """Start of the first packet at or after t (or the stream end)"""
+        i = np.searchsorted(self.packet_starts, t, side='left')
+        return float(self.packet_starts[i]) if i < len(self.packet_starts) else self.end
+
+    def nearest(self, t):
+        lo, hi = self.floor(t), self.ceil(t)
+        return lo if t - lo <= hi - t else hi
+
+    def cut_time(self, boundary):
+        """A time ffmpeg cuts at exactly `boundary`: halfway into the packet before it"""
+        i = np.searchsorted(self.packet_starts, boundary, side='left')
+        if i == 0:
+            return boundary
+        return (float(self.packet_starts[i - 1]) + boundary) / 2
+
+
+def probe(path):
+    """Read codec info and packet timestamps with a single ffmpeg copy pass"""
+    try:
+        info = subprocess.run(['ffmpeg', '-hide_banner', '-i', path],
+                              capture_output=True, text=True).stderr
+    except OSError as e:
+        raise ValueError(f"Cannot run ffmpeg: {e}") from e
+    match = AUDIO_STREAM_RE.search(info)
+    if not match:
+        raise ValueError(f"No audio stream found in {path}")
+    codec = match.group(1)
+    bit_rate = int(match.group(3)) if match.group(3) else None
+
+    # framecrc lists every packet as: stream, dts, pts, duration, size, crc
+    try:
+        crc = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-map', '0:a:0',
+                              '-c', 'copy', '-f', 'framecrc', '-'],
+                             capture_output=True, text=True, check=True).stdout
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ValueError(f"Cannot read packets of {path}: {e}") from e
+    tb = TIME_BASE_RE.search(crc)
+    if not tb:
+        raise ValueError(f"No audio packets found in {path}")
+    time_base = Fraction(int(tb.group(1)), int(tb.group(2)))
+
+    rows = [line.split(',') for line in crc.splitlines() if line and not line.startswith('#')]
+    pts = np.array([int(row[2]) for row in rows], dtype=np.int64)
+    durations = np.array([int(row[3]) for row in rows], dtype=np.int64)
+    order = np.argsort(pts, kind='stable')
+    pts, durations = pts[order], durations[order]
+    first = pts[0]
+    starts = (pts - first) * float(time_base)
+    end = float((pts[-1] + durations[-1] - first) * time_base)
+    return SourceProbe(codec, bit_rate, starts, end)
+
+
+def can_copy(probe_result, output_format):
+    spec = COPY_FORMATS.get(output_format)
+    return spec is not None and spec[0] == probe_result.codec
+
+
+def copy_pieces(source, cuts, muxer, ext, work_dir, probe_result):
+    """
+    Cut `source` at packet boundaries `cuts` in one pass; returns len(cuts)+1
+    piece paths. Raises ValueError if ffmpeg fails, so callers re-encode instead.
+    """
+    pattern = os.path.join(work_dir, f"piece_%05d.{ext}")
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-i', source, '-map', '0:a:0', '-c', 'copy',
+           '-f', 'segment', '-segment_format', muxer, '-reset_timestamps', '1']
+    if cuts:
+        times = ','.join(f"{probe_result.cut_time(c):.6f}" for c in cuts)
+        cmd += ['-segment_times', times]
+    cmd.append(pattern)
+    try:
+        subprocess.run(cmd, capture_output=True, check=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ValueError(f"Stream copy failed: {e}") from e
+    return [pattern % i for i in range(len(cuts) + 1)]
+
+
+def encode_pcm(pcm, start_frame, end_frame, path, encoder, muxer, bit_rate):
+    """Encode a PCM frame range with the same codec as the source"""
+    wav = f"{path}.wav"
+    segment_from_pcm(pcm, start_frame, end_frame).export(wav, format='wav').close()
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-i', wav, '-c:a', encoder]
+    if bit_rate and encoder != 'flac':
+        cmd += ['-b:a', f"{bit_rate}k"]
+    cmd += ['-f', muxer, path]
+    try:
+        subprocess.run(cmd, capture_output=True, check=True)
+    finally:
+        os.remove(wav)
+
+
+def decoded_duration(path):
+    """Seconds of audio that ffmpeg decodes from `path`, priming and padding trimmed"""
+    try:
+        crc = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-map', '0:a:0',
+                              '-c:a', 'pcm_s16le', '-f', 'framecrc', '-'],
+                             capture_output=True, text=True, check=True).stdout
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise ValueError(f"Cannot decode {path}: {e}") from e
+    tb = TIME_BASE_RE.search(crc)
+    if not tb:
+        raise ValueError(f"No audio decoded from {path}")
+    samples = sum(int(line.split(',')[3]) for line in crc.splitlines()
+                  if line and not line.startswith('#'))
+    return float(samples * Fraction(int(tb.group(1)), int(tb.group(2))))
+
+
+def concat(pieces, path, muxer, work_dir):
+    """Join same-codec pieces without re-encoding"""
+    listing = os.path.join(work_dir, f"concat_{uuid.uuid4().hex}.txt")
+    with open(listing, 'w') as f:
+        for piece in pieces:
+            f.write(f"file '{piece}'\n")
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', listing,
+                    '-c', 'copy', '-f', muxer, path], capture_output=True, check=True)
+
+
+def split_copy(source, pcm, split_points, output_format, out_dir, accurate=False):
+    """
+    Split `source` by stream copy.
+
+    Returns segment dicts in index order, like AudioProcessor.split_audio, plus
+    the requested times and how far each actual cut landed from them. Raises
+    ValueError when the source cannot be stream-copied (wrong codec, or ffmpeg
+    failing to probe or cut it); failures of single segments are reported on
+    the segment instead.
+    """
+    probe_result = probe(source)
+    if not can_copy(probe_result, output_format):
+        raise ValueError(f"Cannot stream-copy {probe_result.codec} into {output_format}")
+    _, muxer, encoder = COPY_FORMATS[output_format]
+    sr = pcm.sample_rate
+
+    requested = [p for p in split_points if 0 <= p <= probe_result.end]
+    # Accurate segments end where the decoded source does, padding excluded
+    bounds = [0.0] + requested + [pcm.frames / sr if accurate else probe_result.end]
+    # Lossy pieces cannot be joined gaplessly: encode accurate segments whole
+    whole = accurate and probe_result.codec not in JOINABLE_CODECS
+
+    work_dir = tempfile.mkdtemp(dir=out_dir)
+    try:
+        if whole:
+            cuts, pieces = [], []
+        else:
+            if accurate:
+                # Copy whole packets inside each segment; boundary packets are re-encoded
+                cuts = sorted({probe_result.floor(t) for t in requested} | {probe_result.ceil(t) for t in requested})
+            else:
+                cuts = sorted({probe_result.nearest(t) for t in requested})
+            cuts = [c for c in cuts if 0 < c < probe_result.end]
+            pieces = copy_pieces(source, cuts, muxer, output_format, work_dir, probe_result)
+        spans = list(zip([0.0] + cuts, cuts + [probe_result.end]))
+
+        segments = []
+        for i in range(len(bounds) - 1):
+            req_start, req_end = bounds[i], bounds[i + 1]
+            if accurate:
+                body_start, body_end = probe_result.ceil(req_start), probe_result.floor(req_end)
+                if req_end >= probe_result.end:
+                    body_end = probe_result.end
+                start, end = req_start, req_end
+            else:
+                start = probe_result.nearest(req_start) if i else 0.0
+                end = probe_result.nearest(req_end) if i < len(bounds) - 2 else probe_result.end
+                body_start, body_end = start, end
+            if end <= start:
+                continue
+
+            temp_file = os.path.join(out_dir, f"segment_{uuid.uuid4()}.{output_format}")
+            segment = {
+                'index': i + 1,
+                'start_time': start,
+                'end_time': end,
+                'duration': end - start,
+                'filename': f"segment_{i + 1}.{output_format}",
+                'temp_path': temp_file,
+                'requested_start': req_start,
+                'requested_end': req_end,
+                'start_offset': start - req_start,
+                'end_offset': end - req_end,
+                'method': 'copy',
+            }
+
+            body = [piece for piece, (s, e) in zip(pieces, spans)
+                    if body_start <= s < e <= body_end]
+            head = (start, body_start) if body and body_start > start else None
+            tail = (body_end, end) if body and end > body_end else None
+            try:
+                if not body:
+                    # Shorter than a packet, or lossy and accurate: encode it whole
+                    encode_pcm(pcm, int(round(start * sr)), int(round(end * sr)),
+                               temp_file, encoder, muxer, probe_result.bit_rate)
+                    segment['method'] = 'reencode'
+                elif head is None and tail is None and len(body) == 1:
+                    shutil.move(body[0], temp_file)
+                else:
+                    parts = []
+                    for name, edge in (('head', head), (None, None), ('tail', tail)):
+                        if name is None:
+                            parts += body
+                        elif edge is not None:
+                            parts.append(os.path.join(work_dir, f"{name}_{i}.{output_format}"))
+                            encode_pcm(pcm, int(round(edge[0] * sr)), int(round(edge[1] * sr)),
+                                       parts[-1], encoder, muxer, probe_result.bit_rate)
+                    concat(parts, temp_file, muxer, work_dir)
+                    if head or tail:
+                        segment['method'] = 'smart'
+                if accurate:
+                    segment['duration'] = decoded_duration(temp_file)
+                    segment['end_time'] = start + segment['duration']
+                    segment['end_offset'] = segment['end_time'] - req_end
+            except (subprocess.CalledProcessError, OSError, ValueError) as e:
+                segment['temp_path'] = None
+                segment['error'] = str(e)
+            segments.append(segment)
+        return segments
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
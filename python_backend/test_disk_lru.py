@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for on-disk LRU housekeeping (disk_lru.py)
+"""
+
+import fcntl
+import os
+
+import disk_lru
+
+OLD = 1_000_000
+
+
+def make(path, age=None, directory=False):
+    if directory:
+        os.makedirs(path)
+        with open(os.path.join(path, 'media.m4a.part'), 'wb') as f:
+            f.write(b'x' * 100)
+    else:
+        with open(path, 'wb'):
+            pass
+    if age is not None:
+        os.utime(path, (age, age))
+    return path
+
+
+def test_remove_stale_partials(tmp_path):
+    root = str(tmp_path)
+    stale_dir = make(os.path.join(root, 'key1.abc123.part'), OLD, directory=True)
+    fresh_dir = make(os.path.join(root, 'key2.def456.part'), directory=True)
+    stale_tmp = make(os.path.join(root, 'key3.json.0f0f.tmp'), OLD)
+    stale_lock = make(os.path.join(root, 'key4.lock'), OLD)
+    held_lock = make(os.path.join(root, 'key5.lock'), OLD)
+    fresh_lock = make(os.path.join(root, 'key6.lock'))
+    entry = make(os.path.join(root, 'key7.m4a'), OLD)
+
+    with open(held_lock, 'w') as holder:
+        fcntl.flock(holder, fcntl.LOCK_EX)
+        os.utime(held_lock, (OLD, OLD))
+        disk_lru.remove_stale_partials(root)
+
+    remaining = set(os.listdir(root))
+    assert remaining == {os.path.basename(p) for p in (fresh_dir, held_lock, fresh_lock, entry)}
+    assert not any(os.path.exists(p) for p in (stale_dir, stale_tmp, stale_lock))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests for the pipelined download and decode (ingest.py)
+"""
+
+import http.server
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+import pytest
+
+import ingest
+from pcm_store import PCMStore
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+def file_chunks(path, size=64 * 1024):
+    total = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(size), b''):
+            yield data, total
+
+
+def ingest_file(tmp_path, source):
+    """Ingest `source` as if downloaded; returns (ingest result, PCMStore)"""
+    store = PCMStore(str(tmp_path / 'pcm'), 1 << 30)
+    dest = str(tmp_path / f"downloaded{os.path.splitext(source)[1]}")
+    return ingest.ingest(file_chunks(source), dest, store.root), store
+
+
+def assert_matches_file_decode(tmp_path, source, fetched, atol):
+    """The ingested PCM and peaks equal what decoding the finished file gives"""
+    assert fetched['pcm_path'] is not None
+    decoded = PCMStore(str(tmp_path / 'reference'), 1 << 30).get(source)
+    assert (fetched['sample_rate'], fetched['channels'], fetched['frames']) == \
+        (decoded.sample_rate, decoded.channels, decoded.frames)
+    piped = np.fromfile(fetched['pcm_path'], dtype=np.float32).reshape(-1, fetched['channels'])
+    np.testing.assert_allclose(piped, decoded.samples, rtol=0, atol=atol)
+    assert fetched['pyramid'].length == decoded.frames
+
+
+def test_mp3_end_padding_is_trimmed(tmp_path, tone):
+    source = tone('tone.mp3', '-b:a', '128k')
+    fetched, _ = ingest_file(tmp_path, source)
+    # libsndfile and ffmpeg are different MP3 decoders; they agree to float rounding
+    assert_matches_file_decode(tmp_path, source, fetched, atol=1e-5)
+
+
+def test_audioread_formats_match_16_bit_decode(tmp_path, tone):
+    source = tone('tone.m4a', '-c:a', 'aac', '-movflags', '+faststart')
+    fetched, _ = ingest_file(tmp_path, source)
+    assert_matches_file_decode(tmp_path, source, fetched, atol=0)
+
+
+def test_adopted_entry_equals_file_decode(tmp_path, tone):
+    source = tone('tone.flac')
+    fetched, store = ingest_file(tmp_path, source)
+    entry = store.adopt(fetched['sha256'], fetched['pcm_path'], fetched['sample_rate'],
+                        fetched['channels'], fetched['frames'])
+    decoded = PCMStore(str(tmp_path / 'reference'), 1 << 30).get(source)
+    np.testing.assert_array_equal(entry.samples, decoded.samples)
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's `files` by name with byte ranges; `drop_ranged` cuts ranged bodies short"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        data = self.server.files.get(self.path.lstrip('/'))
+        if data is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            body = data[start:end + 1]
+        else:
+            self.send_response(200)
+            body = data
+        self.send_header('Content-Type', 'audio/mpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if match and self.server.drop_ranged:
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def media_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    server.files, server.requests, server.drop_ranged = {}, [], False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_adopts_pipelined_decode(tmp_path, tone, media_server, processor):
+    source = tone('tone.mp3', '-b:a', '128k')
+    media_server.files['tone.mp3'] = open(source, 'rb').read()
+
+    path, duration = processor.download_audio(f"http://127.0.0.1:{media_server.server_port}/tone.mp3")
+    assert any(r and r.startswith('bytes=0-') for r in media_server.requests)  # Fetched by ingest
+    # Stored during the download, not decoded afterwards
+    key = processor.pcm_store.content_hash(path)
+    assert os.path.exists(os.path.join(processor.pcm_store.root, f"{key}.json"))
+    adopted = processor.pcm_store.get(path)
+    decoded = PCMStore(str(tmp_path / 'reference'), 1 << 30).get(path)
+    assert adopted.frames == decoded.frames and duration == decoded.duration
+    # ffmpeg and libsndfile decode MP3 to within 1e-5 (see ingest's module docstring)
+    np.testing.assert_allclose(adopted.samples, decoded.samples, rtol=0, atol=1e-5)
+
+
+def test_interrupted_download_falls_back_to_yt_dlp(tmp_path, tone, media_server, processor):
+    source = tone('tone.mp3', '-b:a', '128k')
+    media_server.files['tone.mp3'] = open(source, 'rb').read()
+    media_server.drop_ranged = True
+
+    path, _ = processor.download_audio(f"http://127.0.0.1:{media_server.server_port}/tone.mp3")
+    assert path is not None
+    with open(path, 'rb') as f:
+        assert f.read() == media_server.files['tone.mp3']
+    assert processor.pcm_store.get(path).duration == PCMStore(str(tmp_path / 'reference'), 1 << 30).get(source).duration
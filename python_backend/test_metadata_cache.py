@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for the URL metadata cache (metadata_cache.py)
+"""
+
+import time
+
+import yt_dlp
+
+from metadata_cache import MetadataCache
+
+
+def signed(name, expires):
+    return f"https://media.example.com/{name}.m4a?sig=abc&expire={int(expires)}"
+
+
+def test_expired_audio_url_is_refreshed_without_refetching():
+    fetched, resolved = [], []
+
+    def fetch(url):
+        fetched.append(url)
+        # Signed to expire within the refresh margin: stale on the next lookup
+        return {'title': 'Song', 'duration': 42, 'format': 'm4a', 'direct_audio_url': signed('old', time.time() + 30)}
+
+    def resolve_audio_url(url):
+        resolved.append(url)
+        return signed('new', time.time() + 6 * 3600), 'webm'
+
+    cache = MetadataCache(fetch, resolve_audio_url)
+    url = 'https://www.youtube.com/watch?v=abc'
+    assert 'old' in cache.get(url)['direct_audio_url']
+
+    refreshed = cache.get(url)
+    assert len(fetched) == 1 and resolved == [url]
+    assert 'new' in refreshed['direct_audio_url']
+    assert (refreshed['title'], refreshed['duration'], refreshed['format']) == ('Song', 42, 'webm')
+
+    assert cache.get(url) == refreshed  # Fresh again: no more extraction
+    assert len(fetched) == 1 and len(resolved) == 1
+
+
+def test_resolve_audio_url_skips_processing_and_sleeps(monkeypatch):
+    import audio_processor
+    calls = []
+
+    class FakeYoutubeDL:
+        def __init__(self, opts):
+            self.opts = opts
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=True, process=True):
+            calls.append((self.opts, process))
+            return {'id': 'abc', 'formats': [
+                {'url': signed('low', time.time() + 3600), 'ext': 'webm', 'acodec': 'opus', 'vcodec': 'none', 'abr': 64},
+                {'url': signed('high', time.time() + 3600), 'ext': 'm4a', 'acodec': 'mp4a', 'vcodec': 'none', 'abr': 128},
+                {'url': signed('video', time.time() + 3600), 'ext': 'mp4', 'acodec': 'mp4a', 'vcodec': 'avc1'},
+            ]}
+
+    monkeypatch.setattr(yt_dlp, 'YoutubeDL', FakeYoutubeDL)
+    direct_url, fmt = audio_processor.resolve_audio_url('https://www.youtube.com/watch?v=abc')
+    assert 'high' in direct_url and fmt == 'm4a'
+    [(opts, process)] = calls
+    assert process is False
+    assert not opts.get('sleep_interval') and not opts.get('max_sleep_interval')
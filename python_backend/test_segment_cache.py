@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the encoded segment cache (segment_cache.py)
+"""
+
+import os
+import shutil
+
+import pytest
+
+import disk_lru
+from segment_cache import SegmentCache
+
+
+def cached_file(cache, key, tmp_path, size=1000):
+    path = str(tmp_path / f"encoded_{key}.mp3")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    cache.store(key, 'mp3', path)
+    return path
+
+
+def test_hits_leave_served_files_untouched(tmp_path):
+    cache = SegmentCache(str(tmp_path / 'cache'), 1 << 20)
+    cached_file(cache, 'a', tmp_path)
+    served = str(tmp_path / 'served.mp3')
+    assert cache.fetch('a', 'mp3', served)
+    os.utime(served, (1_000_000, 1_000_000))  # As served earlier, with its ETag
+    marker = os.path.join(cache.root, 'a.used')
+    os.utime(marker, (1_000_000, 1_000_000))
+
+    assert cache.fetch('a', 'mp3', str(tmp_path / 'again.mp3'))
+    assert os.stat(served).st_mtime == 1_000_000
+    assert os.stat(marker).st_mtime > 1_000_000
+
+
+def test_eviction_follows_recent_hits(tmp_path):
+    cache = SegmentCache(str(tmp_path / 'cache'), 2500)
+    cached_file(cache, 'old', tmp_path)
+    cached_file(cache, 'new', tmp_path)
+    for key, age in (('old', 300), ('new', 200)):
+        for name in (f"{key}.mp3", f"{key}.used"):
+            os.utime(os.path.join(cache.root, name), (1_000_000 - age, 1_000_000 - age))
+    assert cache.fetch('old', 'mp3', str(tmp_path / 'hit.mp3'))  # Now the most recent
+
+    cached_file(cache, 'third', tmp_path)
+    assert set(disk_lru.scan(cache.root)) == {'old', 'third'}
+    assert not os.path.exists(os.path.join(cache.root, 'new.used'))
+    assert cache.fetch('new', 'mp3', str(tmp_path / 'miss.mp3')) is False
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+def test_moving_one_marker_re_encodes_only_its_segments(tone, processor, monkeypatch):
+    source = tone('tone.wav', seconds=20)
+    encoded = []
+    iter_export = processor.exporter.iter_export
+
+    def counting(pcm, jobs, *args, **kwargs):
+        encoded.extend((start, end) for start, end, _ in jobs)
+        return iter_export(pcm, jobs, *args, **kwargs)
+
+    monkeypatch.setattr(processor.exporter, 'iter_export', counting)
+    first, _ = processor.split_audio(source, [5, 10, 15], 'mp3')
+    assert len(encoded) == 4
+
+    encoded.clear()
+    second, _ = processor.split_audio(source, [5, 12, 15], 'mp3')
+    sr = 44100
+    assert sorted(encoded) == [(5 * sr, 12 * sr), (12 * sr, 15 * sr)]
+    for index in (0, 3):  # Unchanged segments come from the cache, byte for byte
+        with open(first[index]['temp_path'], 'rb') as a, open(second[index]['temp_path'], 'rb') as b:
+            assert a.read() == b.read()
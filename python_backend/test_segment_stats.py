@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for per-segment level analytics (segment_stats.py)
+"""
+
+import re
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import segment_stats
+from pcm_store import PCMStore
+
+SR = 48000
+
+
+def store_pcm(tmp_path, samples, name='signal.wav'):
+    path = str(tmp_path / name)
+    sf.write(path, samples, SR, subtype='FLOAT')
+    return path, PCMStore(str(tmp_path / 'pcm'), 1 << 30).get(path)
+
+
+def sine(seconds, dbfs, freq=1000.0, channels=2):
+    t = np.arange(int(seconds * SR)) / SR
+    wave = (10 ** (dbfs / 20) * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+    return np.repeat(wave[:, None], channels, axis=1)
+
+
+def ffmpeg_loudness(path):
+    """Integrated loudness from ffmpeg's ebur128 filter"""
+    log = subprocess.run(['ffmpeg', '-nostats', '-i', path, '-af', 'ebur128', '-f', 'null', '-'],
+                         capture_output=True, text=True, check=True).stderr
+    return float(re.findall(r"I:\s+(-?[\d.]+) LUFS", log)[-1])
+
+
+def test_ebu_reference_sine_reads_minus_23_lufs(tmp_path):
+    # EBU Tech 3341 case 1: 1 kHz stereo sine at -23 dBFS is -23.0 LUFS (+/- 0.1)
+    _, pcm = store_pcm(tmp_path, sine(20, -23))
+    [stats] = segment_stats.analyze(pcm, [(0, pcm.frames)])
+    assert stats['loudness_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert stats['peak_db'] == pytest.approx(-23.0, abs=0.01)
+    assert stats['rms_db'] == pytest.approx(-26.01, abs=0.01)
+    assert stats['clipped_samples'] == 0
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+def test_segment_loudness_matches_ffmpeg_ebur128(tmp_path):
+    rng = np.random.default_rng(3)
+    # Noise plus tones across the band, with changing level so both gates matter
+    t = np.arange(12 * SR)[:, None] / SR
+    mix = rng.standard_normal((12 * SR, 2)) * 0.3 + sum(np.sin(2 * np.pi * f * t) for f in (60, 440, 3000, 9000))
+    envelope = np.repeat([0.02, 0.3, 0.001, 0.1, 0.5, 0.05], 2 * SR)[:, None]
+    signal = (mix / np.abs(mix).max() * envelope).astype(np.float32)
+    _, pcm = store_pcm(tmp_path, signal)
+
+    bounds = [(0, 5 * SR), (5 * SR, 9 * SR), (9 * SR, 12 * SR)]
+    for (start, end), stats in zip(bounds, segment_stats.analyze(pcm, bounds)):
+        piece = str(tmp_path / f"piece_{start}.wav")
+        sf.write(piece, signal[start:end], SR, subtype='FLOAT')
+        assert stats['loudness_lufs'] == pytest.approx(ffmpeg_loudness(piece), abs=0.1)
+
+
+def test_silent_segment_gets_no_gain(tmp_path):
+    samples = np.concatenate([np.zeros((2 * SR, 2), dtype=np.float32), sine(2, -30)])
+    _, pcm = store_pcm(tmp_path, samples)
+    silent, tone = segment_stats.analyze(pcm, [(0, 2 * SR), (2 * SR, 4 * SR)])
+    assert silent['loudness_lufs'] is None and silent['peak_db'] is None
+    assert silent['leading_silence'] == silent['trailing_silence'] == 2.0
+    assert segment_stats.normalization_gain(silent, -16) == 0.0
+    assert segment_stats.normalization_gain(tone, -30) == pytest.approx(-30 - tone['loudness_lufs'], abs=0.01)
+
+
+def test_gain_is_held_back_by_the_peak_ceiling(tmp_path):
+    _, pcm = store_pcm(tmp_path, sine(5, -6))
+    [stats] = segment_stats.analyze(pcm, [(0, pcm.frames)])
+    assert stats['loudness_lufs'] == pytest.approx(-6.0, abs=0.1)
+    assert segment_stats.normalization_gain(stats, -10) == pytest.approx(-10 - stats['loudness_lufs'], abs=0.01)
+    # Reaching 0 LUFS would need about +6 dB, but the peak may only rise to the ceiling
+    assert segment_stats.normalization_gain(stats, 0) == pytest.approx(5.0, abs=0.01)
+    assert segment_stats.normalization_gain(stats, 0, peak_ceiling_db=-3) == pytest.approx(3.0, abs=0.01)
+
+
+def test_short_segments_have_no_loudness(tmp_path):
+    _, pcm = store_pcm(tmp_path, sine(1, -20))
+    short, longer = segment_stats.analyze(pcm, [(0, int(0.3 * SR)), (int(0.3 * SR), SR)])
+    assert short['loudness_lufs'] is None and short['peak_db'] == pytest.approx(-20, abs=0.01)
+    assert longer['loudness_lufs'] is not None
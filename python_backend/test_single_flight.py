@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-key single-flight locks (single_flight.py)
+"""
+
+import threading
+import time
+
+from single_flight import KeyLocks
+
+
+def test_one_holder_per_key_under_contention():
+    locks = KeyLocks()
+    active = {key: 0 for key in range(3)}
+    most = {key: 0 for key in range(3)}
+    guard = threading.Lock()
+
+    def worker(i):
+        key = i % 3
+        for n in range(50):
+            try:
+                with locks.hold(key):
+                    with guard:
+                        active[key] += 1
+                        most[key] = max(most[key], active[key])
+                    time.sleep(0.0005)
+                    with guard:
+                        active[key] -= 1
+                    if n % 7 == 0:
+                        raise RuntimeError('failed computation')
+            except RuntimeError:
+                pass
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert most == {0: 1, 1: 1, 2: 1}
+    assert not locks._locks  # Dropped once the last holder left
+
+
+def test_waiter_keeps_the_lock_alive():
+    # A holder leaving while another thread waits must not let a third caller in alongside it
+    locks = KeyLocks()
+    entered, release = threading.Event(), threading.Event()
+    inside = []
+
+    def first():
+        with locks.hold('k'):
+            entered.set()
+            release.wait()
+
+    def later(name):
+        with locks.hold('k'):
+            inside.append(name)
+            time.sleep(0.05)
+            inside.remove(name)
+
+    t1 = threading.Thread(target=first)
+    t1.start()
+    entered.wait()
+    t2 = threading.Thread(target=later, args=('waiter',))
+    t2.start()
+    time.sleep(0.05)  # t2 is now blocked on the key's lock
+    release.set()
+    t1.join()
+    with locks.hold('k'):
+        assert inside == []
+    t2.join()
+
+
+def test_get_or_compute_runs_once_per_key():
+    locks = KeyLocks()
+    store, calls = {}, []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.02)
+        store['k'] = 'value'
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(locks.get_or_compute('k', lambda: store.get('k'),
+                                                                                   compute)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [('value', False)] + [('value', True)] * 7
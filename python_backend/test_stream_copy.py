@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Tests for stream-copy splitting (stream_copy.py)
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from pcm_store import PCMStore
+from stream_copy import decoded_duration, split_copy
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+SPLITS = [5, 10]
+
+
+@pytest.mark.parametrize('output_format, args, padding', [
+    ('mp3', ['-b:a', '128k'], 0),
+    ('opus', ['-c:a', 'libopus'], 0),
+    ('flac', [], 0),
+    ('m4a', ['-c:a', 'aac'], 1024 / 44100),  # Ends on a whole AAC frame
+])
+def test_accurate_segments_decode_to_requested_lengths(tmp_path, output_format, args, padding):
+    source = str(tmp_path / f"source.{output_format}")
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'sine=f=440:d=20:sample_rate=44100',
+                    '-ac', '2', *args, source], check=True)
+    pcm = PCMStore(str(tmp_path / 'pcm'), 1 << 30).get(source)
+
+    segments = split_copy(source, pcm, SPLITS, output_format, str(tmp_path), accurate=True)
+    assert [s['index'] for s in segments] == [1, 2, 3]
+    for segment, requested in zip(segments, [5.0, 5.0, pcm.duration - 10]):
+        assert 'error' not in segment
+        decoded = decoded_duration(segment['temp_path'])
+        assert segment['duration'] == pytest.approx(decoded, abs=1e-6)
+        assert requested - 1e-6 <= decoded < requested + padding + 1e-6
+        assert segment['start_offset'] == 0
+        assert segment['end_offset'] == pytest.approx(decoded - requested, abs=1e-6)
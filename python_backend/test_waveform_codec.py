@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for the binary waveform peak format (waveform_codec.py)
+"""
+
+import zlib
+
+import numpy as np
+import pytest
+
+from waveform_codec import HEADER, decode_peaks, encode_peaks
+
+
+@pytest.fixture(scope='module')
+def peaks():
+    rng = np.random.default_rng(4)
+    a, b = rng.uniform(-1, 1, (2, 500)).astype(np.float32)
+    mins, maxs = np.minimum(a, b), np.maximum(a, b)
+    mins[:3], maxs[:3] = -1.0, 1.0  # Full scale survives quantization
+    return mins, maxs, rng.uniform(0, 0.7, 500).astype(np.float32)
+
+
+@pytest.mark.parametrize('bits', [8, 16])
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('with_rms', [False, True])
+def test_round_trip(peaks, bits, compress, with_rms):
+    mins, maxs, rms = peaks
+    data = encode_peaks(mins, maxs, rms if with_rms else None, 44100, 123.5, 2.25, 512.0, bits, compress)
+    decoded = decode_peaks(data)
+
+    assert (decoded['sample_rate'], decoded['duration'], decoded['start'], decoded['samples_per_bucket']) == \
+        (44100, 123.5, 2.25, 512.0)
+    step = 1 / ((1 << (bits - 1)) - 1)
+    # Minimums round down and maximums up: the envelope never shrinks
+    assert np.all(decoded['min'] <= mins + 1e-6) and np.all(decoded['min'] > mins - step - 1e-6)
+    assert np.all(decoded['max'] >= maxs - 1e-6) and np.all(decoded['max'] < maxs + step + 1e-6)
+    assert decoded['min'][0] == -1.0 and decoded['max'][0] == 1.0
+    if with_rms:
+        np.testing.assert_allclose(decoded['rms'], rms, atol=step / 2 + 1e-6)
+    else:
+        assert decoded['rms'] is None
+
+
+def test_payload_size():
+    envelope = np.sin(np.linspace(0, 3, 2000)) * 0.5
+    assert len(encode_peaks(-envelope, envelope, envelope, bits=16)) == HEADER.size + 3 * 2000 * 2
+    assert len(encode_peaks(-envelope, envelope, bits=8)) == HEADER.size + 2 * 2000
+
+
+def test_empty_peaks_round_trip():
+    decoded = decode_peaks(encode_peaks([], [], [], 8000, 0.0, bits=8, compress=True))
+    assert len(decoded['min']) == len(decoded['max']) == len(decoded['rms']) == 0
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_rejects_malformed_payloads(peaks, compress):
+    mins, maxs, rms = peaks
+    data = encode_peaks(mins, maxs, rms, 44100, 10.0, bits=16, compress=compress)
+
+    with pytest.raises(ValueError, match='Not a version 1'):
+        decode_peaks(b'XXXX' + data[4:])
+    with pytest.raises(ValueError, match='Not a version 1'):
+        decode_peaks(data[:4] + bytes([2]) + data[5:])
+    with pytest.raises(ValueError, match='Unsupported sample width'):
+        decode_peaks(data[:5] + bytes([12]) + data[6:])
+    with pytest.raises(ValueError, match='too short'):
+        decode_peaks(data[:HEADER.size - 1])
+    with pytest.raises(ValueError):
+        decode_peaks(data[:-7])  # Truncated payload
+    with pytest.raises(ValueError):
+        decode_peaks(data + b'\0' * 4)
+
+
+def test_rejects_payload_shorter_than_its_count():
+    data = encode_peaks([0.1, 0.2], [0.3, 0.4], bits=8)
+    header = HEADER.unpack_from(data)
+    lying = HEADER.pack(*header[:-1], 3) + data[HEADER.size:]
+    with pytest.raises(ValueError, match='expected'):
+        decode_peaks(lying)
+    compressed = HEADER.pack(*header[:3], 1, *header[4:-1], 3) + zlib.compress(data[HEADER.size:])
+    with pytest.raises(ValueError, match='expected'):
+        decode_peaks(compressed)
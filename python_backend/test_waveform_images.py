@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Tests for cached waveform images (waveform_images.py and GET /waveform/image)
+"""
+
+import shutil
+
+import numpy as np
+import pytest
+
+from waveform_images import BaseImage, WaveformImageCache
+
+
+def base_image(nbytes):
+    return BaseImage(np.zeros(nbytes, dtype=np.uint8), (0, 0, 1, 1), 1.0)
+
+
+def test_base_images_are_evicted_least_recently_used_first():
+    cache = WaveformImageCache(max_bytes=250)
+    for key in 'abc':
+        cache.base(key, lambda: base_image(100))
+    # 'a' went first; touching 'b' makes 'c' the next to go
+    assert cache.base('b', lambda: pytest.fail('b is cached'))[1]
+    cache.base('d', lambda: base_image(100))
+    assert cache.base('b', lambda: pytest.fail('b is cached'))[1]
+    assert cache.base('d', lambda: pytest.fail('d is cached'))[1]
+    assert cache.base('c', lambda: base_image(100))[1] is False
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+def test_revalidation_and_marker_changes(tone, processor, monkeypatch):
+    import audio_processor
+    monkeypatch.setattr(audio_processor, 'processor', processor)
+    source = shutil.copy(tone('tone.wav'), processor.temp_dir)
+    renders = []
+    render = processor._render_base_image
+
+    def counting(*args):
+        renders.append(args)
+        return render(*args)
+
+    monkeypatch.setattr(processor, '_render_base_image', counting)
+    client = audio_processor.app.test_client()
+    url = f"/waveform/image?file={source}&width=400&height=120"
+
+    first = client.get(url + '&split_points=1,2.5')
+    assert first.status_code == 200 and first.mimetype == 'image/png'
+    assert first.data.startswith(b'\x89PNG')
+    etag = first.headers['ETag']
+
+    again = client.get(url + '&split_points=1,2.5', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == etag
+
+    moved = client.get(url + '&split_points=1,3', headers={'If-None-Match': etag})
+    assert moved.status_code == 200 and moved.headers['ETag'] != etag
+    assert moved.data != first.data
+    assert len(renders) == 1  # Markers are composited onto the cached base
+
+    client.get(url + '&split_points=1,3&theme=light')
+    assert len(renders) == 2
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests that streamed and in-memory waveform data agree (AUDIO_WAVEFORM_MODE)
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import ingest
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+# PCM adopted from the download-time decode comes from ffmpeg's MP3 decoder,
+# while streaming decodes the file with libsndfile: they agree to float rounding
+DECODER_TOLERANCE = 1e-5
+
+
+@pytest.mark.parametrize('name, args', [('tone.flac', []), ('tone.mp3', ['-b:a', '128k']),
+                                        ('tone.m4a', ['-c:a', 'aac'])])
+def test_streamed_waveform_equals_in_memory_for_file_decodes(tone, processor, name, args):
+    source = tone(name, *args)
+    assert processor.generate_waveform_data(source, mode='stream') == \
+        processor.generate_waveform_data(source, mode='memory')
+
+
+def test_streamed_waveform_matches_download_time_decode(tmp_path, tone, processor):
+    source = tone('tone.mp3', '-b:a', '128k')
+    dest = str(tmp_path / 'downloaded.mp3')
+    with open(source, 'rb') as f:
+        fetched = ingest.ingest(((data, os.path.getsize(source)) for data in iter(lambda: f.read(1 << 16), b'')),
+                                dest, processor.pcm_store.root)
+    processor.pcm_store.remember_hash(dest, fetched['sha256'])
+    processor.pcm_store.adopt(fetched['sha256'], fetched['pcm_path'], fetched['sample_rate'],
+                              fetched['channels'], fetched['frames'])
+
+    streamed = processor.generate_waveform_data(dest, mode='stream')
+    in_memory = processor.generate_waveform_data(dest, mode='memory')
+    for name in ('duration', 'sample_rate', 'original_length', 'samples_per_bucket', 'times'):
+        assert streamed[name] == in_memory[name]
+    # Near ties between |min| and |max| may pick the other sign; the magnitude agrees
+    np.testing.assert_allclose(np.abs(streamed['amplitudes']), np.abs(in_memory['amplitudes']),
+                               rtol=0, atol=DECODER_TOLERANCE)
+    for name in ('min', 'max', 'rms'):
+        np.testing.assert_allclose(streamed['peaks'][name], in_memory['peaks'][name], rtol=0, atol=DECODER_TOLERANCE)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the min/max/RMS peak pyramid (waveform_peaks.py)
+"""
+
+import numpy as np
+import pytest
+
+from waveform_peaks import BASE_BUCKET, STREAM_MAX_BUCKETS, PeakPyramid, overview, stream_bucket
+
+# Not a multiple of the base bucket, so the last bucket is partial
+LENGTH = 300 * BASE_BUCKET + 77
+
+
+@pytest.fixture(scope='module')
+def signal():
+    rng = np.random.default_rng(1)
+    return (rng.standard_normal(LENGTH) * np.linspace(0.01, 1, LENGTH)).astype(np.float32)
+
+
+def brute_force(y, lo, hi):
+    """min, max and RMS of each column [lo_i, hi_i)"""
+    cols = [y[a:b] for a, b in zip(lo, hi)]
+    return (np.array([c.min() for c in cols], dtype=np.float32),
+            np.array([c.max() for c in cols], dtype=np.float32),
+            np.array([np.sqrt(np.mean(np.square(c, dtype=np.float64))) for c in cols], dtype=np.float32))
+
+
+def assert_columns(peaks, y, lo, hi):
+    mins, maxs, rms = brute_force(y, lo, hi)
+    np.testing.assert_array_equal(peaks['min'], mins)
+    np.testing.assert_array_equal(peaks['max'], maxs)
+    np.testing.assert_allclose(peaks['rms'], rms, rtol=1e-5)
+
+
+def ranges():
+    rng = np.random.default_rng(2)
+    cases = [(0, LENGTH, 1), (0, LENGTH, 2000), (LENGTH - 1000, LENGTH, 7),  # Whole file, last partial bucket
+             (LENGTH - 1, LENGTH, 1), (0, 1, 1), (12345, 12346, 5),  # Single samples
+             (100, 140, 100)]  # Wider than the range: one sample per column
+    for _ in range(40):
+        start, end = sorted(rng.integers(0, LENGTH + 1, size=2))
+        cases.append((int(start), int(end) + 1, int(rng.choice([1, 3, 64, 500, 1920]))))
+    return cases
+
+
+@pytest.mark.parametrize('start, end, width', ranges())
+def test_exact_query_matches_brute_force(signal, start, end, width):
+    pyramid = PeakPyramid.from_signal(signal, 44100)
+    peaks = pyramid.query(start, end, width)
+    end = min(end, LENGTH)
+    assert len(peaks['min']) == min(width, end - start)
+    edges = peaks['edges']
+    assert edges[0] == start and edges[-1] == end and np.all(np.diff(edges) > 0)
+    assert_columns(peaks, signal, edges[:-1], edges[1:])
+
+
+@pytest.mark.parametrize('grid', [BASE_BUCKET, 4 * BASE_BUCKET])
+@pytest.mark.parametrize('start, end, width', ranges()[::4])
+def test_bucket_query_snaps_columns_to_the_grid(signal, grid, start, end, width):
+    pyramid = PeakPyramid.from_signal(signal, 44100, keep_samples=False)
+    peaks = pyramid.query(start, end, width, exact=False, grid=grid)
+    edges = peaks['edges']
+    lo = (edges[:-1] // grid) * grid
+    hi = np.minimum(-(-edges[1:] // grid) * grid, LENGTH)
+    assert_columns(peaks, signal, lo, hi)
+
+
+def test_capped_streamed_build_matches_in_memory_build(signal):
+    blocks = np.array_split(signal, 37)  # Odd block sizes, not bucket aligned
+    streamed = PeakPyramid.from_blocks(blocks, 44100, max_buckets=50)
+    bucket = stream_bucket(LENGTH, max_buckets=50)
+    assert streamed.base_bucket == bucket
+    in_memory = PeakPyramid.from_signal(signal, 44100, base_bucket=bucket, keep_samples=False)
+    for ours, theirs in zip(streamed.levels, in_memory.levels):
+        for a, b in zip(ours, theirs):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_overview_is_the_same_for_streamed_and_in_memory_pyramids():
+    # Long enough that the streamed build coarsens its base level
+    length = STREAM_MAX_BUCKETS * BASE_BUCKET * 2 + 12345
+    y = np.sin(np.arange(length, dtype=np.float32) * np.float32(0.001)) * np.linspace(0, 1, length, dtype=np.float32)
+    blocks = (y[i:i + (1 << 20)] for i in range(0, length, 1 << 20))
+    streamed = PeakPyramid.from_blocks(blocks, 44100, max_buckets=STREAM_MAX_BUCKETS)
+    assert streamed.base_bucket > BASE_BUCKET
+    in_memory = overview(PeakPyramid.from_signal(y, 44100), points=1500)
+    assert overview(streamed, points=1500) == in_memory
+    assert in_memory['original_length'] == length and len(in_memory['amplitudes']) == 1500
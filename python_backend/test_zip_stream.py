@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for streamed ZIP archives (zip_stream.py)
+"""
+
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+
+from zip_stream import ZipStream, safe_arcname
+
+
+def build(entries, compress=False):
+    """Archive bytes for [(arcname, path or bytes)], as a response would stream them; also the names used"""
+    archive, chunks, names = ZipStream(), [], []
+
+    def run(gen):
+        while True:
+            try:
+                chunks.append(next(gen))
+            except StopIteration as stop:
+                return stop.value
+
+    for arcname, source in entries:
+        if isinstance(source, bytes):
+            names.append(run(archive.add_bytes(arcname, source)))
+        else:
+            names.append(run(archive.add_file(arcname, source, compress)))
+    run(archive.close())
+    data = b''.join(chunks)
+    assert archive.bytes_written == len(data)
+    return data, names
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i, size in enumerate([0, 1000, 3 * 1024 * 1024 + 17]):  # Empty, small, several chunks
+        path = str(tmp_path / f"segment_{i}.mp3")
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_streamed_archive_is_valid(files, compress):
+    entries = [(os.path.basename(p), p) for p in files] + [('segments.json', b'{"segments": []}')]
+    data, names = build(entries, compress)
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == names
+        for path, info in zip(files, zf.infolist()):
+            # Written without seeking: sizes and CRC follow the data
+            assert info.flag_bits & 0x08
+            with open(path, 'rb') as f:
+                assert zf.read(info) == f.read()
+        assert zf.read('segments.json') == b'{"segments": []}'
+
+
+def test_zip64_headers(files, monkeypatch):
+    # Entries past the ZIP64 limit need ZIP64 extra fields; lower the limit instead of writing 4 GiB
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1 << 20)
+    data, _ = build([(os.path.basename(p), p) for p in files])
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        big = zf.getinfo('segment_2.mp3')
+        assert big.file_size == 3 * 1024 * 1024 + 17
+    # The local header of the big entry carries a ZIP64 extra field (id 0x0001)
+    offset = big.header_offset
+    name_len, extra_len = struct.unpack_from('<HH', data, offset + 26)
+    extra = data[offset + 30 + name_len:offset + 30 + name_len + extra_len]
+    assert struct.unpack_from('<H', extra)[0] == 0x0001
+
+
+def test_duplicate_names_are_numbered(files):
+    data, names = build([('track.mp3', files[1]), ('track.mp3', files[1]), ('track.mp3', b'x')])
+    assert names == ['track.mp3', 'track (2).mp3', 'track (3).mp3']
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == names and zf.testzip() is None
+
+
+@pytest.mark.parametrize('name, safe', [
+    ('../../etc/passwd', 'etc/passwd'),
+    ('/abs/path/song.mp3', 'abs/path/song.mp3'),
+    ('C:\\Users\\me\\song.mp3', 'C_/Users/me/song.mp3'),
+    ('a/./b/../c.mp3', 'a/b/c.mp3'),
+    ('bad\x00na:me?.mp3', 'bad_na_me_.mp3'),
+    ('..', 'unnamed'),
+    ('', 'unnamed'),
+])
+def test_safe_arcname(name, safe):
+    assert safe_arcname(name) == safe
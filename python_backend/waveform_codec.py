@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Compact binary encoding for waveform peaks.
+
+A 40-byte little-endian header followed by interleaved min/max pairs and
+then RMS values, each quantized to int8 or int16, optionally zlib-compressed:
+
+    magic    4s   b'AWPK'
+    version  B    1
+    bits     B    8 or 16
+    flags    B    bit 0: payload is zlib-compressed, bit 1: RMS values present
+    reserved B
+    sample_rate        I
+    duration           d  seconds
+    start              d  seconds of the first bucket
+    samples_per_bucket d
+    count              I  number of buckets
+
+Bucket i covers start + i * samples_per_bucket / sample_rate seconds, so no
+time array is sent. Minimums are rounded down and maximums up, so the decoded
+envelope never looks quieter than the source.
+"""
+
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'AWPK'
+VERSION = 1
+MIMETYPE = 'application/x-audio-peaks'
+HEADER = struct.Struct('<4sBBBBIdddI')
+FLAG_COMPRESSED = 1
+FLAG_RMS = 2
+ENCODINGS = {'int8': 8, 'int16': 16}
+DTYPES = {8: np.dtype('<i1'), 16: np.dtype('<i2')}
+
+
+def quantize(values, bits, rounding=np.round):
+    scale = (1 << (bits - 1)) - 1
+    values = np.clip(np.asarray(values, dtype=np.float64), -1.0, 1.0) * scale
+    return np.clip(rounding(values), -scale, scale).astype(DTYPES[bits])
+
+
+def encode_peaks(mins, maxs, rms=None, sample_rate=0, duration=0.0, start=0.0,
+                 samples_per_bucket=0.0, bits=16, compress=False):
+    """Pack min/max (and optional RMS) peaks into the binary format"""
+    if bits not in DTYPES:
+        raise ValueError(f"Unsupported sample width: {bits} bits")
+    count = len(mins)
+    pairs = np.empty((count, 2), dtype=DTYPES[bits])
+    pairs[:, 0] = quantize(mins, bits, np.floor)
+    pairs[:, 1] = quantize(maxs, bits, np.ceil)
+    payload = pairs.tobytes()
+    flags = 0
+    if rms is not None:
+        payload += quantize(rms, bits).tobytes()
+        flags |= FLAG_RMS
+    if compress:
+        payload = zlib.compress(payload, 6)
+        flags |= FLAG_COMPRESSED
+    header = HEADER.pack(MAGIC, VERSION, bits, flags, 0, int(sample_rate), float(duration),
+                         float(start), float(samples_per_bucket), count)
+    return header + payload
+
+
+def decode_peaks(data):
+    """Unpack the binary format into float arrays in [-1, 1]; ValueError if it is malformed"""
+    if len(data) < HEADER.size:
+        raise ValueError(f"Peak payload too short for its header: {len(data)} bytes")
+    magic, version, bits, flags, _, sample_rate, duration, start, spb, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version 1 peak payload")
+    if bits not in DTYPES:
+        raise ValueError(f"Unsupported sample width: {bits} bits")
+    payload = data[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        stream = zlib.decompressobj()
+        try:
+            payload = stream.decompress(payload)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt compressed peak payload: {e}") from e
+        if not stream.eof or stream.unused_data:
+            raise ValueError("Truncated or padded compressed peak payload")
+    dtype = DTYPES[bits]
+    expected = (3 if flags & FLAG_RMS else 2) * count * dtype.itemsize
+    if len(payload) != expected:
+        raise ValueError(f"Peak payload holds {len(payload)} bytes, expected {expected} for {count} buckets")
+    scale = float((1 << (bits - 1)) - 1)
+    values = np.frombuffer(payload, dtype=dtype).astype(np.float32) / scale
+    pairs = values[:2 * count].reshape(count, 2)
+    return {
+        'sample_rate': sample_rate,
+        'duration': duration,
+        'start': start,
+        'samples_per_bucket': spb,
+        'min': pairs[:, 0],
+        'max': pairs[:, 1],
+        'rms': values[2 * count:3 * count] if flags & FLAG_RMS else None,
+    }
+
+
+def encode_overview(data, bits=16, compress=False):
+    """Binary form of a waveform_peaks.overview() result"""
+    peaks = data['peaks']
+    return encode_peaks(peaks['min'], peaks['max'], peaks['rms'], data['sample_rate'],
+                        data['duration'], 0.0, data['samples_per_bucket'], bits, compress)
+
+
+def to_base64(payload):
+    return base64.b64encode(payload).decode('ascii')
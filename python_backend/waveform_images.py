@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Cache of rendered waveform images.
+
+Rendering a waveform (from the peak pyramid, or through matplotlib for the
+annotated style) is the expensive part of an image; split markers are a few
+columns and labels drawn on top. Bases are kept as 8-bit RGB pixels with the
+plot area they map time onto, keyed by (source hash, width, height, theme,
+style), in an LRU bounded by bytes. Finished PNGs are also kept for a while by
+their ETag, so a repeated request is a dictionary lookup and a request with
+new markers only pays for compositing and PNG encoding.
+"""
+
+import threading
+from collections import OrderedDict
+
+from single_flight import KeyLocks
+
+
+class BaseImage:
+    """Rendered waveform without markers: uint8 (height, width, 3) pixels"""
+
+    def __init__(self, pixels, rect, duration):
+        self.pixels = pixels
+        self.rect = rect          # (x0, y0, x1, y1) of the area spanning 0..duration
+        self.duration = duration
+
+    @property
+    def nbytes(self):
+        return self.pixels.nbytes
+
+
+class WaveformImageCache:
+    """Base images by key, computed once each, and recent PNGs by ETag"""
+
+    MAX_PNGS = 64
+
+    def __init__(self, max_bytes=64 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._bases = OrderedDict()
+        self._pngs = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+
+    def _lookup(self, key):
+        with self._lock:
+            cached = self._bases.get(key)
+            if cached is not None:
+                self._bases.move_to_end(key)
+            return cached
+
+    def _store(self, key, base):
+        with self._lock:
+            if key in self._bases:
+                return
+            self._bases[key] = base
+            self._size += base.nbytes
+            while self._size > self.max_bytes and len(self._bases) > 1:
+                _, evicted = self._bases.popitem(last=False)
+                self._size -= evicted.nbytes
+
+    def base(self, key, render):
+        """(BaseImage, hit) for `key`, calling `render()` on a miss"""
+        def compute():
+            base = render()
+            self._store(key, base)
+            return base
+
+        return self._key_locks.get_or_compute(key, lambda: self._lookup(key), compute)
+
+    def png(self, etag):
+        with self._lock:
+            data = self._pngs.get(etag)
+            if data is not None:
+                self._pngs.move_to_end(etag)
+            return data
+
+    def store_png(self, etag, data):
+        with self._lock:
+            self._pngs[etag] = data
+            self._pngs.move_to_end(etag)
+            while len(self._pngs) > self.MAX_PNGS:
+                self._pngs.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._bases.clear()
+            self._pngs.clear()
+            self._size = 0
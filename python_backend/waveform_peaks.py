@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution min/max/RMS peak pyramid for waveform display and zooming.
+
+The base level reduces the signal into fixed-size buckets; every level above
+halves the resolution again. Zoom queries combine whole buckets from the
+coarsest level that fits and only touch raw samples at the column edges, so a
+query costs time proportional to the output width, not the file length.
+"""
+
+import numpy as np
+
+BASE_BUCKET = 256  # Samples per bucket on the finest level
+STREAM_MAX_BUCKETS = 1 << 16  # Base-level cap for streamed builds
+
+
+def _merge_pairs(buckets):
+    """Reduce adjacent bucket pairs; an odd trailing bucket pairs with the identity"""
+    mins, maxs, sumsq = buckets
+    if len(mins) % 2:
+        mins = np.append(mins, np.float32(np.inf))
+        maxs = np.append(maxs, np.float32(-np.inf))
+        sumsq = np.append(sumsq, 0.0)
+    return (np.minimum(mins[0::2], mins[1::2]),
+            np.maximum(maxs[0::2], maxs[1::2]),
+            sumsq[0::2] + sumsq[1::2])
+
+
+def _concat(parts):
+    if not parts:
+        return (np.zeros(0, dtype=np.float32),
+                np.zeros(0, dtype=np.float32),
+                np.zeros(0, dtype=np.float64))
+    return tuple(np.concatenate([part[i] for part in parts]) for i in range(3))
+
+
+def _split_last(buckets):
+    return tuple(a[:-1] for a in buckets), tuple(a[-1:] for a in buckets)
+
+
+def stream_bucket(length, base_bucket=BASE_BUCKET, max_buckets=STREAM_MAX_BUCKETS):
+    """Bucket size a builder capped at `max_buckets` ends up with for `length` samples"""
+    bucket = base_bucket
+    while -(-length // bucket) > max_buckets:
+        bucket *= 2
+    return bucket
+
+
+class PeakPyramidBuilder:
+    """
+    Fold mono sample blocks into the base level of a peak pyramid.
+
+    With `max_buckets` set, the base level doubles its bucket size whenever it
+    would grow past that many buckets, so memory stays flat however long the
+    input is. Buckets are always merged in the same pairwise order as the
+    pyramid levels, so the result matches an uncapped build exactly.
+    """
+
+    def __init__(self, sample_rate, base_bucket=BASE_BUCKET, max_buckets=None):
+        self.sample_rate = sample_rate
+        self.base_bucket = base_bucket
+        self.max_buckets = max_buckets
+        self.length = 0
+        self.level = 0  # Output buckets hold base_bucket * 2**level samples
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._pending = []  # One unpaired bucket (or None) per level below self.level
+        self._out = []
+        self._count = 0
+
+    def add(self, block):
+        """Add the next block of mono samples"""
+        block = np.asarray(block, dtype=np.float32)
+        if block.size == 0:
+            return
+        self.length += len(block)
+        if len(self._carry):
+            block = np.concatenate([self._carry, block])
+
+        full = len(block) // self.base_bucket
+        if full:
+            self._push(self._reduce(block[:full * self.base_bucket].reshape(full, self.base_bucket)))
+        self._carry = block[full * self.base_bucket:].copy()
+
+    def finish(self, samples=None):
+        """Return the finished pyramid; `samples` enables exact edge queries"""
+        tail = self._reduce(self._carry.reshape(1, -1)) if len(self._carry) else _concat([])
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._push(tail, final=True)
+        while self.max_buckets and self._count > self.max_buckets:
+            self._coarsen(final=True)
+
+        return PeakPyramid(_concat(self._out), self.length, self.sample_rate,
+                           self.base_bucket << self.level, samples=samples)
+
+    def snapshot(self):
+        """Pyramid of the complete output buckets so far (None before the first); the build continues"""
+        if not self._out:
+            return None
+        self._out = [_concat(self._out)]
+        return PeakPyramid(self._out[0], self._count * (self.base_bucket << self.level), self.sample_rate,
+                           self.base_bucket << self.level)
+
+    @staticmethod
+    def _reduce(buckets):
+        return (buckets.min(axis=1),
+                buckets.max(axis=1),
+                np.square(buckets, dtype=np.float64).sum(axis=1))
+
+    def _push(self, buckets, final=False):
+        # Carry the new base buckets up to the current output level
+        for j in range(self.level):
+            parts = [buckets] if self._pending[j] is None else [self._pending[j], buckets]
+            buckets = _concat(parts)
+            self._pending[j] = None
+            if len(buckets[0]) % 2 and not final:
+                buckets, self._pending[j] = _split_last(buckets)
+            buckets = _merge_pairs(buckets)
+
+        if len(buckets[0]):
+            self._out.append(buckets)
+            self._count += len(buckets[0])
+        while not final and self.max_buckets and self._count > self.max_buckets:
+            self._coarsen()
+
+    def _coarsen(self, final=False):
+        buckets = _concat(self._out)
+        pending = None
+        if len(buckets[0]) % 2 and not final:
+            buckets, pending = _split_last(buckets)
+        buckets = _merge_pairs(buckets)
+        self._out = [buckets]
+        self._count = len(buckets[0])
+        self._pending.append(pending)
+        self.level += 1
+
+
+class PeakPyramid:
+    """Min/max/sum-of-squares buckets at power-of-two resolutions"""
+
+    def __init__(self, base, length, sample_rate, base_bucket=BASE_BUCKET, samples=None):
+        self.length = length
+        self.sample_rate = sample_rate
+        self.base_bucket = base_bucket
+        self.samples = samples
+
+        # Level l holds buckets of base_bucket * 2**l samples
+        self.levels = [base]
+        while len(self.levels[-1][0]) > 1:
+            self.levels.append(_merge_pairs(self.levels[-1]))
+
+    @classmethod
+    def from_signal(cls, y, sample_rate, base_bucket=BASE_BUCKET, keep_samples=True):
+        """Build a pyramid from an in-memory (or memory-mapped) mono signal"""
+        builder = PeakPyramidBuilder(sample_rate, base_bucket)
+        builder.add(y)
+        return builder.finish(samples=y if keep_samples else None)
+
+    @classmethod
+    def from_blocks(cls, blocks, sample_rate, base_bucket=BASE_BUCKET, samples=None,
+                    max_buckets=None):
+        """Build a pyramid from an iterable of mono sample blocks"""
+        builder = PeakPyramidBuilder(sample_rate, base_bucket, max_buckets)
+        for block in blocks:
+            builder.add(block)
+        return builder.finish(samples=samples)
+
+    @property
+    def duration(self):
+        return self.length / self.sample_rate if self.sample_rate else 0.0
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for level in self.levels for a in level)
+
+    def query(self, start_sample, end_sample, width, exact=True, grid=None):
+        """
+        Reduce [start_sample, end_sample) into `width` columns.
+
+        With `exact` and the raw samples available, every column covers exactly
+        its share of the range. Otherwise column edges snap outwards to `grid`
+        (a power-of-two multiple of the base bucket, default the base bucket),
+        which gives the same answer for in-memory and streamed pyramids.
+        """
+        n = self.length
+        s0 = int(min(max(start_sample, 0), n))
+        s1 = int(min(max(end_sample, 0), n))
+        if s1 <= s0 or width < 1:
+            empty = np.zeros(0, dtype=np.float32)
+            return {'edges': np.zeros(0, dtype=np.int64), 'min': empty, 'max': empty, 'rms': empty}
+
+        width = int(min(width, s1 - s0))
+        edges = s0 + (np.arange(width + 1, dtype=np.int64) * (s1 - s0)) // width
+        lo = edges[:-1].copy()
+        hi = edges[1:].copy()
+
+        use_raw = exact and self.samples is not None
+        b0 = self.base_bucket
+        grid = b0 if use_raw else max(grid or b0, b0)
+        # A trailing partial bucket counts as whole when a column runs to the end
+        padded_end = -(-n // grid) * grid
+        if not use_raw:
+            lo = (lo // grid) * grid
+            hi = np.minimum(-(-hi // grid) * grid, n)
+        count = hi - lo
+        hi = np.where(hi == n, padded_end, hi)
+
+        acc_min = np.full(width, np.inf, dtype=np.float32)
+        acc_max = np.full(width, -np.inf, dtype=np.float32)
+        acc_sq = np.zeros(width, dtype=np.float64)
+
+        spp = (s1 - s0) / width
+        top = int(np.floor(np.log2(spp / b0))) if spp >= b0 else 0
+        top = min(max(top, 0), len(self.levels) - 1)
+
+        # Each column is a head interval and, once split, a tail interval
+        head_lo, head_hi = lo, hi
+        tail_lo, tail_hi = hi.copy(), hi.copy()
+        for level in range(top, -1, -1):
+            bucket = b0 << level
+            mins, maxs, sumsq = self.levels[level]
+
+            a = -(-tail_lo // bucket)
+            b = tail_hi // bucket
+            self._combine(mins, maxs, sumsq, a, b, acc_min, acc_max, acc_sq)
+            tail_lo = np.where(a < b, b * bucket, tail_lo)
+
+            a = -(-head_lo // bucket)
+            b = head_hi // bucket
+            self._combine(mins, maxs, sumsq, a, b, acc_min, acc_max, acc_sq)
+            split = (a < b) & (tail_lo == tail_hi)
+            tail_lo = np.where(split, b * bucket, tail_lo)
+            tail_hi = np.where(split, head_hi, tail_hi)
+            head_hi = np.where(a < b, a * bucket, head_hi)
+
+        if use_raw:
+            self._combine_raw(head_lo, np.minimum(head_hi, n), acc_min, acc_max, acc_sq)
+            self._combine_raw(tail_lo, np.minimum(tail_hi, n), acc_min, acc_max, acc_sq)
+
+        rms = np.sqrt(acc_sq / np.maximum(count, 1)).astype(np.float32)
+        return {'edges': edges, 'min': acc_min, 'max': acc_max, 'rms': rms}
+
+    def query_seconds(self, start, end, width, exact=True):
+        """Same as `query` with the range given in seconds"""
+        sr = self.sample_rate
+        return self.query(int(np.floor(start * sr)), int(np.ceil(end * sr)), width, exact)
+
+    @staticmethod
+    def _combine(mins, maxs, sumsq, a, b, acc_min, acc_max, acc_sq):
+        """Fold the whole buckets [a, b) of one level into each column"""
+        b = np.minimum(b, len(mins))  # Buckets past the end of the data are empty
+        has = a < b
+        if not has.any():
+            return
+        # Interleave the ranges so reduceat reduces [a_i, b_i) at even slots;
+        # the appended identity element makes b_i == len(level) a valid index
+        idx = np.empty(2 * int(has.sum()), dtype=np.int64)
+        idx[0::2] = a[has]
+        idx[1::2] = b[has]
+        mins = np.append(mins, np.float32(np.inf))
+        maxs = np.append(maxs, np.float32(-np.inf))
+        sumsq = np.append(sumsq, 0.0)
+        acc_min[has] = np.minimum(acc_min[has], np.minimum.reduceat(mins, idx)[0::2])
+        acc_max[has] = np.maximum(acc_max[has], np.maximum.reduceat(maxs, idx)[0::2])
+        acc_sq[has] += np.add.reduceat(sumsq, idx)[0::2]
+
+    def _combine_raw(self, lo, hi, acc_min, acc_max, acc_sq):
+        """Fold the raw samples [lo, hi) (shorter than one base bucket) into each column"""
+        span = hi - lo
+        longest = int(span.max()) if len(span) else 0
+        if longest <= 0:
+            return
+        idx = lo[:, None] + np.arange(longest)[None, :]
+        valid = idx < hi[:, None]
+        values = np.asarray(self.samples[np.where(valid, idx, 0).ravel()],
+                            dtype=np.float32).reshape(idx.shape)
+        acc_min[:] = np.minimum(acc_min, np.where(valid, values, np.inf).min(axis=1))
+        acc_max[:] = np.maximum(acc_max, np.where(valid, values, -np.inf).max(axis=1))
+        acc_sq += np.where(valid, np.square(values, dtype=np.float64), 0.0).sum(axis=1)
+
+
+def overview(pyramid, points=2000, as_lists=True):
+    """
+    Fixed-width overview of the whole file in the `generate_waveform_data` shape.
+
+    With `as_lists=False` the arrays stay NumPy arrays and `times` is left out,
+    for callers that pack them into a binary payload.
+    """
+    # Snap to the grid a streamed build would have, so both modes agree exactly
+    grid = stream_bucket(pyramid.length, pyramid.base_bucket)
+    peaks = pyramid.query(0, pyramid.length, points, exact=False, grid=grid)
+    mins, maxs = peaks['min'], peaks['max']
+    # Signed peak with the larger magnitude, so single-line plots keep transients
+    amplitudes = np.where(np.abs(maxs) >= np.abs(mins), maxs, mins)
+    buckets = max(len(mins), 1)
+    result = {
+        'amplitudes': amplitudes,
+        'peaks': {
+            'min': mins,
+            'max': maxs,
+            'rms': peaks['rms'],
+        },
+        'duration': pyramid.duration,
+        'sample_rate': pyramid.sample_rate,
+        'original_length': pyramid.length,
+        'samples_per_bucket': pyramid.length / buckets,
+    }
+    if not as_lists:
+        return result
+    result['times'] = (peaks['edges'][:-1] / pyramid.sample_rate).tolist()
+    result['amplitudes'] = amplitudes.tolist()
+    result['peaks'] = {name: values.tolist() for name, values in result['peaks'].items()}
+    return result
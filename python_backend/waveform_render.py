@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Fast waveform rasterizer.
+
+Draws a waveform straight from per-pixel-column min/max/RMS peaks into a NumPy
+RGB buffer and encodes it as PNG, so render time depends on the image size
+rather than the number of samples. Uses the same themes and red split
+markers as the matplotlib rendering.
+
+Markers are drawn separately from the waveform, so a rendered base image can
+be cached and new split points composited onto a copy of it.
+"""
+
+import base64
+import struct
+import zlib
+
+import numpy as np
+
+THEME = {
+    'background': '#1f2937',
+    'plot': '#374151',
+    'waveform': '#4F46E5',
+    'marker': '#EF4444',
+    'text': '#ffffff',
+}
+THEMES = {
+    'dark': THEME,
+    'light': {
+        'background': '#ffffff',
+        'plot': '#f3f4f6',
+        'waveform': '#4F46E5',
+        'marker': '#DC2626',
+        'text': '#111827',
+    },
+}
+
+PADDING = 8  # Background border around the plot area, in pixels
+
+# 3x5 bitmap digits for split point labels
+DIGITS = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '010', '010', '010'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+}
+
+
+def hex_to_rgb(color):
+    color = color.lstrip('#')
+    return np.array([int(color[i:i + 2], 16) for i in (0, 2, 4)], dtype=np.float32)
+
+
+def blend(image, mask, color, alpha):
+    """Alpha-blend `color` into `image` wherever `mask` is set"""
+    image[mask] = image[mask] * (1 - alpha) + hex_to_rgb(color) * alpha
+
+
+def plot_rect(width, height):
+    """(x0, y0, x1, y1) of the plot area inside the padded image"""
+    return PADDING, PADDING, width - PADDING, height - PADDING
+
+
+def render_base(mins, maxs, rms, width, height, theme=THEME):
+    """Render the waveform without markers; one peak column per plot pixel"""
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:] = hex_to_rgb(theme['background'])
+    x0, y0, x1, y1 = plot_rect(width, height)
+    image[y0:y1, x0:x1] = hex_to_rgb(theme['plot'])
+
+    plot_h = y1 - y0
+    columns = min(len(mins), x1 - x0)
+    if columns == 0:
+        return image
+
+    def to_row(values):
+        # Amplitude +1 maps to the top row, -1 to the bottom row
+        values = np.clip(np.asarray(values[:columns], dtype=np.float32), -1, 1)
+        return np.round((1 - values) / 2 * (plot_h - 1)).astype(np.int32)
+
+    rows = np.arange(plot_h, dtype=np.int32)[:, None]
+    zero = to_row(np.zeros(columns))
+    # Peak envelope always touches the zero line, like fill_between(y, 0)
+    top = np.minimum(to_row(maxs), zero)
+    bottom = np.maximum(to_row(mins), zero)
+    envelope = (rows >= top[None, :]) & (rows <= bottom[None, :])
+    core = (rows >= to_row(rms)[None, :]) & (rows <= to_row(-np.asarray(rms))[None, :])
+
+    area = image[y0:y1, x0:x0 + columns]
+    blend(area, envelope, theme['waveform'], 0.55)
+    blend(area, core & envelope, theme['waveform'], 0.8)
+    return image
+
+
+def draw_markers(image, split_points, duration, theme=THEME, label_row=None, rect=None):
+    """
+    Draw numbered split point markers onto a rendered image in place.
+
+    `rect` is the (x0, y0, x1, y1) pixel area spanning 0..duration, by
+    default the fast renderer's plot area. Only the marker columns and
+    labels are touched, so this costs the same for any image size.
+    """
+    if not split_points or duration <= 0:
+        return image
+    height, width, _ = image.shape
+    x0, y0, x1, y1 = rect or plot_rect(width, height)
+    if label_row is None:
+        label_row = y0 + int(0.1 * (y1 - y0))
+    color = hex_to_rgb(theme['marker'])
+
+    for i, point in enumerate(split_points):
+        if not 0 <= point <= duration:
+            continue
+        x = x0 + int(round(point / duration * (x1 - x0 - 1)))
+        line = image[y0:y1, max(x - 1, x0):min(x + 1, x1)]
+        line[:] = line * 0.2 + color * 0.8
+        draw_label(image, str(i + 1), x + 4, label_row, theme['marker'])
+    return image
+
+
+def draw_label(image, text, x, y, color, scale=3):
+    """Draw digits with the bitmap font, top-left corner at (x, y)"""
+    height, width, _ = image.shape
+    rgb = hex_to_rgb(color)
+    for c, char in enumerate(text):
+        glyph = np.array([[bit == '1' for bit in row] for row in DIGITS[char]])
+        glyph = np.kron(glyph, np.ones((scale, scale), dtype=bool))
+        gx = x + c * 4 * scale
+        gh, gw = glyph.shape
+        if gx < 0 or y < 0 or gx + gw > width or y + gh > height:
+            continue
+        image[y:y + gh, gx:gx + gw][glyph] = rgb
+
+
+def encode_png(image):
+    """Encode an (height, width, 3) image as PNG bytes"""
+    pixels = np.clip(np.round(image), 0, 255).astype(np.uint8)
+    height, width, _ = pixels.shape
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+
+def to_data_uri(png):
+    return f"data:image/png;base64,{base64.b64encode(png).decode()}"
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+ZIP archives written straight to an HTTP response.
+
+`ZipStream` wraps `zipfile` around a write-only sink, so entries are written
+with data descriptors (sizes and CRC after the data) and nothing needs to be
+seeked back into. Each `add_*` call is a generator of the archive bytes for
+that entry, produced a chunk at a time, so memory stays at one chunk per file
+and no archive is ever assembled on disk.
+"""
+
+import io
+import os
+import posixpath
+import re
+import time
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+UNSAFE_CHARS_RE = re.compile(r'[\x00-\x1f\\:*?"<>|]')
+
+
+class _Sink(io.RawIOBase):
+    """Write-only, unseekable buffer drained after every write batch"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def safe_arcname(name):
+    """Relative archive path with no absolute, parent or control-character parts"""
+    parts = []
+    for part in name.replace('\\', '/').split('/'):
+        part = UNSAFE_CHARS_RE.sub('_', part).strip()
+        if part and part not in ('.', '..'):
+            parts.append(part)
+    return '/'.join(parts) or 'unnamed'
+
+
+class ZipStream:
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', allowZip64=True)
+        self._names = set()
+        self.bytes_written = 0
+
+    def _info(self, arcname, compress_type):
+        info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+        info.compress_type = compress_type
+        info.external_attr = 0o644 << 16  # rw-r--r-- when extracted
+        return info
+
+    def _unique(self, name):
+        name = safe_arcname(name)
+        stem, ext = posixpath.splitext(name)
+        candidate, n = name, 1
+        while candidate in self._names:
+            n += 1
+            candidate = f"{stem} ({n}){ext}"
+        self._names.add(candidate)
+        return candidate
+
+    def _drain(self):
+        data = self._sink.drain()
+        self.bytes_written += len(data)
+        return data
+
+    def add_file(self, arcname, path, compress=False):
+        """
+        Stream the file at `path` into the archive.
+
+        `name = yield from stream.add_file(...)` gives the name actually used
+        (made safe, and numbered if it was taken).
+        """
+        arcname = self._unique(arcname)
+        info = self._info(arcname, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        info.file_size = os.path.getsize(path)  # Lets zipfile pick ZIP64 up front for big files
+        with open(path, 'rb') as src, self._zip.open(info, 'w') as dest:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                yield self._drain()
+        yield self._drain()
+        return arcname
+
+    def add_bytes(self, arcname, data):
+        arcname = self._unique(arcname)
+        info = self._info(arcname, zipfile.ZIP_DEFLATED)
+        self._zip.writestr(info, data)
+        yield self._drain()
+        return arcname
+
+    def close(self):
+        """The central directory that ends the archive"""
+        self._zip.close()
+        yield self._drain()